@@ -0,0 +1,142 @@
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import perf
+
+# --- 投稿アカウントシートの共通データ層 ---
+# get_all_values() の生データ（ヘッダー行込み）を、アカウントごとに1度だけ型付きの DataFrame に変換する。
+# 登録アプリ・編集アプリの両方がこの構造を使い、店舗アカウント状況の集計（account_summary）もここから作る。
+
+ACCOUNT_OPTIONS = ["A", "B", "C", "D"]
+SHEET_MAP = {opt: f"投稿{opt}アカウント" for opt in ACCOUNT_OPTIONS}
+DF_COLS = ["エリア", "店名", "媒体", "投稿時間", "女の子の名前", "タイトル", "本文"]
+KEY_COLS = ["エリア", "店名", "媒体", "投稿時間", "女の子の名前"]   # 前後の空白を落として比較に使う列
+CATEGORY_COLS = ["アカウント", "エリア", "店名", "媒体"]
+FRAME_COLS = ["アカウント", "__row__"] + DF_COLS + ["__id__"]
+# 行ID（日記と画像を結びつける短いID）を書く列。H列は投稿システムの状況欄なので、離れた Z 列（非表示）を使う
+ROW_ID_COL = 25
+ROW_ID_LETTER = "Z"
+
+_frame_cache = {}
+_frame_lock = threading.Lock()
+
+
+# --- 複数シートの同時読み込み ---
+def _a1(sheet_name, cell_range=None):
+    quoted = "'" + sheet_name.replace("'", "''") + "'"
+    return f"{quoted}!{cell_range}" if cell_range else quoted
+
+
+def _pad(rows):
+    """values API は行末の空セルを省くので、get_all_values() と同じ長方形に揃える"""
+    width = max((len(r) for r in rows), default=0)
+    return [r + [""] * (width - len(r)) for r in rows]
+
+
+def fan_out(fn, items, max_workers=8):
+    """items を並列に fn へ渡して {item: 結果} を返す（失敗した item は例外オブジェクトが入る）"""
+    items = list(items)
+    if not items:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+        # 計測（perf）の集計先を引き継ぐため、呼び出し元のコンテキストをタスクごとに複製して実行
+        futures = {item: ex.submit(contextvars.copy_context().run, fn, item) for item in items}
+    results = {}
+    for item, fut in futures.items():
+        try:
+            results[item] = fut.result()
+        except Exception as e:
+            results[item] = e
+    return results
+
+
+RETRY_WAITS = (2, 4, 8, 16, 32)   # 429（API制限）・一時的なエラーのときに待つ秒数
+
+
+def _is_transient(e):
+    return any(c in str(e) for c in ("429", "500", "502", "503", "Connection"))
+
+
+def read_sheets(spreadsheet, sheet_names, cell_range=None):
+    """同じスプレッドシート内の複数シートを values_batchGet 1回で読む。{シート名: 行リスト}
+    429（API制限）・一時的なエラーは待って一括取得をやり直す（並列で読み直すと制限をさらに超えるため）。
+    存在しないシートがあるなど、それ以外の理由で失敗したときだけシートごとに並列で読む（失敗分は例外オブジェクト）"""
+    sheet_names = list(sheet_names)
+    for wait in RETRY_WAITS + (None,):
+        try:
+            res = perf.call("sheets.values_batch_get", ",".join(sheet_names), spreadsheet.values_batch_get,
+                            [_a1(n, cell_range) for n in sheet_names])
+            return {n: _pad(vr.get("values", [])) for n, vr in zip(sheet_names, res.get("valueRanges", []))}
+        except Exception as e:
+            if not _is_transient(e):
+                break
+            if wait is None:
+                raise
+            time.sleep(wait)
+
+    def one(name):
+        ws = perf.call("sheets.worksheet", name, spreadsheet.worksheet, name)
+        if cell_range:
+            return _pad(list(perf.call("sheets.get", f"{name}!{cell_range}", ws.get, cell_range)))
+        return perf.call("sheets.get_all_values", name, ws.get_all_values)
+    return fan_out(one, sheet_names)
+
+
+def empty_frame():
+    return _categorize(pd.DataFrame({c: pd.Series(dtype=object) for c in FRAME_COLS}).astype({"__row__": int}))
+
+
+def _categorize(df):
+    return df.astype({c: "category" for c in CATEGORY_COLS})
+
+
+def _build(code, rows):
+    body = rows[1:] if rows else []
+    if not body:
+        return empty_frame()
+    raw = pd.DataFrame(body)
+    df = raw.reindex(columns=range(len(DF_COLS))).fillna("").astype(str)
+    df.columns = DF_COLS
+    df["__id__"] = raw[ROW_ID_COL].fillna("").astype(str).str.strip() if ROW_ID_COL in raw.columns else ""
+    df.insert(0, "__row__", range(2, len(body) + 2))   # スプレッドシート上の行番号（ヘッダーが1行目）
+    df.insert(0, "アカウント", code)
+    for c in KEY_COLS:
+        df[c] = df[c].str.strip()
+    # 7列すべて空の行は除外（タイトル・本文は空白だけでも空扱い）
+    filled = df[KEY_COLS].ne("").any(axis=1) | df["タイトル"].str.strip().ne("") | df["本文"].str.strip().ne("")
+    return _categorize(df[filled].reset_index(drop=True))
+
+
+def frame_for(code, rows, slot=None):
+    """1アカウント分の DataFrame。同じ生データ（同一オブジェクト）に対しては変換結果を使い回す。
+    1アカウントが複数のシート（シャード）にあるときは slot で置き場所ごとにキャッシュを分ける。
+    返り値は共有されるので、呼び出し側で列の追加などの変更はしないこと"""
+    slot = code if slot is None else slot
+    key = (slot, id(rows))
+    with _frame_lock:
+        hit = _frame_cache.get(key)
+        if hit is not None and hit[0] is rows:
+            return hit[1]
+    df = _build(code, rows)
+    with _frame_lock:
+        for k in [k for k in _frame_cache if k[0] == slot]:
+            del _frame_cache[k]
+        _frame_cache[key] = (rows, df)
+    return df
+
+
+def combine_frames(frames):
+    """frame_for の結果（複数）を1つの DataFrame にまとめる"""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return empty_frame()
+    if len(frames) == 1:
+        return frames[0]
+    # アカウントごとにカテゴリが異なるので、連結後にカテゴリを作り直す
+    df = pd.concat([f.astype({c: str for c in CATEGORY_COLS}) for f in frames], ignore_index=True)
+    return _categorize(df)
+
@@ -0,0 +1,121 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import perf
+import account_data
+from retire_jobs import contiguous_blocks
+
+# --- 店舗アカウント状況の集計シート ---
+# 「アカウント × エリア × 店名 × 媒体 → 件数」を投稿アカウントと同じスプレッドシートの集計用シートに持ち、
+# 状況表示はこのシート（数十セル）だけを読む。登録・落ち店移動のたびに差分で更新し、
+# ずれたときは全シートから再計算できる。
+
+SUMMARY_SHEET = "店舗アカウント集計"
+HEADER = ["アカウント", "エリア", "店名", "媒体", "件数", "更新日時"]
+KEY_COLS = ["アカウント", "エリア", "店名", "媒体"]
+JST = timezone(timedelta(hours=9))
+
+_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _worksheet(spreadsheet):
+    try:
+        return perf.call("sheets.worksheet", SUMMARY_SHEET, spreadsheet.worksheet, SUMMARY_SHEET)
+    except Exception:
+        ws = perf.call("sheets.add_worksheet", SUMMARY_SHEET, spreadsheet.add_worksheet, title=SUMMARY_SHEET, rows=200, cols=len(HEADER))
+        perf.call("sheets.update", SUMMARY_SHEET, ws.update, range_name="A1", values=[HEADER])
+        return ws
+
+
+def rows_from_frame(df):
+    """account_data の DataFrame から集計行 [[アカウント, エリア, 店名, 媒体, 件数, 更新日時], ...] を作る"""
+    if df.empty:
+        return []
+    counts = df.groupby(KEY_COLS, observed=True).size()
+    now = _now()
+    return [[str(a), str(ar), str(s), str(m), int(n), now] for (a, ar, s, m), n in counts.items() if n > 0]
+
+
+def to_summary(rows):
+    """集計行から表示用の (アカウント別件数, {アカウント: {エリア: ["媒体 : 店名", ...]}}) を作る"""
+    counts, summary = {}, {}
+    for r in rows:
+        r = (list(r) + [""] * len(HEADER))[:len(HEADER)]
+        try:
+            n = int(str(r[4]).strip() or 0)
+        except ValueError:
+            continue
+        if not r[0] or n <= 0:
+            continue
+        counts[r[0]] = counts.get(r[0], 0) + n
+        labels = summary.setdefault(r[0], {}).setdefault(r[1], [])
+        label = f"{r[3]} : {r[2]}"
+        if label not in labels:
+            labels.append(label)
+    for areas in summary.values():
+        for area in areas:
+            areas[area].sort()
+    return counts, summary
+
+
+def read_rows(spreadsheet):
+    """集計シートの行（ヘッダー除く）。シートが無い・空なら None"""
+    rows = account_data.read_sheets(spreadsheet, [SUMMARY_SHEET]).get(SUMMARY_SHEET)
+    if not isinstance(rows, list) or len(rows) <= 1:
+        return None
+    return rows[1:]
+
+
+def recompute(spreadsheet, df):
+    """全アカウントの DataFrame から集計シートを作り直す"""
+    rows = rows_from_frame(df)
+    with _lock:
+        ws = _worksheet(spreadsheet)
+        perf.call("sheets.clear", SUMMARY_SHEET, ws.clear)
+        perf.call("sheets.update", SUMMARY_SHEET, ws.update, range_name="A1", values=[HEADER] + rows)
+    return rows
+
+
+def apply_delta(spreadsheet, changes):
+    """changes = {(アカウント, エリア, 店名, 媒体): 増減件数}。該当行の件数を書き換え、無ければ追加、0件以下なら削除"""
+    changes = {tuple(str(v).strip() for v in k): d for k, d in changes.items() if d}
+    if not changes:
+        return
+    with _lock:
+        ws = _worksheet(spreadsheet)
+        rows = perf.call("sheets.get_all_values", SUMMARY_SHEET, ws.get_all_values)
+        now = _now()
+        updates, deletes = [], []
+        for i, r in enumerate(rows[1:], 2):
+            key = tuple(str(v).strip() for v in (r + [""] * 4)[:4])
+            if key not in changes:
+                continue
+            try:
+                n = int(str(r[4]).strip() or 0) + changes.pop(key)
+            except (ValueError, IndexError):
+                n = changes.pop(key)
+            if n > 0:
+                updates.append({"range": f"E{i}:F{i}", "values": [[n, now]]})
+            else:
+                deletes.append(i)
+        if updates:
+            perf.call("sheets.batch_update", SUMMARY_SHEET, ws.batch_update, updates)
+        for start, end in contiguous_blocks(deletes):
+            perf.call("sheets.delete_rows", SUMMARY_SHEET, ws.delete_rows, start, end)
+        new_rows = [list(k) + [d, now] for k, d in changes.items() if d > 0]
+        if new_rows:
+            perf.call("sheets.append_rows", SUMMARY_SHEET, ws.append_rows, new_rows, value_input_option='USER_ENTERED')
+
+
+def remove_store(spreadsheet, acc, area, store):
+    """落ち店移動後：アカウント acc・エリア area の店舗 store の行をすべて消す（同名店舗が別エリアにあっても残す）"""
+    with _lock:
+        ws = _worksheet(spreadsheet)
+        rows = perf.call("sheets.get_all_values", SUMMARY_SHEET, ws.get_all_values)
+        targets = [i for i, r in enumerate(rows[1:], 2) if len(r) >= 3 and r[0].strip() == acc and r[1].strip() == area.strip() and r[2].strip() == store.strip()]
+        for start, end in contiguous_blocks(targets):
+            perf.call("sheets.delete_rows", SUMMARY_SHEET, ws.delete_rows, start, end)
@@ -1,31 +1,39 @@
+import perf
+perf.STARTUP.begin()
 import os
 import re
 import pandas as pd
-from datetime import datetime, time
 import streamlit as st
-import gspread
-from google.oauth2.service_account import Credentials
-from google.cloud import bigquery
+perf.begin_rerun(st, "auto-post-manual")
 from datetime import datetime, time, timedelta, timezone
+import transport
+import registration
+import sheet_routing
 
 # --- ページ設定 ---
 st.set_page_config(page_title="自動日記運用マニュアル", layout="wide")
 
 # --- 0. Googleスプレッドシートへの接続設定 (追加箇所) ---
-try:
-    scope = [
-        'https://www.googleapis.com/auth/spreadsheets',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    credentials = Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"],
-        scopes=scope
-    )
-    GC = gspread.authorize(credentials)
-except Exception as e:
+# 認証とgspreadの読み込みは「投稿状況チェック」を押したときまで遅らせる（マニュアル表示を速くする）
+# 起動時間の内訳の auth / first_api も、そのとき（初回だけ）記録する
+POST_SHEET_ID = "1sEzw59aswIlA-8_CTyUrRBLN7OnrRIJERKUZ_bELMrY"
+@st.cache_resource(ttl=3600)
+def get_gspread_client():
+    # 登録・編集アプリと同じ認証情報と接続プールを使う
+    return transport.gspread_client(st.secrets["gcp_service_account"])
+
+@st.cache_data(ttl=sheet_routing.ROUTING_MAX_AGE)
+def get_routing_table(default_sheet_id):
+    # 投稿アカウントシートの置き場所（登録・編集アプリと同じ対応表。無ければ従来の1スプレッドシート）
+    gcs = transport.storage_client(st.secrets["gcp_service_account"])
+    return sheet_routing.load_table(gcs.bucket(registration.GCS_BUCKET_NAME), default_sheet_id)
+
+if "gcp_service_account" not in st.secrets:
     st.error("Googleスプレッドシートの認証設定（Secrets）が見つかりません。")
     st.stop()
 
+perf.STARTUP.mark("import")
+
 # --- モダンUIデザイン（文字を大きく、PCで見やすく） ---
 st.markdown("""
     <style>
@@ -93,21 +101,30 @@ with tab_manual:
         status_color = "normal"
 
     if st.button("最新の投稿状況をチェックする"):
-        spreadsheet_id = "1sEzw59aswIlA-8_CTyUrRBLN7OnrRIJERKUZ_bELMrY"
-        target_sheets = ["投稿Aアカウント", "投稿Bアカウント", "投稿Cアカウント", "投稿Dアカウント"]
-        
         status_summary = []
         any_critical_error = False # 3時間停止があるかどうかのフラグ
         base_seconds = now_jst.hour * 3600 + now_jst.minute * 60 + now_jst.second
 
         with st.spinner('全ログをスキャンして稼働状況を判定中...'):
             try:
-                sh_status = GC.open_by_key(spreadsheet_id)
+                perf.STARTUP.restart_clock()   # ボタンを押すまでの待ち時間は起動時間に入れない
+                GC = get_gspread_client()
+                perf.STARTUP.mark("auth")
+                loaded = get_routing_table(POST_SHEET_ID)
+                router = sheet_routing.SheetRouter(loaded["table"], loaded["generation"])
+                locations = router.all_locations()
+                # スプレッドシート（シャード）ごとに1回のリクエストでまとめて取得し、シャード同士は並列（失敗時はシートごとに並列取得）
+                sheet_values = sheet_routing.read_locations(
+                    lambda sid: perf.call("sheets.open_by_key", sid, GC.open_by_key, sid), locations, 'A1:J1500')
+                perf.STARTUP.mark("first_api")
+                perf.STARTUP.finish("auto-post-manual")
                 
-                for name in target_sheets:
+                for loc in locations:
+                    # 1アカウントが複数のシャードにあるときは、シャード名も付けて別々に判定する
+                    name = loc.worksheet if len(router.locations(loc.account)) == 1 else f"{loc.worksheet}（{loc.shard}）"
                     try:
-                        ws = sh_status.worksheet(name)
-                        raw_data = ws.get('A1:J1500') 
+                        raw_data = sheet_values.get(loc)
+                        if isinstance(raw_data, Exception): raise raw_data
                         
                         best_row = None
                         min_diff = float('inf')
@@ -340,24 +357,7 @@ with tab_billing:
     </div>
     """, unsafe_allow_html=True)
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+perf.STARTUP.mark("render")   # 起動時間のログは、初回の投稿状況チェックで auth / first_api まで測ってから出す
+perf.render_startup_report(st)
+perf.render_trace_panel(st)
+transport.render_pool_panel(st)
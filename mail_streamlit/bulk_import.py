@@ -0,0 +1,366 @@
+"""写メ日記の一括登録コマンド
+
+CSV/TSV（エリア, 店名, 媒体, 投稿時間, 女の子の名前, タイトル, 本文）と画像フォルダから、
+登録アプリのフォームと同じ形でスプレッドシートとGCSへ登録する。
+画像は「{投稿時間}_{女の子の名前}.{拡張子}」の名前で画像フォルダに置いておく。
+
+    python bulk_import.py diaries.csv --images ./images --account A
+    python bulk_import.py diaries.tsv --images ./images --account B --dry-run
+    python bulk_import.py diaries.csv --images ./images --account A --credentials logins.csv
+
+ログイン情報は店舗ごとに、ログイン情報シートと同じ列（エリア, 店名, 媒体, ログインID, パスワード）の
+CSV/TSV を --credentials で渡す。店舗が1つだけなら --login-id / --login-pw でもよい。
+ログイン情報シートに既に行がある店舗はそのまま（追加しない）。
+
+途中で止まっても同じコマンドを再実行すれば、アップロード済みの画像と登録済みの行は飛ばして続きから進む。
+"""
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+import account_data
+import account_summary
+import content_check
+import registration
+import sheet_routing
+
+REQUIRED_COLUMNS = account_data.DF_COLS
+CREDENTIAL_COLUMNS = ["エリア", "店名", "媒体", "ログインID", "パスワード"]   # ログイン情報シートと同じ並び
+
+
+# --- ローカル実行用（--dry-run）の保存先 ---
+class LocalBlob:
+    def __init__(self, root, name):
+        self.path = os.path.join(root, name)
+
+    def upload_from_string(self, data, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+
+class LocalBucket:
+    """GCSバケットの代わりにローカルフォルダへ書き出す"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def blob(self, name):
+        return LocalBlob(self.root, name)
+
+
+class LocalWorksheet:
+    """シートの代わりに CSV へ追記する"""
+
+    def __init__(self, path):
+        self.path = path
+        self.title = os.path.basename(path)
+
+    def append_rows(self, rows, value_input_option=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows(rows)
+
+    def append_row(self, row, value_input_option=None):
+        self.append_rows([row])
+
+    def get_all_values(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            return list(csv.reader(f))
+
+    def col_values(self, col):
+        values = [r[col - 1] if len(r) >= col else "" for r in self.get_all_values()]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+
+# --- 入力の読み込みと検証 ---
+def read_table(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        text = f.read()
+    delimiter = "\t" if path.lower().endswith(".tsv") or ("\t" in text.splitlines()[0] if text else False) else ","
+    reader = csv.DictReader(text.splitlines(), delimiter=delimiter)
+    missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        raise SystemExit(f"❌ 列が足りません: {', '.join(missing)}")
+    return [{c: (r.get(c) or "").strip() if c not in ("タイトル", "本文") else (r.get(c) or "") for c in REQUIRED_COLUMNS}
+            for r in reader], text
+
+
+def read_credentials(path):
+    """{(エリア, 店名, 媒体): (ログインID, パスワード)}"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        text = f.read()
+    delimiter = "\t" if path.lower().endswith(".tsv") or ("\t" in text.splitlines()[0] if text else False) else ","
+    reader = csv.DictReader(text.splitlines(), delimiter=delimiter)
+    missing = [c for c in CREDENTIAL_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        raise SystemExit(f"❌ ログイン情報ファイルの列が足りません: {', '.join(missing)}")
+    return {tuple((r.get(c) or "").strip() for c in CREDENTIAL_COLUMNS[:3]): ((r.get("ログインID") or "").strip(), (r.get("パスワード") or "").strip())
+            for r in reader}
+
+
+def store_keys(entries):
+    """入力に出てくる店舗 (エリア, 店名, 媒体) を出てきた順に"""
+    return list(dict.fromkeys((e["エリア"], e["店名"], e["媒体"]) for e in entries))
+
+
+def store_credentials(entries, credentials, login_id, login_pw):
+    """店舗ごとのログイン情報 {(エリア, 店名, 媒体): (ID, パスワード)}。--login-id / --login-pw は店舗が1つのときだけ使う
+    （複数の店舗に同じログイン情報を入れないように）"""
+    stores = store_keys(entries)
+    if (login_id or login_pw) and len(stores) > 1:
+        raise SystemExit(f"❌ --login-id / --login-pw は店舗が1つのときだけ使えます（{len(stores)}店舗）。--credentials で店舗ごとに指定してください")
+    found = {k: credentials[k] for k in stores if k in credentials}
+    if (login_id or login_pw) and stores:
+        found.setdefault(stores[0], (login_id, login_pw))
+    return found
+
+
+def index_images(image_dir):
+    """{"投稿時間_女の子の名前": ファイルパス}"""
+    found = {}
+    for name in os.listdir(image_dir):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in registration.IMAGE_EXTS:
+            found[stem.strip()] = os.path.join(image_dir, name)
+    return found
+
+
+def validate(entries, images, allow_missing_images):
+    """登録前に全件をチェックし、(エラー, 警告) のリストを返す（エラーが1件でもあれば何も登録しない）"""
+    errors, warnings = [], []
+    seen = set()
+    for i, e in enumerate(entries, 2):
+        where = f"{i}行目"
+        for c in ("エリア", "店名", "投稿時間", "女の子の名前"):
+            if not e[c]:
+                errors.append(f"{where}: {c} が空です")
+        if e["媒体"] not in registration.MEDIA_OPTIONS:
+            errors.append(f"{where}: 媒体は {' / '.join(registration.MEDIA_OPTIONS)} のどれかにしてください（{e['媒体']!r}）")
+        if e["投稿時間"] and not registration.is_valid_post_time(e["投稿時間"]):
+            errors.append(f"{where}: 投稿時間 {e['投稿時間']!r} を時刻として読めません")
+        key = (e["エリア"], e["店名"], e["投稿時間"], e["女の子の名前"])
+        if key in seen:
+            errors.append(f"{where}: 同じ店舗・時間・名前の行が重複しています")
+        seen.add(key)
+        if not allow_missing_images and f"{e['投稿時間']}_{e['女の子の名前']}" not in images:
+            errors.append(f"{where}: 画像 {e['投稿時間']}_{e['女の子の名前']}.* が見つかりません")
+    # 禁止語はエラー、文字数の目安超え・タイトル空欄は警告（投稿時間の形式は上でチェック済み）
+    for i, kind, detail in content_check.scan_entries(entries):
+        if kind == "投稿時間の形式":
+            continue
+        (errors if kind in content_check.BLOCKING_KINDS else warnings).append(f"{i + 2}行目: {kind}（{detail}）")
+    return errors, warnings
+
+
+# --- 再開用の進捗ファイル ---
+def load_state(path, fingerprint):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("fingerprint") == fingerprint:
+            return state
+        print("⚠️ 入力内容が前回と違うため、進捗ファイルを作り直します。")
+    return {"fingerprint": fingerprint, "uploaded": [], "rows_appended": 0, "summary_done": False, "status_done": []}
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# --- 接続先 ---
+def connect(args):
+    """(バケット, エリア → (置き場所のキー, スプレッドシート, シート) の関数, ログイン情報シート, ハッシュ索引, 集計用スプレッドシート)"""
+    if args.dry_run:
+        root = args.local_out
+        sheet = sheet_routing.sheet_name(args.account)
+        ws_main = LocalWorksheet(os.path.join(root, "spreadsheet", f"{sheet}.csv"))
+        return (LocalBucket(os.path.join(root, registration.GCS_BUCKET_NAME)),
+                lambda area: (sheet, None, ws_main),
+                LocalWorksheet(os.path.join(root, "status", f"{sheet}.csv")),
+                None, None)
+    import tomllib
+    import transport
+    from image_hash import ImageHashIndex
+    with open(args.secrets, "rb") as f:
+        secrets = tomllib.load(f)
+    info = secrets["gcp_service_account"]
+    gc = transport.gspread_client(info)
+    bucket = transport.storage_client(info).bucket(registration.GCS_BUCKET_NAME)
+    # 書き込み先はアプリと同じ対応表（アカウント・エリア → スプレッドシート）で決める
+    router = sheet_routing.load(bucket, secrets["google_resources"]["spreadsheet_id"])
+    if args.account not in router.accounts:
+        raise SystemExit(f"❌ アカウント {args.account} は対応表にありません（{' / '.join(router.accounts)}）")
+    ws_status = gc.open_by_key(router.status_id).worksheet(router.sheet_map[args.account])
+    opened = {}
+
+    def main_ws(area):
+        loc = router.location(args.account, area)
+        if loc not in opened:
+            sh = gc.open_by_key(loc.spreadsheet_id)
+            opened[loc] = (loc.snapshot_key, sh, sh.worksheet(loc.worksheet))
+        return opened[loc]
+
+    return bucket, main_ws, ws_status, ImageHashIndex(bucket), gc.open_by_key(router.home_id)
+
+
+def main(argv=None):
+    default_secrets = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".streamlit", "secrets.toml")
+    p = argparse.ArgumentParser(description="写メ日記をCSV/TSVと画像フォルダから一括登録します。")
+    p.add_argument("table", help="エリア/店名/媒体/投稿時間/女の子の名前/タイトル/本文 の列を持つ CSV または TSV")
+    p.add_argument("--images", required=True, help="「{投稿時間}_{女の子の名前}.{拡張子}」の画像を置いたフォルダ")
+    p.add_argument("--account", required=True, help="投稿アカウント（A〜D、または対応表に追加したアカウント）")
+    p.add_argument("--credentials", help="店舗ごとのログイン情報（エリア/店名/媒体/ログインID/パスワード の列を持つ CSV または TSV）")
+    p.add_argument("--login-id", default="", help="店舗のログインID（入力が1店舗のときだけ）")
+    p.add_argument("--login-pw", default="", help="店舗のパスワード（入力が1店舗のときだけ）")
+    p.add_argument("--secrets", default=default_secrets, help="secrets.toml のパス")
+    p.add_argument("--workers", type=int, default=8, help="画像アップロードの並列数")
+    p.add_argument("--chunk", type=int, default=registration.APPEND_CHUNK, help="append_rows 1回あたりの行数")
+    p.add_argument("--state", help="進捗ファイル（既定: 入力ファイル名 + .import-state.json）")
+    p.add_argument("--allow-missing-images", action="store_true", help="画像が無い行もそのまま登録する")
+    p.add_argument("--dry-run", action="store_true", help="GCS・スプレッドシートの代わりに --local-out へ書き出す")
+    p.add_argument("--local-out", default="./bulk_import_dryrun", help="--dry-run の出力先フォルダ")
+    args = p.parse_args(argv)
+
+    entries, raw_text = read_table(args.table)
+    credentials = store_credentials(entries, read_credentials(args.credentials) if args.credentials else {}, args.login_id, args.login_pw)
+    images = index_images(args.images)
+    errors, warnings = validate(entries, images, args.allow_missing_images)
+    for msg in warnings:
+        print(f"⚠️ {msg}")
+    if errors:
+        print(f"❌ {len(errors)}件のエラーがあるため登録しません。")
+        for msg in errors:
+            print(f"  - {msg}")
+        return 1
+    with_image = sum(1 for e in entries if f"{e['投稿時間']}_{e['女の子の名前']}" in images)
+    print(f"✅ 検証OK: {len(entries)}件（画像 {with_image}枚）")
+
+    fingerprint = hashlib.sha1((raw_text + args.account + str(args.dry_run)).encode("utf-8")).hexdigest()
+    state_path = args.state or args.table + (".dryrun" if args.dry_run else "") + ".import-state.json"
+    state = load_state(state_path, fingerprint)
+    bucket, main_ws, ws_status, hash_index, sh_home = connect(args)
+
+    # 1. 画像（並列アップロード。済んだものは進捗ファイルに記録して再実行時に飛ばす）
+    uploaded = set(state["uploaded"])
+    # 行IDは入力内容から決めるので、再実行しても同じ行には同じIDが付く
+    for i, e in enumerate(entries):
+        e["row_id"] = registration.new_row_id(f"{fingerprint}:{i}")
+    row_ids = {}
+    todo = []
+    for e in entries:
+        src = images.get(f"{e['投稿時間']}_{e['女の子の名前']}")
+        if src:
+            ext = os.path.splitext(src)[1].lstrip(".")
+            dest = registration.image_blob_path(e["エリア"], e["店名"], e["媒体"], e["投稿時間"], e["女の子の名前"], ext)
+            row_ids[dest] = e["row_id"]
+            if dest not in uploaded:
+                todo.append((src, dest))
+
+    # 進捗ファイルに記録する前に中断した画像は、既存の内容と同じなら送らない（フォルダごとに1回だけ一覧を取る）
+    existing = {}
+    if hasattr(bucket, "list_blobs"):
+        for prefix in sorted({dest.rsplit("/", 1)[0] + "/" for _, dest in todo}):
+            existing.update(registration.listing(bucket, prefix))
+    stats = registration.UploadStats()
+
+    def upload(item):
+        src, dest = item
+        with open(src, "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(src)[0] or "application/octet-stream"
+        return dest, registration.upload_image(bucket, dest, data, content_type, hash_index, row_id=row_ids[dest],
+                                               existing=existing.get(dest), stats=stats)
+
+    print(f"📸 画像をアップロード中...（{len(todo)}枚、済み {len(uploaded)}枚）")
+    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+        for i, (dest, similar) in enumerate(ex.map(upload, todo), 1):
+            uploaded.add(dest)
+            state["uploaded"] = sorted(uploaded)
+            save_state(state_path, state)
+            if similar:
+                print(f"  ⚠️ {dest} は使用済み画像と酷似しています: {' / '.join(n for _, n in similar[:3])}")
+            if i % 20 == 0 or i == len(todo):
+                print(f"  {i}/{len(todo)}")
+    if hash_index is not None:
+        hash_index.save()
+    if todo:
+        print(f"  {stats.summary()}")
+
+    # 2. 日記文（書き込み先のシート（シャード）ごとにチャンクで append_rows し、済んだ行数を通し番号で記録）
+    # 行IDは入力から決まるので、書き込む前に Z 列を読んで既にある行は送らない
+    # （途中で落ちた・429 の再試行で二重に入るのを防ぐ）
+    targets = {}
+    for e in entries:
+        key, sh, ws = main_ws(e["エリア"])
+        targets.setdefault(key, (sh, ws, []))[2].append(registration.sheet_row(e["エリア"], e["店名"], e["媒体"], e))
+    total = sum(len(t[2]) for t in targets.values())
+    print(f"📝 日記文を登録中...（{total - state['rows_appended']}行、済み {state['rows_appended']}行）")
+    offset = 0
+    for sh, ws, rows in targets.values():
+        start = max(state["rows_appended"] - offset, 0)
+        if start < len(rows):
+            if sh is not None:
+                registration.ensure_row_id_column(sh, ws)
+            written = registration.written_row_ids(ws)
+            todo = [r for r in rows[start:] if registration.row_id_of(r) not in written]
+            if len(todo) < len(rows) - start:
+                print(f"  ⏭ 既にシートにある {len(rows) - start - len(todo)} 行は飛ばします")
+            base = offset + len(rows) - len(todo)
+
+            def on_chunk(done, base=base):
+                print(f"  {base + done}/{total}")
+
+            registration.append_rows_chunked(ws, todo, chunk=args.chunk, on_chunk=on_chunk, skip_written=True)
+        # 済み行数はシート単位で進める（途中で落ちたら、そのシートは Z 列の行IDで続きから入れる）
+        offset += len(rows)
+        state["rows_appended"] = max(state["rows_appended"], offset)
+        save_state(state_path, state)
+
+    # 店舗アカウント集計（全行の登録が済んでから1回だけ）
+    if sh_home is not None and not state.get("summary_done"):
+        changes = {}
+        for e in entries:
+            key = (args.account, e["エリア"], e["店名"], e["媒体"])
+            changes[key] = changes.get(key, 0) + 1
+        try:
+            account_summary.apply_delta(sh_home, changes)
+        except Exception as ex:
+            print(f"⚠️ 店舗アカウント集計の更新に失敗しました（アプリの「集計を再計算」で直せます）: {ex}")
+        state["summary_done"] = True
+        save_state(state_path, state)
+
+    # 3. ログイン情報（店舗ごとに1行。ログイン情報シートに既にある店舗はそのまま）
+    registered = {tuple(c.strip() for c in (r + [""] * 3)[:3]) for r in ws_status.get_all_values()}
+    no_login = []
+    for area, store, media in store_keys(entries):
+        if f"{area}/{store}" in state["status_done"] or (area, store, media) in registered:
+            continue
+        if (area, store, media) not in credentials:
+            no_login.append(f"{area} / {store}（{media}）")
+            continue
+        login_id, login_pw = credentials[(area, store, media)]
+        ws_status.append_row([area, store, media, login_id, login_pw], value_input_option='USER_ENTERED')
+        state["status_done"].append(f"{area}/{store}")
+        save_state(state_path, state)
+    if no_login:
+        print(f"⚠️ ログイン情報が無いため登録しなかった店舗（アプリか --credentials で登録してください）: {', '.join(no_login)}")
+
+    print(f"✅ {total}件の登録が完了しました。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import os
+import threading
+import unicodedata
+from collections import deque
+
+import pandas as pd
+
+import schedule_planner
+
+# --- 日記文の内容チェック ---
+# 禁止語（媒体の審査で弾かれる語句）を Aho–Corasick オートマトンで1回の走査で探し、
+# 文字数超過・タイトル空欄・読めない投稿時間は DataFrame の列演算でまとめて判定する。
+# 編集アプリの「データ不備チェック」と、登録フォーム・一括登録の書き込み前チェックで共通に使う。
+# 書き込み前チェックで登録を止めるのは BLOCKING_KINDS だけで、文字数・タイトル空欄は警告にとどめる。
+
+BANNED_WORDS_PATH = os.environ.get("DIARY_BANNED_WORDS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "banned_words.txt"))
+# 媒体ごとの文字数の目安（タイトル, 本文）。媒体側の正確な上限は未確認なので、超えても登録は止めない
+LENGTH_LIMITS = {"駅ちか": (30, 1000), "デリじゃ": (30, 1000)}
+DEFAULT_LIMITS = (30, 1000)
+ISSUE_COLS = ["種別", "詳細"]
+BLOCKING_KINDS = {"禁止語", "投稿時間の形式"}   # 登録を止める不備（それ以外は警告）
+
+_SEP = "\x00"   # 日記どうしの区切り（禁止語に含まれないので、ここで一致が途切れる）
+
+
+def normalize(text):
+    """全角英数・半角カナを揃えて小文字にする（禁止語の表記ゆれ対策）"""
+    return unicodedata.normalize("NFKC", str(text)).lower()
+
+
+class AhoCorasick:
+    """複数の語を1回の走査で探すオートマトン"""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for w in words:
+            node = 0
+            for ch in w:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] = self.out[node] + (w,)
+        # 幅優先で失敗遷移を張り、失敗先の出力を引き継ぐ
+        queue = deque(self.goto[0].values())   # 深さ1の失敗先はルートのまま
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def scan(self, text):
+        """[(終了位置, 語), ...]"""
+        goto, fail, out = self.goto, self.fail, self.out
+        root = goto[0]
+        node = 0
+        hits = []
+        for i, ch in enumerate(text):
+            if node == 0:
+                # 大半の文字はルートから先に進まないので、ここで1回の辞書参照だけで済ませる
+                node = root.get(ch, 0)
+            else:
+                while node and ch not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(ch, 0)
+            if out[node]:
+                hits.extend((i, w) for w in out[node])
+        return hits
+
+
+def load_banned_words(path=BANNED_WORDS_PATH):
+    """1行1語（# 以降はコメント）。正規化して重複を除く"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    words = {normalize(line.split("#", 1)[0].strip()) for line in lines}
+    return sorted(w for w in words if w and _SEP not in w)
+
+
+_matcher = {"mtime": None, "ac": None}
+_matcher_lock = threading.Lock()
+
+
+def get_matcher(path=BANNED_WORDS_PATH):
+    """禁止語リストのオートマトン（ファイルが更新されたときだけ作り直す）"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    with _matcher_lock:
+        if _matcher["ac"] is None or _matcher["mtime"] != mtime:
+            _matcher["ac"] = AhoCorasick(load_banned_words(path))
+            _matcher["mtime"] = mtime
+        return _matcher["ac"]
+
+
+def find_banned(texts, matcher=None):
+    """texts（Series）の各要素に含まれる禁止語を、全件を連結した1回の走査で探す。{位置: [語, ...]}"""
+    matcher = matcher or get_matcher()
+    if len(matcher.goto) == 1 or len(texts) == 0:
+        return {}
+    values = [normalize(t) for t in texts]
+    joined = _SEP.join(values)
+    # 連結後の各要素の終了位置（区切りを含む）で、一致位置を元の要素へ戻す
+    ends = pd.Series([len(v) + 1 for v in values]).cumsum().to_numpy()
+    found = {}
+    for pos, word in matcher.scan(joined):
+        k = int(ends.searchsorted(pos, side="right"))
+        bucket = found.setdefault(k, [])
+        if word not in bucket:
+            bucket.append(word)
+    return found
+
+
+def scan(df, matcher=None):
+    """日記の DataFrame（媒体・投稿時間・タイトル・本文 列）を検査し、問題ごとに1行の DataFrame を返す。
+    返り値の index は df の index、列は ISSUE_COLS"""
+    if df.empty:
+        return pd.DataFrame(columns=ISSUE_COLS)
+    title = df["タイトル"].astype(str)
+    body = df["本文"].astype(str)
+    media = df["媒体"].astype(str).str.strip()
+    t_max = media.map(lambda m: LENGTH_LIMITS.get(m, DEFAULT_LIMITS)[0])
+    b_max = media.map(lambda m: LENGTH_LIMITS.get(m, DEFAULT_LIMITS)[1])
+    t_len, b_len = title.str.len(), body.str.len()
+
+    parts = []
+
+    def add(mask, kind, detail):
+        if mask.any():
+            parts.append(pd.DataFrame({"種別": kind, "詳細": detail[mask] if isinstance(detail, pd.Series) else detail},
+                                      index=df.index[mask.to_numpy()]))
+
+    add(title.str.strip().eq(""), "タイトルなし", "タイトルが空です")
+    add(t_len > t_max, "タイトル文字数超過", t_len.astype(str) + " / " + t_max.astype(str) + " 文字")
+    add(b_len > b_max, "本文文字数超過", b_len.astype(str) + " / " + b_max.astype(str) + " 文字")
+    add(schedule_planner.parse_minutes(df["投稿時間"]).isna(), "投稿時間の形式", "「" + df["投稿時間"].astype(str) + "」を時刻として読めません")
+
+    banned = find_banned(title + "\n" + body, matcher)
+    if banned:
+        positions = list(banned)
+        parts.append(pd.DataFrame({"種別": "禁止語", "詳細": [" / ".join(banned[p]) for p in positions]},
+                                  index=df.index[positions]))
+
+    if not parts:
+        return pd.DataFrame(columns=ISSUE_COLS)
+    return pd.concat(parts).sort_index(kind="stable")
+
+
+def with_context(df, issues, cols):
+    """scan() の結果の左に df の cols 列を付けた表示用の表
+    （1件に複数の不備があると index が重複するので、位置で横に並べる）"""
+    return pd.concat([df.loc[issues.index, cols].astype(str).reset_index(drop=True),
+                      issues.reset_index(drop=True)], axis=1)
+
+
+def scan_entries(entries, media=""):
+    """フォーム・CSV の入力（投稿時間・タイトル・本文 を持つ dict のリスト）を検査。[(何件目(0始まり), 種別, 詳細)]
+    媒体は entries 側に「媒体」があればそれを、なければ media を使う"""
+    if not entries:
+        return []
+    df = pd.DataFrame([{"媒体": e.get("媒体", media),
+                        "投稿時間": e.get("投稿時間", ""), "タイトル": e.get("タイトル", ""), "本文": e.get("本文", "")}
+                       for e in entries])
+    issues = scan(df)
+    return [(int(i), r["種別"], r["詳細"]) for i, r in issues.iterrows()]
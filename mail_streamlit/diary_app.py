@@ -1,65 +1,83 @@
+import perf
+perf.STARTUP.begin()
 import streamlit as st
 import pandas as pd
-import gspread
-import zipfile
-import datetime
-import re
+perf.begin_rerun(st, "diary_app")
+import os
 from io import BytesIO
-from datetime import timedelta
-from google.oauth2.service_account import Credentials
-from google.cloud import storage 
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from image_hash import ImageHashIndex
+from snapshot_cache import SNAPSHOTS
+import schedule_planner
+import account_data
+import registration
+import stock_archive
+import content_check
+import account_summary
+import transport
+import image_urls
+import sheet_routing
+# gspread / google.cloud.storage / zipfile は使う場所で読み込む（コールドスタート短縮）
 
 # --- 1. 定数と初期設定 ---
 try:
+    # 対応表（sheet_routing）が無いときの既定のスプレッドシート。アカウント・ログイン情報・ストックの場所は下で対応表から決める
     SHEET_ID = st.secrets["google_resources"]["spreadsheet_id"] 
-    ACCOUNT_STATUS_SHEET_ID = "1_GmWjpypap4rrPGNFYWkwcQE1SoK3QOMJlozEhkBwVM"
-    USABLE_DIARY_SHEET_ID = "1e-iLey43A1t0bIBoijaXP55t5fjONdb0ODiTS53beqM"
     
     GCS_BUCKET_NAME = "auto-poster-images"
 
     SHEET_NAMES = st.secrets["sheet_names"]
-    POSTING_ACCOUNT_SHEETS = {
-        "A": "投稿Aアカウント",
-        "B": "投稿Bアカウント",
-        "C": "投稿Cアカウント",
-        "D": "投稿Dアカウント"
-    }
     
     USABLE_DIARY_SHEET = "【使用可能日記文】"
-    MEDIA_OPTIONS = ["駅ちか", "デリじゃ"]
-    POSTING_ACCOUNT_OPTIONS = ["A", "B", "C", "D"] 
+    MEDIA_OPTIONS = registration.MEDIA_OPTIONS
     
     SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/cloud-platform']
 except KeyError:
     st.error("🚨 secrets.tomlの設定を確認してください。")
     st.stop()
 
-REGISTRATION_HEADERS = ["エリア", "店名", "媒体", "投稿時間", "女の子の名前", "タイトル", "本文"]
+REGISTRATION_HEADERS = account_data.DF_COLS
 INPUT_HEADERS = ["投稿時間", "女の子の名前", "タイトル", "本文"]
 
 # --- 2. 各種API連携 ---
 @st.cache_resource(ttl=3600)
 def get_gspread_client():
-    """スプレッドシートAPIのクライアントを作成"""
-    return gspread.service_account_from_dict(st.secrets["gcp_service_account"])
+    """スプレッドシートAPIのクライアントを作成（認証・接続プールは transport で全アプリ共通）"""
+    return transport.gspread_client(st.secrets["gcp_service_account"])
 
 @st.cache_resource(ttl=3600)
 def get_gcs_client():
     """Google Cloud Storageのクライアントを作成"""
-    from google.cloud import storage
-    return storage.Client.from_service_account_info(st.secrets["gcp_service_account"])
+    return transport.storage_client(st.secrets["gcp_service_account"])
+
+@st.cache_resource(ttl=3600)
+def get_spreadsheet(sheet_key):
+    """スプレッドシートを開く（メタデータ取得の往復は初回利用時の1回だけ）"""
+    return perf.call("sheets.open_by_key", sheet_key, get_gspread_client().open_by_key, sheet_key)
+
+def clear_caches():
+    """「更新」ボタン用：メモリとディスクのキャッシュを次回アクセス時に取り直させる"""
+    st.cache_data.clear()
+    SNAPSHOTS.invalidate()
+    sheet_routing.clear_cache()
+
+def current_router():
+    """書き込み直前に使う対応表（世代番号を確かめ、変わっていれば読み直したもの）"""
+    return sheet_routing.current(ROUTER, GCS_CLIENT.bucket(GCS_BUCKET_NAME), SHEET_ID)
+
+perf.STARTUP.mark("import")
 
 try:
-    # 1. まずクライアントを作成
+    # クライアントだけ先に作成し、スプレッドシートは get_spreadsheet() で使う時に開く
     GC = get_gspread_client()
     GCS_CLIENT = get_gcs_client()
-    
-    # 2. スプレッドシートを開く
-    SPRS = GC.open_by_key(SHEET_ID)
-    STATUS_SPRS = GC.open_by_key(ACCOUNT_STATUS_SHEET_ID)
-    
+    perf.STARTUP.mark("auth")
+    # アカウント（＋エリア）→ スプレッドシートの対応表。shard_admin.py の変更は ROUTING_MAX_AGE 秒以内に反映される
+    ROUTER = sheet_routing.cached(GCS_CLIENT.bucket(GCS_BUCKET_NAME), SHEET_ID)
+    SHEET_ID = ROUTER.home_id   # 集計シートを置くスプレッドシート
+    ACCOUNT_STATUS_SHEET_ID = ROUTER.status_id
+    USABLE_DIARY_SHEET_ID = ROUTER.stock_id
+    POSTING_ACCOUNT_OPTIONS = ROUTER.accounts
+    POSTING_ACCOUNT_SHEETS = ROUTER.sheet_map
 except Exception as e:
     if "429" in str(e):
         st.error("🚨 Google APIの制限を超えました。1分ほど待ってから再読み込みしてください。")
@@ -68,26 +86,41 @@ except Exception as e:
     else:
         st.error(f"❌ API接続失敗: {e}")
     st.stop()
-    
+
+@st.cache_resource
+def get_hash_index():
+    """画像の知覚ハッシュ索引（使い回し防止用）を読み込み"""
+    return ImageHashIndex(GCS_CLIENT.bucket(GCS_BUCKET_NAME))
+
+@st.cache_resource
+def get_stock_archive():
+    """使用可能日記文のアーカイブ（DIARY_STOCK_ARCHIVE_DIR があればローカル、なければバケットに保存）"""
+    local_dir = os.environ.get("DIARY_STOCK_ARCHIVE_DIR")
+    store = stock_archive.LocalStore(local_dir) if local_dir else stock_archive.BucketStore(GCS_CLIENT.bucket(GCS_BUCKET_NAME))
+    return stock_archive.StockArchive(store)
+
 # 【修正箇所】media引数を追加し、session_stateではなく選択された値を参照するように変更
-def gcs_upload_wrapper(uploaded_file, entry, area, store, media):
+def gcs_upload_wrapper(uploaded_file, entry, area, store, media, existing=None, stats=None):
     try:
         bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
         # 選択された媒体（media）を直接参照
-        folder_name = f"デリじゃ {store}" if media == "デリじゃ" else store
         ext = uploaded_file.name.split('.')[-1]
-        blob_path = f"{area}/{folder_name}/{entry['投稿時間'].strip()}_{entry['女の子の名前'].strip()}.{ext}"
-        blob = bucket.blob(blob_path)
-        blob.upload_from_string(uploaded_file.getvalue(), content_type=uploaded_file.type)
+        blob_path = registration.image_blob_path(area, store, media, entry['投稿時間'], entry['女の子の名前'], ext)
+        # 他店舗・落ち店で使用済みの画像と酷似していないか照合しつつアップロード（同じ内容の画像が既にあれば送らない）
+        similar = registration.upload_image(bucket, blob_path, uploaded_file.getvalue(), uploaded_file.type, get_hash_index(),
+                                            row_id=entry.get('row_id'), existing=(existing or {}).get(blob_path), stats=stats)
+        if similar:
+            # 登録後の st.rerun で消えないよう、セッションに貯めて再実行後に表示する
+            st.session_state.setdefault("upload_notices", []).append(
+                f"⚠️ {entry['女の子の名前']}（{entry['投稿時間']}）の画像は使用済み画像と酷似しています: " + " / ".join(n for _, n in similar[:3]))
         return True
     except Exception as e:
         st.error(f"❌ GCSアップロード失敗: {e}")
         return False
 
-def get_cached_url(blob_name):
-    import urllib.parse
-    safe_path = urllib.parse.quote(blob_name)
-    return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{safe_path}"
+def get_cached_url(blob_name, generation=None):
+    # 世代番号付きURL（上書きされると URL が変わる）。署名付きURLの設定なら署名をキャッシュして使い回す
+    return image_urls.image_url(GCS_CLIENT.bucket(GCS_BUCKET_NAME), blob_name, generation)
     
 # --- 3. UI 構築 ---
 st.set_page_config(layout="wide", page_title="写メ日記投稿登録")
@@ -119,24 +152,30 @@ tab1, tab2, tab3, tab4 = st.tabs([
     "🖼 ④ 使用可能画像"
 ])
 
-combined_data = []
-acc_summary = {}; acc_counts = {}
-try:
-    all_ws = SPRS.worksheets()
-    ws_dict = {ws.title: ws for ws in all_ws}
-    for code, s_name in POSTING_ACCOUNT_SHEETS.items():
-        if s_name in ws_dict:
-            rows = ws_dict[s_name].get_all_values()
-            if len(rows) > 1:
-                for i, r in enumerate(rows[1:]):
-                    if any(str(c).strip() for c in r[:7]):
-                        combined_data.append([code, i+2] + [r[j] if j<len(r) else "" for j in range(7)])
-                        a, s, m = str(r[0]).strip(), str(r[1]).strip(), str(r[2]).strip()
-                        acc_counts[code] = acc_counts.get(code, 0) + 1
-                        if code not in acc_summary: acc_summary[code] = {}
-                        if a not in acc_summary[code]: acc_summary[code][a] = set()
-                        acc_summary[code][a].add(f"{m} : {s}")
-except: pass
+# 全アカウントのデータを1つの DataFrame にまとめる（集計・プランナー共通）。使う場所で読み、5分キャッシュする
+@st.cache_data(ttl=300, show_spinner="全アカウントのシートを読み込み中...")
+def load_accounts_df(routing_generation):
+    """スプレッドシート（シャード）ごとに values_batchGet 1回、シャード同士は並列で取得。
+    1枚でも読めなければ例外（欠けたデータで集計を上書きしないように）"""
+    rows_by_loc = sheet_routing.read_locations(get_spreadsheet, ROUTER.all_locations())
+    failed = [loc.worksheet for loc, rows in rows_by_loc.items() if not isinstance(rows, list)]
+    if failed:
+        raise RuntimeError(f"読み込めなかったシート: {', '.join(failed)}")
+    perf.STARTUP.mark("first_api")
+    return sheet_routing.all_frames(ROUTER, rows_by_loc)
+
+def get_accounts_df():
+    return load_accounts_df(ROUTER.generation)
+
+# 店舗アカウント状況は集計シート（数十セル）から読む。無ければ上の全データから作る
+SUMMARY_KEY = f"sheet:{SHEET_ID}:{account_summary.SUMMARY_SHEET}"
+def get_account_summary():
+    def _fetch():
+        rows = account_summary.read_rows(get_spreadsheet(SHEET_ID))
+        perf.STARTUP.mark("first_api")
+        # 集計シートが無ければ空で返す（作り直しは「集計を再計算」ボタンだけで行う）
+        return rows or []
+    return SNAPSHOTS.get(SUMMARY_KEY, _fetch, max_age=300)
 
 # =========================================================
 # --- Tab 1: 📝 ① データ登録 ---
@@ -158,6 +197,39 @@ with tab1:
         ### 4. 登録の実行
         最下部の **「🔥 データを一括登録する」** を押すと、全データがスプレッドシートとストレージへ同時に保存されます。
         """)
+
+    with st.expander("🗓 投稿時間プランナー（混み具合を見て空き時間を自動入力）", expanded=False):
+        # 全アカウントのシートを読むので、使うときだけ読み込む
+        plan_df = None
+        if st.toggle("混み具合を読み込む", key="plan_on"):
+            try:
+                plan_df = get_accounts_df()
+            except Exception as e:
+                st.error(f"❌ アカウントシートの読み込みに失敗しました: {e}")
+        if plan_df is not None:
+            load = schedule_planner.hourly_load(plan_df, POSTING_ACCOUNT_OPTIONS)
+            remaining = schedule_planner.remaining_capacity(load)
+
+            st.caption(f"※ 1アカウントあたり1時間 {schedule_planner.POSTS_PER_HOUR_CAPACITY} 件を目安に、残り枠を表示しています（06:00〜11:00 はメンテナンスのため 0）。")
+            m_cols = st.columns(len(POSTING_ACCOUNT_OPTIONS))
+            for m_col, acc_code in zip(m_cols, POSTING_ACCOUNT_OPTIONS):
+                m_col.metric(f"👤 投稿{acc_code} 残り枠/日", int(remaining[acc_code].sum()), f"登録済み {int(load[acc_code].sum())} 件", delta_color="off")
+            st.dataframe(load.T, use_container_width=True)
+
+            p1, p2, p3, p4 = st.columns([1, 2, 1, 2])
+            plan_acc = p1.selectbox("👤 アカウント", POSTING_ACCOUNT_OPTIONS, index=POSTING_ACCOUNT_OPTIONS.index(remaining.sum().idxmax()), key="plan_acc")
+            plan_store = p2.text_input("🏢 店名（同じ店舗の時間と重ならないようにします）", key="plan_store")
+            plan_count = p3.number_input("件数", min_value=1, max_value=40, value=10, key="plan_count")
+            p4.write("")
+            if p4.button("⏱ 空いている時間を下の表に自動入力", use_container_width=True):
+                times = iter(schedule_planner.propose_times(plan_df, plan_acc, plan_store, int(plan_count)))
+                # 時間が空欄の行にだけ、先頭から順に入れる
+                for i in range(40):
+                    if not st.session_state.get(f"f_t_{i}"):
+                        t = next(times, None)
+                        if t is None: break
+                        st.session_state[f"f_t_{i}"] = t
+                st.toast("投稿時間を入力しました。アカウント・店名をフォームにも入力してください。")
         
     with st.form("diary_input_form", clear_on_submit=False):
         c1, c2, c3, c4 = st.columns(4)
@@ -199,38 +271,91 @@ with tab1:
 
     if submit_button:
         valid_data = [e for e in form_entries if e['投稿時間'] and e['女の子の名前']]
+        content_issues = content_check.scan_entries(valid_data, target_media)
+        blocking = [x for x in content_issues if x[1] in content_check.BLOCKING_KINDS]
         if not valid_data or not global_area or not global_store:
             st.error("⚠️ 入力不足：エリア、店名、および少なくとも1件以上の「時間・名前」を入力してください。")
+        elif blocking:
+            st.error(f"🚫 内容に不備が {len(blocking)} 件あるため登録できません。修正してから再度登録してください。")
+            for i, kind, detail in blocking:
+                st.markdown(f"- **{valid_data[i]['投稿時間']} {valid_data[i]['女の子の名前']}**：{kind}（{detail}）")
         else:
+            # 文字数の目安超え・タイトル空欄は登録したうえで警告だけ出す
+            for i, kind, detail in content_issues:
+                st.session_state.setdefault("upload_notices", []).append(
+                    f"⚠️ {valid_data[i]['投稿時間']} {valid_data[i]['女の子の名前']}：{kind}（{detail}）")
             progress_text = st.empty()
             try:
                 progress_text.info("📸 画像をアップロード中...")
+                # エラー後の再送信で同じ画像を送り直さないよう、店舗フォルダの一覧を1回だけ取って比べる
+                existing = registration.listing(GCS_CLIENT.bucket(GCS_BUCKET_NAME), f"{global_area}/{registration.store_folder(global_store, target_media)}/")
+                upload_stats = registration.UploadStats()
                 for e in valid_data:
+                    e['row_id'] = registration.new_row_id()   # シートの行と画像を結ぶID
                     # 【修正箇所】target_mediaを引数に追加
-                    if e['img']: gcs_upload_wrapper(e['img'], e, global_area, global_store, target_media)
+                    if e['img']: gcs_upload_wrapper(e['img'], e, global_area, global_store, target_media, existing, upload_stats)
+                st.toast(f"📸 画像: {upload_stats.summary()}")
                 
                 progress_text.info("📝 日記文を登録中...")
-                ws_main = SPRS.worksheet(POSTING_ACCOUNT_SHEETS[target_acc])
-                rows_main = [[global_area, global_store, target_media, e['投稿時間'], e['女の子の名前'], e['タイトル'], e['本文']] for e in valid_data]
-                ws_main.append_rows(rows_main, value_input_option='USER_ENTERED')
+                router = current_router()   # 画面を開いた後に振り分けが変わっていても、今の書き込み先へ入れる
+                loc = router.location(target_acc, global_area)   # アカウント（エリア）ごとの書き込み先シャード
+                ws_main = perf.call("sheets.worksheet", loc.worksheet, get_spreadsheet(loc.spreadsheet_id).worksheet, loc.worksheet)
+                registration.ensure_row_id_column(get_spreadsheet(loc.spreadsheet_id), ws_main)
+                rows_main = [registration.sheet_row(global_area, global_store, target_media, e) for e in valid_data]
+                registration.append_rows_chunked(ws_main, rows_main)
+                # ハッシュ索引はシートに行が入ってから保存する（保存に失敗しても登録は済んでいるので止めない）
+                try:
+                    get_hash_index().save()
+                except Exception as e:
+                    st.session_state.setdefault("upload_notices", []).append(f"⚠️ 画像ハッシュ索引の保存に失敗しました（次の登録・削除時に保存されます）: {e}")
+                try:
+                    account_summary.apply_delta(get_spreadsheet(router.home_id), {(target_acc, global_area, global_store, target_media): len(rows_main)})
+                    SNAPSHOTS.forget(SUMMARY_KEY)
+                except Exception as e:
+                    st.warning(f"⚠️ 店舗アカウント集計の更新に失敗しました（②タブの「集計を再計算」で直せます）: {e}")
                 
                 progress_text.info("🔐 ログイン情報を登録中...")
-                ws_status = STATUS_SPRS.worksheet(POSTING_ACCOUNT_SHEETS[target_acc])
-                ws_status.append_row([global_area, global_store, target_media, login_id, login_pw], value_input_option='USER_ENTERED')
+                status_title = router.sheet_map[target_acc]
+                ws_status = perf.call("sheets.worksheet", status_title, get_spreadsheet(router.status_id).worksheet, status_title)
+                perf.call("sheets.append_row", ws_status.title, ws_status.append_row, [global_area, global_store, target_media, login_id, login_pw], value_input_option='USER_ENTERED')
                 
                 progress_text.empty()
                 st.success(f"✅ {len(valid_data)}件のデータを正常に登録しました！")
-                st.cache_data.clear()
+                clear_caches()
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ 登録エラーが発生しました: {e}")
 
+    # 登録時の警告（登録成功時は再実行後にここで表示される）
+    for notice in st.session_state.pop("upload_notices", []):
+        st.warning(notice)
+
 # =========================================================
 # --- Tab 2: 📊 ② 店舗アカウント状況 ---
 # =========================================================
 with tab2:
     st.markdown("## 📊 店舗アカウント状況")
-    if combined_data:
+    c_sum, _ = st.columns([1, 4])
+    if c_sum.button("🧮 集計を再計算", key="recompute_tab2", use_container_width=True):
+        try:
+            if current_router().generation != ROUTER.generation:
+                st.warning("⚠️ シートの振り分けが変わりました。画面を読み直してからもう一度押してください。")
+            else:
+                # 読み直した全データで作り直す（読めなければ例外になり、集計シートは書き換えない）
+                load_accounts_df.clear()
+                account_summary.recompute(get_spreadsheet(SHEET_ID), get_accounts_df())
+                SNAPSHOTS.forget(SUMMARY_KEY)
+                st.toast("集計シートを作り直しました")
+        except Exception as e:
+            st.error(f"❌ 再計算に失敗しました: {e}")
+    acc_counts, acc_summary = {}, {}
+    try:
+        acc_counts, acc_summary = account_summary.to_summary(perf.cached_call("cache.summary", SUMMARY_KEY, get_account_summary))
+        if not acc_counts:
+            st.info("ℹ️ 集計シートが空です。「🧮 集計を再計算」を押すと全シートから作り直します。")
+    except Exception as e:
+        st.error(f"集計シート読み込みエラー: {e}")
+    if acc_counts:
         for acc_code in POSTING_ACCOUNT_OPTIONS:
             count = acc_counts.get(acc_code, 0)
             st.markdown(f"### 👤 投稿{acc_code}アカウント `{count} 件`")
@@ -248,11 +373,12 @@ with tab2:
 # =========================================================
 with tab3:
     st.header("3️⃣ 使用可能日記文")
-    @st.cache_data
     def get_usable_diary_data(update_tick):
-        tmp_sprs = GC.open_by_key("1e-iLey43A1t0bIBoijaXP55t5fjONdb0ODiTS53beqM")
-        tmp_ws = tmp_sprs.sheet1 
-        return tmp_ws.get_all_values()
+        def _fetch():
+            tmp_sprs = get_spreadsheet(USABLE_DIARY_SHEET_ID)
+            tmp_ws = tmp_sprs.sheet1 
+            return perf.call("sheets.get_all_values", tmp_ws.title, tmp_ws.get_all_values)
+        return SNAPSHOTS.get(f"sheet:{USABLE_DIARY_SHEET_ID}:sheet1", _fetch, max_age=604800)
 
     if 'tab3_update_tick' not in st.session_state:
         st.session_state.tab3_update_tick = 0
@@ -260,11 +386,11 @@ with tab3:
     col_refresh, _ = st.columns([1, 4])
     if col_refresh.button("🔄 データを最新に更新", key="refresh_tab3", use_container_width=True):
         st.session_state.tab3_update_tick += 1
-        st.cache_data.clear()
+        clear_caches()
         st.rerun()
 
     try:
-        tmp_data = get_usable_diary_data(st.session_state.tab3_update_tick)
+        tmp_data = perf.cached_call("cache.usable_diary", USABLE_DIARY_SHEET_ID, get_usable_diary_data, st.session_state.tab3_update_tick)
         if len(tmp_data) > 1:
             df_usable = pd.DataFrame(tmp_data[1:], columns=tmp_data[0])
             st.dataframe(df_usable, use_container_width=True, height=600, hide_index=True)
@@ -273,6 +399,55 @@ with tab3:
     except Exception as e:
         st.error(f"読み込みエラー: {e}")
 
+    with st.expander("🗄 アーカイブ（使用済み・古い日記文の退避と検索・復元）", expanded=False):
+        archive = get_stock_archive()
+        a_stats = archive.stats()
+        st.caption(f"アーカイブ済み：{a_stats['rows']} 件（{a_stats['partitions']} ファイル）。A・B列に値がある使用済みの行と、最新 N 行より古い行をシートから移します。")
+
+        ac1, ac2, ac3 = st.columns([1, 1.5, 1.5])
+        keep_rows = ac1.number_input("シートに残す最新行数", min_value=100, value=stock_archive.KEEP_ROWS, step=500, key="arc_keep")
+        if ac2.button("📦 アーカイブを実行", key="arc_run", use_container_width=True):
+            bar = st.progress(0.0, text="アーカイブ中...")
+            try:
+                ws_stock = get_spreadsheet(current_router().stock_id).sheet1
+                moved = archive.archive_from_sheet(ws_stock, int(keep_rows), progress=lambda i, n: bar.progress(i / n, text=f"シートから削除中... {i}/{n}"))
+                bar.empty()
+                st.success(f"✅ {moved} 件をアーカイブしました")
+                SNAPSHOTS.forget(f"sheet:{USABLE_DIARY_SHEET_ID}:sheet1")
+            except Exception as e:
+                bar.empty()
+                st.error(f"❌ アーカイブに失敗しました: {e}")
+        if ac3.button("🧮 索引を再構築", key="arc_reindex", use_container_width=True):
+            with st.spinner("索引を作り直しています..."):
+                archive.rebuild_index()
+            st.success("✅ 索引を再構築しました")
+
+        sc1, sc2, sc3 = st.columns([3, 1, 1])
+        arc_q = sc1.text_input("🔍 キーワード（スペース区切りで AND）", key="arc_q")
+        arc_min = sc2.number_input("本文の文字数（以上）", min_value=0, value=0, key="arc_min")
+        arc_max = sc3.number_input("（以下, 0=上限なし）", min_value=0, value=0, key="arc_max")
+        if arc_q or arc_min or arc_max:
+            try:
+                hits = archive.search(arc_q, arc_min or None, arc_max or None)
+            except Exception as e:
+                st.error(f"❌ 検索に失敗しました: {e}")
+                hits = None
+            if hits is not None and len(hits):
+                view = hits[["タイトル", "本文", "文字数"]].copy()
+                view.insert(0, "復元", False)
+                edited = st.data_editor(view, key="arc_sel", hide_index=True, use_container_width=True, height=400,
+                                        disabled=["タイトル", "本文", "文字数"])
+                picked = hits[edited["復元"].to_numpy()]
+                if st.button(f"♻️ 選択した {len(picked)} 件をシートへ復元", key="arc_restore", type="primary", disabled=len(picked) == 0):
+                    try:
+                        restored = archive.restore(get_spreadsheet(current_router().stock_id).sheet1, picked)
+                        SNAPSHOTS.forget(f"sheet:{USABLE_DIARY_SHEET_ID}:sheet1")
+                        st.success(f"✅ {restored} 件を復元しました")
+                    except Exception as e:
+                        st.error(f"❌ 復元に失敗しました: {e}")
+            elif hits is not None:
+                st.info("該当する日記文はありません。")
+
 # =========================================================
 # --- Tab 4: 🖼 ④ 使用可能画像 ---
 # =========================================================
@@ -280,34 +455,87 @@ with tab4:
     st.header("🖼 使用可能画像ブラウザ（落ち店）")
     ROOT_PATH = "【落ち店】/"
 
-    @st.cache_data(show_spinner=False)
     def get_ochimise_folders_v9(update_tick):
-        blobs = GCS_CLIENT.list_blobs(GCS_BUCKET_NAME, prefix=ROOT_PATH, delimiter='/')
-        list(blobs)
-        return blobs.prefixes
+        def _list():
+            blobs = GCS_CLIENT.list_blobs(GCS_BUCKET_NAME, prefix=ROOT_PATH, delimiter='/')
+            list(blobs)
+            return sorted(blobs.prefixes)
+        return SNAPSHOTS.get(f"prefixes:{ROOT_PATH}", lambda: perf.call("gcs.list_prefixes", ROOT_PATH, _list), max_age=604800)
 
     if 'tab4_tick' not in st.session_state: st.session_state.tab4_tick = 0
 
-    c_btn, _ = st.columns([1.5, 4])
+    c_btn, c_hash, c_cc, _ = st.columns([1.5, 1.5, 1.5, 1])
     if c_btn.button("🔄 店舗リストを強制更新", key="update_4_img"):
         st.session_state.tab4_tick += 1
-        st.cache_data.clear()
+        clear_caches()
         st.rerun()
-
-    folders = get_ochimise_folders_v9(st.session_state.tab4_tick)
+    if c_hash.button("🧬 画像ハッシュ索引を再構築", key="hash_backfill_4"):
+        bar = st.progress(0.0, text="画像ハッシュを計算中...")
+        try:
+            added = get_hash_index().backfill(progress=lambda i, n: bar.progress(i / n, text=f"画像ハッシュを計算中... {i}/{n}"))
+            bar.empty()
+            st.success(f"✅ 索引を更新しました（新規 {added} 枚）")
+        except Exception as e:
+            bar.empty()
+            st.error(f"❌ 索引の再構築に失敗しました: {e}")
+    if c_cc.button("🗂️ 画像のキャッシュ設定を更新", key="cache_control_4"):
+        # 設定前にアップロードした画像にも Cache-Control を付け、ブラウザのキャッシュを効かせる
+        bar = st.progress(0.0, text="Cache-Control を設定中...")
+        try:
+            n = image_urls.backfill_cache_control(GCS_CLIENT.bucket(GCS_BUCKET_NAME),
+                                                  progress=lambda i, n: bar.progress(i / n, text=f"Cache-Control を設定中... {i}/{n}"))
+            bar.empty()
+            st.success(f"✅ {n} 枚の画像に Cache-Control を設定しました")
+        except Exception as e:
+            bar.empty()
+            st.error(f"❌ Cache-Control の設定に失敗しました: {e}")
+
+    folders = perf.cached_call("cache.ochimise_folders", ROOT_PATH, get_ochimise_folders_v9, st.session_state.tab4_tick)
     show_all = st.checkbox("📂 全画像表示（一括モード）", key="all_check_4")
 
+    # --- 選択状態：セッションごとに1つの構造で保持 ---
+    # manifest（画像名リスト）上の添字で管理し、all=True のときは「全件から flip を除いたもの」が選択中。
+    # 全選択・解除は flip を空にして gen を進めるだけ（O(1)）。チェックボックスのキーは gen 付きの短いキーで、
+    # gen が変わると古いウィジェット状態は描画されずに自動破棄される。
+    def get_selection(img_names, target_path):
+        # 一覧全体のハッシュで照合（途中の画像だけが入れ替わっても添字の指す画像が変わるので、選択を引き継がない）
+        manifest_key = (target_path, len(img_names), hash(tuple(img_names)))
+        sel = st.session_state.get("s4_sel")
+        if sel is None or sel["manifest"] != manifest_key:
+            # gen は引き継いで進める（同じキーの古いチェック状態を拾わないように）
+            sel = {"manifest": manifest_key, "all": False, "flip": set(), "gen": st.session_state.get("s4_gen", 0) + 1}
+            st.session_state.s4_sel = sel
+        st.session_state.s4_gen = sel["gen"]
+        return sel
+
+    def is_selected(sel, i):
+        return (i in sel["flip"]) != sel["all"]
+
+    def set_selection(sel, value, indices=None):
+        if indices is None:
+            sel["all"], sel["flip"] = value, set()
+        else:
+            for i in indices:
+                if value == sel["all"]: sel["flip"].discard(i)
+                else: sel["flip"].add(i)
+        sel["gen"] += 1
+
+    def toggle_selection(i):
+        st.session_state.s4_sel["flip"] ^= {i}
+
     @st.fragment
     def ochimise_action_fragment(folders, show_all):
         bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
         
-        @st.cache_data(ttl=600, show_spinner=False)
         def get_img_list_fast(path, is_all):
-            if is_all:
-                blobs = list(bucket.list_blobs(prefix=ROOT_PATH))
-            else:
-                blobs = list(bucket.list_blobs(prefix=path, delimiter='/'))
-            return [bl.name for bl in blobs if bl.name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))]
+            def _list():
+                if is_all:
+                    blobs = perf.call("gcs.list_blobs", ROOT_PATH, lambda: list(bucket.list_blobs(prefix=ROOT_PATH)))
+                else:
+                    blobs = perf.call("gcs.list_blobs", path, lambda: list(bucket.list_blobs(prefix=path, delimiter='/')))
+                # 画像名と世代番号（表示URLのキャッシュ用）
+                return {bl.name: bl.generation for bl in blobs if bl.name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))}
+            return SNAPSHOTS.get(f"imgs:{ROOT_PATH if is_all else path}:{int(is_all)}", _list, max_age=600)
 
         target_path = ROOT_PATH
         current_label = "一括"
@@ -321,42 +549,64 @@ with tab4:
                 current_label = sel
             else: return
 
-        img_names = get_img_list_fast(target_path, show_all)
+        img_gens = perf.cached_call("cache.img_list", target_path, get_img_list_fast, target_path, show_all)
+        img_names = list(img_gens)
         
         if img_names:
             search_q = st.text_input("🔍 絞り込み検索", key="q_4")
-            display_imgs = [n for n in img_names if search_q.lower() in n.lower()]
+            sel = get_selection(img_names, target_path)
+            if search_q:
+                display_idx = [i for i, n in enumerate(img_names) if search_q.lower() in n.lower()]
+            else:
+                display_idx = range(len(img_names))
 
             c1, c2, c3, c4 = st.columns([1, 1, 2, 2])
+            # ボタンはチェックボックスより先に評価されるので、rerunせずにそのまま反映される
             if c1.button("✅ 全選択"):
-                for n in display_imgs: st.session_state[f"s4_{n}"] = True
-                st.rerun()
+                set_selection(sel, True, display_idx if search_q else None)
             if c2.button("⬜️ 解除"):
-                for n in display_imgs: st.session_state[f"s4_{n}"] = False
-                st.rerun()
+                set_selection(sel, False, display_idx if search_q else None)
 
-            selected = [n for n in display_imgs if st.session_state.get(f"s4_{n}")]
+            if search_q:
+                selected = [img_names[i] for i in display_idx if is_selected(sel, i)]
+            elif sel["all"]:
+                selected = [n for i, n in enumerate(img_names) if i not in sel["flip"]]
+            else:
+                selected = [img_names[i] for i in sorted(sel["flip"])]
 
             if selected:
+                import zipfile
                 zip_buf = BytesIO()
                 with zipfile.ZipFile(zip_buf, "w") as zf:
                     for p in selected:
-                        zf.writestr(p.split('/')[-1], bucket.blob(p).download_as_bytes())
+                        zf.writestr(p.split('/')[-1], perf.call("gcs.download", p, bucket.blob(p).download_as_bytes))
                 
                 c3.download_button(f"① {len(selected)}枚を保存(ZIP)", zip_buf.getvalue(), f"{current_label}.zip", type="primary", use_container_width=True)
                 
                 if c4.button(f"② 保存完了・削除実行", key="del_btn_4", type="secondary", use_container_width=True):
-                    for n in selected: bucket.blob(n).delete()
-                    for n in selected: st.session_state[f"s4_{n}"] = False
-                    st.cache_data.clear()
+                    h_index = get_hash_index()
+                    for n in selected:
+                        perf.call("gcs.delete", n, bucket.blob(n).delete)
+                        h_index.remove(n)
+                    h_index.save()
+                    st.session_state.s4_sel = None
+                    clear_caches()
                     st.rerun()
                 st.warning("⚠️ 保存後、必ず②を押して消去してください（使い回し防止）")
 
             cols = st.columns(8)
-            for idx, b_name in enumerate(display_imgs):
+            for idx, i in enumerate(display_idx):
+                b_name = img_names[i]
                 with cols[idx % 8]:
-                    st.image(get_cached_url(b_name), use_container_width=True)
-                    st.checkbox("選", key=f"s4_{b_name}", label_visibility="collapsed")
+                    st.image(get_cached_url(b_name, img_gens[b_name]), use_container_width=True)
+                    st.checkbox("選", value=is_selected(sel, i), key=f"s4_{sel['gen']}_{i}",
+                                on_change=toggle_selection, args=(i,), label_visibility="collapsed")
                     st.caption(f":grey[{b_name.split('/')[-1][:10]}]")
 
     ochimise_action_fragment(folders, show_all)
+
+perf.STARTUP.mark("render")
+perf.STARTUP.finish("diary_app")
+perf.render_startup_report(st)
+perf.render_trace_panel(st)
+transport.render_pool_panel(st)
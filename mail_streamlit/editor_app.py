@@ -1,20 +1,28 @@
+import perf
+perf.STARTUP.begin()
 import streamlit as st
-import pandas as pd
-import gspread
+perf.begin_rerun(st, "editor_app")
 import datetime
-import urllib.parse
 import re
-from google.cloud import storage
+import time
+from image_hash import ImageHashIndex
+from retire_jobs import RetireJobRunner, sheet_lock, journal_store
+from snapshot_cache import SNAPSHOTS
+import account_data
+import registration
+import content_check
+import account_summary
+import transport
+import image_urls
+import sheet_routing
 
 # --- 1. 定数・設定 ---
 try:
+    # 対応表（sheet_routing）が無いときの既定のスプレッドシート。アカウント・ログイン情報・ストックの場所は対応表から決める
     SHEET_ID = st.secrets["google_resources"]["spreadsheet_id"]
-    ACCOUNT_STATUS_SHEET_ID = "1_GmWjpypap4rrPGNFYWkwcQE1SoK3QOMJlozEhkBwVM"
     
     GCS_BUCKET_NAME = "auto-poster-images"
-    ACCOUNT_OPTIONS = ["A", "B", "C", "D"]
-    SHEET_MAP = {opt: f"投稿{opt}アカウント" for opt in ACCOUNT_OPTIONS}
-    DF_COLS = ["エリア", "店名", "媒体", "投稿時間", "女の子の名前", "タイトル", "本文"]
+    DF_COLS = account_data.DF_COLS
 except KeyError:
     st.error("🚨 secrets.tomlの設定を確認してください。")
     st.stop()
@@ -41,28 +49,291 @@ def is_time_match(base_time, target_filename, window_min=20):
     diff = abs((base_time - t_target).total_seconds()) / 60
     return diff <= window_min or diff >= (1440 - window_min)
 
-def get_cached_url(blob_name):
-    return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{urllib.parse.quote(blob_name)}"
+def get_cached_url(blob_name, generation=None):
+    # 世代番号付きURL（上書きされると URL が変わる）。署名付きURLの設定なら署名をキャッシュして使い回す
+    return image_urls.image_url(GCS_CLIENT.bucket(GCS_BUCKET_NAME), blob_name, generation)
 
 # --- 3. API接続 & キャッシュ設定 ---
 @st.cache_resource(ttl=3600)
 def get_clients():
-    gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
-    gcs = storage.Client.from_service_account_info(st.secrets["gcp_service_account"])
+    # 重いライブラリはクライアント作成時に読み込む（認証・接続プールは transport で全アプリ共通）
+    gc = transport.gspread_client(st.secrets["gcp_service_account"])
+    gcs = transport.storage_client(st.secrets["gcp_service_account"])
     return gc, gcs
 
+@st.cache_resource(ttl=3600)
+def get_spreadsheet(sheet_key):
+    """スプレッドシートを開く（メタデータ取得の往復は初回利用時の1回だけ）"""
+    return perf.call("sheets.open_by_key", sheet_key, GC.open_by_key, sheet_key)
+
+perf.STARTUP.mark("import")
 GC, GCS_CLIENT = get_clients()
+perf.STARTUP.mark("auth")
+
+def get_router():
+    """アカウント（＋エリア）→ スプレッドシートの対応表。shard_admin.py の変更は ROUTING_MAX_AGE 秒以内に反映される"""
+    return sheet_routing.cached(GCS_CLIENT.bucket(GCS_BUCKET_NAME), SHEET_ID)
+
+def current_router():
+    """書き込み直前に使う対応表（世代番号を確かめ、変わっていれば読み直したもの）"""
+    return sheet_routing.current(get_router(), GCS_CLIENT.bucket(GCS_BUCKET_NAME), SHEET_ID)
+
+ROUTER = get_router()
+# 対応表が変わった（行の移動があった）ら、シートのスナップショットを捨てて行番号のずれた古い内容で書き込まないようにする
+if SNAPSHOTS.get("routing:seen", lambda: ROUTER.generation, max_age=float("inf")) != ROUTER.generation:
+    for _loc in ROUTER.all_locations():
+        SNAPSHOTS.forget(_loc.snapshot_key)
+    SNAPSHOTS.put("routing:seen", ROUTER.generation)
+SHEET_ID = ROUTER.home_id   # 集計シートを置くスプレッドシート
+ACCOUNT_STATUS_SHEET_ID = ROUTER.status_id
+USABLE_DIARY_SHEET_ID = ROUTER.stock_id
+ACCOUNT_OPTIONS = ROUTER.accounts
+SHEET_MAX_AGE = 604800   # シートのスナップショットを取り直すまでの秒数（書き込みは都度反映するので長め）
+
+@st.cache_resource
+def get_hash_index():
+    return ImageHashIndex(GCS_CLIENT.bucket(GCS_BUCKET_NAME))
+
+@st.cache_resource
+def get_retire_runner():
+    """落ち店移動ジョブの実行器（プロセス内で共有。未完了ジョブはジャーナルから復元）"""
+    h_index = get_hash_index()
+    return RetireJobRunner(
+        GC, GCS_CLIENT.bucket(GCS_BUCKET_NAME), current_router, journal=journal_store(GCS_CLIENT),
+        on_blob_moved=h_index.rename, on_job_done=lambda job: on_retire_done(job, h_index),
+    )
+
+def on_retire_done(job, h_index):
+    """落ち店移動の完了時（バックグラウンドスレッド）：ハッシュ索引を保存し、集計シートから店舗を外す"""
+    h_index.save()
+    try:
+        account_summary.remove_store(GC.open_by_key(current_router().home_id), job["acc"], job["area"], job["shop"])
+        SNAPSHOTS.forget(SUMMARY_KEY)
+    except Exception:
+        pass  # 集計のずれは「集計を再計算」で直せるので、移動自体は完了扱いにする
+
+JOB_STATE_LABELS = {"queued": "⏳ 待機中", "running": "🚚 実行中", "done": "✅ 完了", "failed": "❌ 失敗", "interrupted": "⏸ 中断"}
+
+def retire_jobs_panel():
+    """落ち店移動ジョブの進捗表示（実行中は2秒ごとにこの部分だけ更新）"""
+    runner = get_retire_runner()
+
+    @st.fragment(run_every=2 if runner.has_active() else None)
+    def _panel():
+        jobs = runner.list_jobs()
+        if not jobs: return
+        st.markdown("### 🚚 落ち店移動ジョブ")
+        for job in jobs:
+            done, total, rate = runner.progress(job)
+            label = f"{JOB_STATE_LABELS.get(job['state'], job['state'])}　{job['acc']} / {job['area']} / {job['shop']}"
+            detail = (f"転記 {job['rows_copied']}/{job['rows_total']}行・削除 {job['rows_deleted']}/{job['rows_total']}行・"
+                      f"画像 {job['blobs_moved']}/{job['blobs_total']}枚（{rate:.1f} 件/秒）")
+            c_bar, c_btn = st.columns([5, 1])
+            c_bar.progress(done / total, text=f"{label}　{detail}")
+            if job["state"] in ("failed", "interrupted"):
+                if job.get("error"): c_bar.caption(f":red[{job['error']}]")
+                if c_btn.button("▶ 再開", key=f"resume_{job['id']}", use_container_width=True):
+                    runner.resume(job["id"])
+                    st.rerun(scope="fragment")
+        if any(j["state"] == "done" for j in jobs):
+            if st.button("🧹 完了したジョブを消す", key="clear_jobs"):
+                runner.clear_finished()
+                st.rerun(scope="fragment")
+
+    _panel()
+
+def clear_caches():
+    """「更新」ボタン用：メモリとディスクのキャッシュを次回アクセス時に取り直させる"""
+    st.cache_data.clear()
+    SNAPSHOTS.invalidate()
+    sheet_routing.clear_cache()
 
-@st.cache_data(ttl=604800)
 def get_full_sheet_data(sheet_key, worksheet_name):
+    # ディスクにスナップショットがあれば即返し、裏で取り直す（再起動直後もすぐ表示できる）
+    def _fetch():
+        sh = get_spreadsheet(sheet_key)
+        ws = perf.call("sheets.worksheet", worksheet_name, sh.worksheet, worksheet_name)
+        rows = perf.call("sheets.get_all_values", worksheet_name, ws.get_all_values)
+        perf.STARTUP.mark("first_api")
+        return rows
     try:
-        sh = GC.open_by_key(sheet_key)
-        ws = sh.worksheet(worksheet_name)
-        return ws.get_all_values()
+        return SNAPSHOTS.get(f"sheet:{sheet_key}:{worksheet_name}", _fetch, max_age=SHEET_MAX_AGE)
     except Exception as e:
         st.error(f"シート読み込みエラー: {e}")
         return None
 
+def get_all_account_data(codes=None):
+    """全アカウント（codes 指定時はその分）のシートを {置き場所: 行リスト} で返す。
+    キャッシュに無い分だけ、スプレッドシート（シャード）ごとに values_batchGet 1回・シャード同士は並列で取得する"""
+    locs = ROUTER.all_locations(codes)
+    missing = [loc for loc in locs if not SNAPSHOTS.peek(loc.snapshot_key, max_age=SHEET_MAX_AGE)]
+    if missing:
+        try:
+            for loc, rows in sheet_routing.read_locations(get_spreadsheet, missing).items():
+                if isinstance(rows, list):
+                    SNAPSHOTS.put(loc.snapshot_key, rows)
+        except Exception:
+            pass  # 取れなかった分は下の get_full_sheet_data で個別に読む
+    return {loc: perf.cached_call("cache.sheet", loc.worksheet, get_full_sheet_data, loc.spreadsheet_id, loc.worksheet) for loc in locs}
+
+def get_account_frame(code):
+    """1アカウント分の DataFrame（複数のシャードにまたがっていてもまとめる。__row__ は各シートの行番号）"""
+    return sheet_routing.account_frame(ROUTER, code, get_all_account_data([code]))
+
+def row_worksheet(code, area):
+    """書き込み先のシート（対応表の世代番号を確かめてから引く）"""
+    loc = current_router().location(code, area)
+    return loc, perf.call("sheets.worksheet", loc.worksheet, get_spreadsheet(loc.spreadsheet_id).worksheet, loc.worksheet)
+
+def locate_row(ws, row):
+    """row（スナップショットから作った行）の今の行番号。見つからない・決められなければ None
+    スナップショットの行番号は古いことがあるので、書き込み直前に sheet_lock の中で読み直して探す
+    （行IDがあれば Z 列だけ読んで行IDで、無ければ全列を読んで内容で照合する）"""
+    rid = row.get("__id__") or ""
+    if rid:
+        ids = perf.call("sheets.col_values", ws.title, ws.col_values, account_data.ROW_ID_COL + 1)
+        hits = [i for i, v in enumerate(ids, 1) if v.strip() == rid]
+    else:
+        want = [str(row[c]).strip() for c in DF_COLS]
+        rows = perf.call("sheets.get_all_values", ws.title, ws.get_all_values)
+        hits = [i for i, r in enumerate(rows[1:], 2) if [c.strip() for c in (r + [""] * len(DF_COLS))[:len(DF_COLS)]] == want]
+    if row["__row__"] in hits:
+        return row["__row__"]
+    return hits[0] if len(hits) == 1 else None
+
+SUMMARY_KEY = f"sheet:{SHEET_ID}:{account_summary.SUMMARY_SHEET}"
+
+def get_account_summary():
+    """店舗アカウント状況の集計行。集計シートが無ければ空（作り直しは「集計を再計算」ボタンで行う）"""
+    def _fetch():
+        return account_summary.read_rows(get_spreadsheet(SHEET_ID)) or []
+    return SNAPSHOTS.get(SUMMARY_KEY, _fetch, max_age=300)
+
+def folder_blob_key(prefix):
+    # 値の形を一覧（list）から辞書に変えたのでキー名も変える（古いスナップショットの一覧を辞書として読まないように）
+    return f"folder_index:{GCS_BUCKET_NAME}:{prefix}"
+
+def blob_row_id(blob):
+    return (blob.metadata or {}).get(registration.ROW_ID_META, "")
+
+def list_folder_blobs(prefix):
+    """店舗フォルダ内の画像を {"by_id": {行ID: [画像名]}, "legacy": [行IDのない画像名], "all": [全画像名],
+    "entries": {画像名: サイズ・ハッシュ}} で返す（カードごとに list_blobs しないよう、フォルダ単位でキャッシュ）"""
+    bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
+    def _list():
+        by_id, legacy, names, entries = {}, [], [], {}
+        for b in perf.call("gcs.list_blobs", prefix, lambda: list(bucket.list_blobs(prefix=prefix))):
+            names.append(b.name)
+            entries[b.name] = registration.blob_entry(b)
+            rid = blob_row_id(b)
+            if rid: by_id.setdefault(rid, []).append(b.name)
+            else: legacy.append(b.name)
+        return {"by_id": by_id, "legacy": legacy, "all": names, "entries": entries}
+    return SNAPSHOTS.get(folder_blob_key(prefix), _list, max_age=600)
+
+def fuzzy_match(names, name_norm, base_time):
+    """行IDのない画像用：名前を含み、投稿時間が前後20分以内の画像"""
+    return [
+        name for name in names
+        if (name_norm in normalize_text(name.split('/')[-1]) or normalize_text(name.split('/')[-1]) in name_norm)
+        and is_time_match(base_time, name.split('/')[-1])
+    ]
+
+CARDS_PER_PAGE = 10
+
+@st.fragment
+def diary_card(sel_acc, sel_area, sel_store, row):
+    """日記1件分のカード。保存・画像追加・削除はこのカードだけを再実行する"""
+    key = f"{sel_acc}_{row['__row__']}"
+    media_type = str(row["媒体"]).strip()
+    target_folder = f"デリじゃ {sel_store}" if media_type == "デリじゃ" else sel_store
+    prefix = f"{sel_area}/{target_folder}/"
+    bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
+
+    # 行IDがあれば辞書を1回引くだけ。無い（古い）行・画像だけ名前と時間のあいまい一致で探す
+    folder = list_folder_blobs(prefix)
+    entries = folder.get("entries", {})   # entries を持たない古いスナップショットもある
+    row_id = row.get("__id__") or ""
+    matched_files = folder["by_id"].get(row_id, []) if row_id else []
+    if not matched_files:
+        matched_files = fuzzy_match(folder["legacy"] if row_id else folder["all"],
+                                    normalize_text(row["女の子の名前"]), parse_to_datetime(row["投稿時間"]))
+
+    with st.container():
+        st.markdown(f"#### 👤 {row['女の子の名前']} / ⏰ {row['投稿時間']} / 📱 {row['媒体']}")
+        col_txt, col_img, col_ops = st.columns([2.5, 1, 1])
+
+        with col_txt:
+            new_title = st.text_input("タイトル", row["タイトル"], key=f"ti_{key}")
+            new_body = st.text_area("本文", row["本文"], key=f"bo_{key}", height=400)
+            if st.button("💾 内容を保存", key=f"sv_{key}", type="primary"):
+                loc, ws = row_worksheet(sel_acc, sel_area)
+                with sheet_lock(loc.spreadsheet_id, loc.worksheet):
+                    n = locate_row(ws, row)
+                    if n is not None:
+                        perf.call("sheets.update_cell", ws.title, ws.update_cell, n, 6, new_title)
+                        perf.call("sheets.update_cell", ws.title, ws.update_cell, n, 7, new_body)
+                # ページ移動後に古い内容が出ないよう、次の全体再実行でシートを読み直す
+                SNAPSHOTS.forget(loc.snapshot_key)
+                if n is None:
+                    st.error("❌ シート上でこの日記が見つかりません（移動・削除された可能性があります）。「🔄 更新」してからやり直してください。")
+                else:
+                    row.update({"タイトル": new_title, "本文": new_body})   # 次の保存も今の内容で探す
+                    st.toast(f"{row['女の子の名前']} の日記を保存しました")
+
+        with col_img:
+            if matched_files:
+                for m_path in matched_files:
+                    st.image(get_cached_url(m_path, entries.get(m_path, {}).get("generation")), use_container_width=True)
+                    with st.popover("🗑️ 削除"):
+                        if st.button("実行する", key=f"del_{key}_{m_path}"):
+                            perf.call("gcs.delete", m_path, bucket.blob(m_path).delete)
+                            h_index = get_hash_index()
+                            h_index.remove(m_path)
+                            h_index.save()
+                            SNAPSHOTS.forget(folder_blob_key(prefix))
+                            st.rerun(scope="fragment")
+            else:
+                st.error("🚨 画像なし")
+
+        with col_ops:
+            up_file = st.file_uploader("📥 画像追加", type=["jpg","png","jpeg"], key=f"up_{key}")
+            if up_file:
+                if st.button("🚀 アップ", key=f"u_btn_{key}"):
+                    ext = up_file.name.split('.')[-1]
+                    # アップロード先も媒体別のフォルダに固定
+                    new_blob_name = f"{sel_area}/{target_folder}/{row['投稿時間']}_{row['女の子の名前']}.{ext}"
+                    if not row_id:
+                        # 行IDのない古い行は、ここで ID を振ってシートにも書いておく（書き込む行は内容で探し直す）
+                        loc, ws = row_worksheet(sel_acc, sel_area)
+                        registration.ensure_row_id_column(get_spreadsheet(loc.spreadsheet_id), ws)
+                        with sheet_lock(loc.spreadsheet_id, loc.worksheet):
+                            n = locate_row(ws, row)
+                            if n is not None:
+                                row_id = registration.new_row_id()
+                                registration.set_row_id(ws, n, row_id)
+                                row["__id__"] = row_id
+                        SNAPSHOTS.forget(loc.snapshot_key)
+                        if not row_id:
+                            st.error("❌ シート上でこの日記が見つかりません（移動・削除された可能性があります）。「🔄 更新」してからやり直してください。")
+                            return
+                    h_index = get_hash_index()
+                    # 二度押しなどで同じ内容の画像が既にあれば送らない
+                    up_stats = registration.UploadStats()
+                    similar = registration.upload_image(bucket, new_blob_name, up_file.getvalue(), up_file.type, h_index, row_id=row_id,
+                                                        existing=entries.get(new_blob_name), stats=up_stats)
+                    h_index.save()
+                    SNAPSHOTS.forget(folder_blob_key(prefix))
+                    if up_stats.skipped:
+                        st.toast("同じ画像がアップロード済みのため送信を省略しました")
+                    if similar:
+                        # rerunすると警告が消えるため、アップロード結果と一緒に表示して止める
+                        st.warning("⚠️ 使用済み画像と酷似しています（使い回しの可能性）: " + " / ".join(n for _, n in similar[:3]))
+                    else:
+                        st.rerun(scope="fragment")
+
+        st.markdown("<div class='diary-divider'></div>", unsafe_allow_html=True)
+
 # --- 4. UI構築 ---
 st.set_page_config(layout="wide", page_title="写メ日記投稿データ管理")
 
@@ -100,22 +371,17 @@ def main():
         with c6:
             st.write("") 
             if st.button("🔄 更新", key="btn_reload_tab1", use_container_width=True):
-                st.cache_data.clear()
+                clear_caches()
                 st.rerun()
         
-        data = get_full_sheet_data(SHEET_ID, SHEET_MAP[sel_acc])
+        # 共通データ層で変換済み（エリア〜名前は前後の空白を除去済み、__row__ はシートの行番号）
+        full_df = get_account_frame(sel_acc)
         
-        if not data or len(data) <= 1:
+        if full_df.empty:
             st.warning("有効なデータがありません。")
             st.markdown('</div>', unsafe_allow_html=True)
         else:
-            full_df = pd.DataFrame(data[1:])
-            full_df = full_df.iloc[:, :7]
-            while full_df.shape[1] < 7: full_df[full_df.shape[1]] = ""
-            full_df.columns = DF_COLS
-            full_df['__row__'] = range(2, len(data) + 1)
-            full_df = full_df[full_df["店名"].str.strip() != ""]
-            full_df = full_df[full_df["女の子の名前"].str.strip() != ""]
+            full_df = full_df[(full_df["店名"] != "") & (full_df["女の子の名前"] != "")]
 
             with c2:
                 areas = sorted(full_df["エリア"].unique())
@@ -154,7 +420,7 @@ def main():
                     # 特定されたフォルダのみから画像を取得
                     for folder in target_folders:
                         prefix = f"{sel_area}/{folder}/"
-                        all_matched_blobs.extend(list(bucket.list_blobs(prefix=prefix)))
+                        all_matched_blobs.extend(perf.call("gcs.list_blobs", prefix, lambda: list(bucket.list_blobs(prefix=prefix))))
                     
                     if all_matched_blobs:
                         from io import BytesIO
@@ -166,7 +432,7 @@ def main():
                                 if search_query and normalize_text(search_query) not in normalize_text(blob.name):
                                     continue
                                 try:
-                                    f_bytes = blob.download_as_bytes()
+                                    f_bytes = perf.call("gcs.download", blob.name, blob.download_as_bytes)
                                     # ZIP内でのファイル名重複を避けるため、フォルダ名も含めたパスにする
                                     arc_name = blob.name.replace(f"{sel_area}/", "")
                                     zf.writestr(arc_name, f_bytes)
@@ -200,64 +466,22 @@ def main():
                     ]
 
                 st.subheader(f"📊 {sel_store} ({len(target_df)} 件)")
-                bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
+
+                # 10件ずつ表示（店舗・検索条件が変わったら1ページ目に戻す）
+                page_ctx = (sel_acc, sel_area, sel_store, search_query)
+                if st.session_state.get("ed_page_ctx") != page_ctx:
+                    st.session_state.ed_page_ctx = page_ctx
+                    st.session_state.ed_page = 1
+                n_pages = max(1, -(-len(target_df) // CARDS_PER_PAGE))
+                p_col, p_info = st.columns([1, 4])
+                page = p_col.number_input("ページ", min_value=1, max_value=n_pages, key="ed_page")
+                start = (page - 1) * CARDS_PER_PAGE
+                p_info.caption(f"{start + 1}〜{min(start + CARDS_PER_PAGE, len(target_df))} 件目 / 全 {len(target_df)} 件（{n_pages} ページ）")
                 st.write("---")
 
-                for idx, row in target_df.iterrows():
-                    # --- 【修正】日記ごとの表示ロジック ---
-                    media_type = str(row["媒体"]).strip()
-                    target_folder = f"デリじゃ {sel_store}" if media_type == "デリじゃ" else sel_store
-                    
-                    prefix = f"{sel_area}/{target_folder}/"
-                    # キャッシュ効率のためblobリストはループ外で取得するのが理想ですが、
-                    # 厳密なフォルダ分けを優先するためprefix指定で取得します
-                    current_blobs = list(bucket.list_blobs(prefix=prefix))
-                    
-                    base_time = parse_to_datetime(row["投稿時間"])
-                    name_norm = normalize_text(row["女の子の名前"])
-                    matched_files = [
-                        img.name for img in current_blobs 
-                        if (name_norm in normalize_text(img.name.split('/')[-1]) or normalize_text(img.name.split('/')[-1]) in name_norm) 
-                        and is_time_match(base_time, img.name.split('/')[-1])
-                    ]
+                for _, row in target_df.iloc[start:start + CARDS_PER_PAGE].iterrows():
+                    diary_card(sel_acc, sel_area, sel_store, row.to_dict())
 
-                    with st.container():
-                        st.markdown(f"#### 👤 {row['女の子の名前']} / ⏰ {row['投稿時間']} / 📱 {row['媒体']}")
-                        col_txt, col_img, col_ops = st.columns([2.5, 1, 1])
-
-                        with col_txt:
-                            new_title = st.text_input("タイトル", row["タイトル"], key=f"ti_{idx}")
-                            new_body = st.text_area("本文", row["本文"], key=f"bo_{idx}", height=400)
-                            if st.button("💾 内容を保存", key=f"sv_{idx}", type="primary"):
-                                ws = GC.open_by_key(SHEET_ID).worksheet(SHEET_MAP[sel_acc])
-                                ws.update_cell(row['__row__'], 6, new_title)
-                                ws.update_cell(row['__row__'], 7, new_body)
-                                st.toast(f"{row['女の子の名前']} の日記を保存しました")
-
-                        with col_img:
-                            if matched_files:
-                                for m_path in matched_files:
-                                    st.image(get_cached_url(m_path), use_container_width=True)
-                                    with st.popover("🗑️ 削除"):
-                                        if st.button("実行する", key=f"del_{idx}_{m_path}"):
-                                            bucket.blob(m_path).delete()
-                                            st.rerun()
-                            else:
-                                st.error("🚨 画像なし")
-
-                        with col_ops:
-                            up_file = st.file_uploader("📥 画像追加", type=["jpg","png","jpeg"], key=f"up_{idx}")
-                            if up_file:
-                                if st.button("🚀 アップ", key=f"u_btn_{idx}"):
-                                    ext = up_file.name.split('.')[-1]
-                                    # アップロード先も媒体別のフォルダに固定
-                                    new_blob_name = f"{sel_area}/{target_folder}/{row['投稿時間']}_{row['女の子の名前']}.{ext}"
-                                    blob = bucket.blob(new_blob_name)
-                                    blob.upload_from_string(up_file.getvalue(), content_type=up_file.type)
-                                    st.rerun()
-                        
-                        st.markdown("<div class='diary-divider'></div>", unsafe_allow_html=True)
-                        
     # =========================================================================
     # TAB 2: データ不備チェック
     # =========================================================================
@@ -270,31 +494,33 @@ def main():
         with ce2:
             st.write("")
             if st.button("🔄 最新データでスキャン", key="btn_reload_tab2", use_container_width=True):
-                st.cache_data.clear()
+                clear_caches()
                 st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
         
-        data_tab2 = get_full_sheet_data(SHEET_ID, SHEET_MAP[sel_acc_tab2])
-        if data_tab2 and len(data_tab2) > 1:
-            df2 = pd.DataFrame(data_tab2[1:], columns=DF_COLS + [f"extra_{i}" for i in range(len(data_tab2[0])-7)])
-            df2 = df2[df2["店名"].str.strip() != ""]
+        df2 = get_account_frame(sel_acc_tab2)
+        if not df2.empty:
+            df2 = df2[df2["店名"] != ""]
             
             bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
             all_blobs = []
             for area in df2["エリア"].unique():
-                all_blobs.extend(list(bucket.list_blobs(prefix=f"{area}/")))
+                all_blobs.extend(perf.call("gcs.list_blobs", f"{area}/", lambda: list(bucket.list_blobs(prefix=f"{area}/"))))
             
+            linked_ids = {blob_row_id(b) for b in all_blobs} - {""}
             missing_images = []
             for _, row in df2.iterrows():
+                if row["__id__"] in linked_ids:
+                    continue
                 b_time = parse_to_datetime(row["投稿時間"])
                 n_norm = normalize_text(row["女の子の名前"])
                 s_norm = normalize_text(row["店名"])
                 store_blobs = [b.name for b in all_blobs if s_norm in normalize_text(b.name)]
                 matched = [img for img in store_blobs if (n_norm in normalize_text(img) or normalize_text(img) in n_norm) and is_time_match(b_time, img.split('/')[-1])]
-                if not matched and row["女の子の名前"].strip() != "":
+                if not matched and row["女の子の名前"] != "":
                     missing_images.append(row)
             
-            store_counts = df2["店名"].value_counts()
+            store_counts = df2.groupby("店名", observed=True).size().sort_values(ascending=False)
             low_count_stores = store_counts[store_counts <= 20]
 
             c_err1, c_err2 = st.columns(2)
@@ -313,28 +539,45 @@ def main():
                 else:
                     st.success("全店舗20件以上あります。")
 
+            # 禁止語・文字数・タイトル空欄・投稿時間の形式を全件まとめて検査
+            t_scan = time.perf_counter()
+            issues = content_check.scan(df2)
+            scan_ms = (time.perf_counter() - t_scan) * 1000
+            st.subheader(f"🚫 内容の不備 ({issues.index.nunique()}件)")
+            st.caption(f"※ {len(df2)} 件を {scan_ms:.0f} ms で検査（禁止語リスト: banned_words.txt）")
+            if not issues.empty:
+                issue_view = content_check.with_context(df2, issues, ["エリア", "店名", "女の子の名前", "投稿時間", "__row__"])
+                st.dataframe(issue_view.rename(columns={"__row__": "行"}), hide_index=True, use_container_width=True)
+            else:
+                st.success("内容の不備はありません。")
+
     # =========================================================================
     # TAB 3: 店舗アカウント状況 (旧Tab2)
     # =========================================================================
     with tab3:
         st.markdown("## 📊 店舗アカウント状況")
-        combined_data = []
-        acc_summary = {}; acc_counts = {}
+        c_sum, _ = st.columns([1, 4])
+        if c_sum.button("🧮 集計を再計算", key="btn_recompute_tab3", use_container_width=True):
+            # 全シートを読み直して集計シートを作り直す（ずれたとき用）
+            clear_caches()
+            try:
+                if current_router().generation != ROUTER.generation:
+                    st.warning("⚠️ シートの振り分けが変わりました。画面を読み直してからもう一度押してください。")
+                else:
+                    account_summary.recompute(get_spreadsheet(SHEET_ID), sheet_routing.all_frames(ROUTER, get_all_account_data()))
+                    SNAPSHOTS.forget(SUMMARY_KEY)
+                    st.toast("集計シートを作り直しました")
+            except Exception as e:
+                st.error(f"❌ 再計算に失敗しました: {e}")
+        acc_counts, acc_summary = {}, {}
         try:
-            for opt in ACCOUNT_OPTIONS:
-                rows = get_full_sheet_data(SHEET_ID, SHEET_MAP[opt])
-                if rows and len(rows) > 1:
-                    for i, r in enumerate(rows[1:]):
-                        if any(str(c).strip() for c in r[:7]):
-                            combined_data.append([opt, i+2] + [r[j] if j<len(r) else "" for j in range(7)])
-                            a, s, m = str(r[0]).strip(), str(r[1]).strip(), str(r[2]).strip()
-                            acc_counts[opt] = acc_counts.get(opt, 0) + 1
-                            if opt not in acc_summary: acc_summary[opt] = {}
-                            if a not in acc_summary[opt]: acc_summary[opt][a] = set()
-                            acc_summary[opt][a].add(f"{m} : {s}")
-        except: pass
-
-        if combined_data:
+            acc_counts, acc_summary = account_summary.to_summary(perf.cached_call("cache.summary", SUMMARY_KEY, get_account_summary))
+            if not acc_counts:
+                st.info("ℹ️ 集計シートが空です。「🧮 集計を再計算」を押すと全シートから作り直します。")
+        except Exception as e:
+            st.error(f"集計シート読み込みエラー: {e}")
+
+        if acc_counts:
             for acc_code in ACCOUNT_OPTIONS:
                 count = acc_counts.get(acc_code, 0)
                 st.markdown(f"### 👤 投稿{acc_code}アカウント `{count} 件`")
@@ -359,42 +602,26 @@ def main():
                         st.session_state.confirm_move = False
                         st.rerun()
                     if col_yes.button("⭕ はい、実行します", type="primary", use_container_width=True):
-                        import time
+                        # 移動はバックグラウンドジョブとして実行（ブラウザを閉じても継続し、途中停止は再開できる）
+                        runner = get_retire_runner()
                         try:
-                            sh_stock = GC.open_by_key("1e-iLey43A1t0bIBoijaXP55t5fjONdb0ODiTS53beqM")
-                            ws_stock = sh_stock.sheet1
                             for item in selected_shops:
-                                ws_main = GC.open_by_key(SHEET_ID).worksheet(SHEET_MAP[item['acc']])
-                                main_data = ws_main.get_all_values()
-                                for row_idx in range(len(main_data), 0, -1):
-                                    row = main_data[row_idx-1]
-                                    if len(row) >= 2 and row[1] == item['shop']:
-                                        ws_stock.append_row([None, None, row[5], row[6]], value_input_option='USER_ENTERED')
-                                        time.sleep(2.0)
-                                        ws_main.delete_rows(row_idx)
-                                status_sprs = GC.open_by_key(ACCOUNT_STATUS_SHEET_ID)
-                                ws_link = status_sprs.worksheet(SHEET_MAP[item['acc']])
-                                link_data = ws_link.get_all_values()
-                                for row_idx in range(len(link_data), 0, -1):
-                                    if len(link_data[row_idx-1]) >= 2 and link_data[row_idx-1][1] == item['shop']:
-                                        ws_link.delete_rows(row_idx)
-                                        break
-                                bucket = GCS_CLIENT.bucket(GCS_BUCKET_NAME)
-                                found_blobs = []
-                                for pfx in [f"{item['area']}/{item['shop']}/", f"{item['area']}/デリじゃ {item['shop']}/"]:
-                                    blobs = list(bucket.list_blobs(prefix=pfx))
-                                    if blobs: found_blobs = blobs; break
-                                for b in found_blobs:
-                                    file_name = b.name.split('/')[-1]
-                                    new_name = f"【落ち店】/{item['shop']}/{file_name}"
-                                    bucket.copy_blob(b, bucket, new_name)
-                                    b.delete()
-                            st.success("🎉 移動完了！ 最新データにするには更新ボタンを押してください。")
+                                runner.submit(item['acc'], item['area'], item['shop'])
+                            for k in [k for k in st.session_state if k.startswith("move_")]:
+                                del st.session_state[k]
                             st.session_state.confirm_move = False
+                            st.success("🚚 移動ジョブを開始しました。進捗は下に表示されます（完了後に更新ボタンを押してください）。")
                         except Exception as e:
                             st.error(f"エラー: {e}")
 
+        retire_jobs_panel()
+
 if __name__ == "__main__":
     main()
+    perf.STARTUP.mark("render")
+    perf.STARTUP.finish("editor_app")
+    perf.render_startup_report(st)
+    perf.render_trace_panel(st)
+    transport.render_pool_panel(st)
 
 
@@ -0,0 +1,217 @@
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import perf
+
+# --- 画像の知覚ハッシュ索引（使い回し防止） ---
+# GCS上の全画像について 64bit の dHash を保持し、BK木でハミング距離検索する。
+# 索引本体は バケット内の JSON（blob名 → 16進ハッシュ）として永続化する。
+
+INDEX_BLOB = "_system/image_hashes.json"
+OCHIMISE_ROOT = "【落ち店】/"
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+NEAR_DUP_DISTANCE = 6  # これ以下のハミング距離を「ほぼ同一画像」とみなす
+
+
+def dhash(data, size=8):
+    """画像バイト列から 64bit の dHash を計算"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEGは縮小デコードして高速化（バックフィル時の負荷対策）
+        img.draft("L", (size * 8, size * 8))
+        img = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+        px = list(img.getdata())
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return bits
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def store_folder(blob_name):
+    """blob名から店舗フォルダ（"エリア/店名/" や "【落ち店】/店名/"）を取り出す"""
+    return blob_name.rsplit('/', 1)[0] + '/'
+
+
+class BKTree:
+    """ハミング距離のBK木。ノードは [hash, blob名の集合, {距離: 子ノード}]"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, h, name):
+        if self.root is None:
+            self.root = [h, {name}, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].add(name)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, {name}, {}]
+                return
+            node = child
+
+    def discard(self, h, name):
+        # 木の構造は維持し、名前だけ外す（空ノードは検索結果に出ない）
+        node = self.root
+        while node is not None:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].discard(name)
+                return
+            node = node[2].get(d)
+
+    def search(self, h, max_dist):
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= max_dist:
+                results.extend((d, n) for n in node[1])
+            for k, child in node[2].items():
+                if d - max_dist <= k <= d + max_dist:
+                    stack.append(child)
+        return results
+
+
+class ImageHashIndex:
+    """blob名 → dHash の索引。GCSのJSONへ保存し、世代番号で上書き競合を検出する。
+    索引の読み込みは最初に使うときまで遅らせる（起動時間に影響させない）"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.hashes = {}
+        self.tree = BKTree()
+        self._loaded = False
+        self._generation = None
+        self._pending = []
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def load(self):
+        with self._lock:
+            self._loaded = True
+            self.hashes, self.tree = {}, BKTree()
+            blob = perf.call("gcs.get_blob", INDEX_BLOB, self.bucket.get_blob, INDEX_BLOB)
+            self._generation = blob.generation if blob else None
+            if blob is not None:
+                for name, hx in json.loads(perf.call("gcs.download", INDEX_BLOB, blob.download_as_bytes)).items():
+                    self._put(name, int(hx, 16))
+        return self
+
+    def _put(self, name, h):
+        old = self.hashes.get(name)
+        if old is not None:
+            self.tree.discard(old, name)
+        self.hashes[name] = h
+        self.tree.add(h, name)
+
+    def _drop(self, name):
+        old = self.hashes.pop(name, None)
+        if old is not None:
+            self.tree.discard(old, name)
+
+    def add(self, name, h):
+        with self._lock:
+            self._ensure_loaded()
+            self._put(name, h)
+            self._pending.append(("add", name, h))
+
+    def remove(self, name):
+        with self._lock:
+            self._ensure_loaded()
+            self._drop(name)
+            self._pending.append(("remove", name, None))
+
+    def rename(self, old_name, new_name):
+        with self._lock:
+            self._ensure_loaded()
+            h = self.hashes.get(old_name)
+            if h is None:
+                return
+            self.remove(old_name)
+            self.add(new_name, h)
+
+    def find_similar(self, h, dest_path, max_dist=NEAR_DUP_DISTANCE):
+        """保存先とは別の店舗（落ち店を含む）にある酷似画像を [(距離, blob名)] で返す"""
+        dest_folder = store_folder(dest_path)
+        with self._lock:
+            self._ensure_loaded()
+            hits = self.tree.search(h, max_dist)
+        return sorted((d, n) for d, n in hits if n != dest_path and store_folder(n) != dest_folder)
+
+    def check_upload(self, data, dest_path):
+        """アップロード前の照合。(ハッシュ, 酷似画像リスト) を返す。画像として読めなければ (None, [])"""
+        try:
+            h = dhash(data)
+        except Exception:
+            return None, []
+        return h, self.find_similar(h, dest_path)
+
+    def save(self, retries=3):
+        from google.api_core.exceptions import PreconditionFailed
+        with self._lock:
+            if not self._pending:
+                return
+            for _ in range(retries):
+                payload = json.dumps({n: f"{h:016x}" for n, h in self.hashes.items()}, ensure_ascii=False)
+                blob = self.bucket.blob(INDEX_BLOB)
+                try:
+                    perf.call("gcs.upload", INDEX_BLOB, blob.upload_from_string, payload,
+                              content_type="application/json", if_generation_match=self._generation or 0)
+                    self._generation = blob.generation
+                    self._pending = []
+                    return
+                except PreconditionFailed:
+                    # 他のセッションが先に保存した → 最新を読み直して自分の変更を再適用
+                    pending = self._pending
+                    self.load()
+                    for op, name, h in pending:
+                        if op == "add":
+                            self._put(name, h)
+                        else:
+                            self._drop(name)
+                    self._pending = pending
+            raise RuntimeError("画像ハッシュ索引の保存が競合しました。時間をおいて再実行してください。")
+
+    def backfill(self, workers=8, progress=None):
+        """バケット全体を走査し、未登録の画像をハッシュ化・消えた画像を索引から除去"""
+        names = [b.name for b in self.bucket.list_blobs() if b.name.lower().endswith(IMAGE_EXTS)]
+        alive = set(names)
+        with self._lock:
+            self._ensure_loaded()
+            for stale in [n for n in self.hashes if n not in alive]:
+                self.remove(stale)
+            todo = [n for n in names if n not in self.hashes]
+
+        def work(name):
+            try:
+                return name, dhash(self.bucket.blob(name).download_as_bytes())
+            except Exception:
+                return name, None
+
+        added = 0
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for i, (name, h) in enumerate(ex.map(work, todo), 1):
+                if h is not None:
+                    self.add(name, h)
+                    added += 1
+                if progress:
+                    progress(i, len(todo))
+        self.save()
+        return added
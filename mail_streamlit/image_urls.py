@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+import urllib.parse
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import perf
+
+# --- 画像の表示用URL ---
+# 画像は内容が変わると世代番号（generation）が変わるので、表示URLには必ず ?v=世代番号 を付けて「同じURL＝同じ内容」にし、
+# アップロード時に1年・immutable の Cache-Control を付ける。これでグリッドやカードを再実行しても
+# ブラウザは手元のキャッシュから表示し、画像を取り直さない。
+# DIARY_IMAGE_URLS=signed のときは公開URLの代わりに V4 署名付きURLを使う（バケットを非公開にできる）。
+# 署名はプロセス内で期限付きキャッシュし、期限内は同じURLを返す（ブラウザのキャッシュもそのまま効く）。
+
+URL_MODE = os.environ.get("DIARY_IMAGE_URLS", "public")            # "public" / "signed"
+SIGNED_URL_TTL = int(os.environ.get("DIARY_SIGNED_URL_TTL", str(12 * 3600)))
+SIGN_MARGIN = 3600        # 期限まで1時間を切った署名は作り直す（表示中に切れないように）
+MAX_SIGNED = 20000        # これを超えたら期限切れの署名を掃除する
+CACHE_CONTROL = ("private" if URL_MODE == "signed" else "public") + ", max-age=31536000, immutable"
+
+_signed = {}              # {(blob名, 世代): (URL, 使える期限)}
+_lock = threading.Lock()
+
+
+def public_url(bucket_name, blob_name, generation=None):
+    url = f"https://storage.googleapis.com/{bucket_name}/{urllib.parse.quote(blob_name)}"
+    return f"{url}?v={generation}" if generation else url
+
+
+def signed_url(bucket, blob_name, generation=None):
+    """V4 署名付きURL。同じ画像・同じ世代なら期限内は同じURLを返す"""
+    key = (blob_name, generation)
+    now = time.time()
+    with _lock:
+        hit = _signed.get(key)
+        if hit and hit[1] > now:
+            return hit[0]
+    params = {"v": str(generation)} if generation else None
+    url = perf.call("gcs.sign_url", blob_name, bucket.blob(blob_name).generate_signed_url,
+                    version="v4", expiration=timedelta(seconds=SIGNED_URL_TTL), method="GET", query_parameters=params)
+    with _lock:
+        if len(_signed) >= MAX_SIGNED:
+            for k in [k for k, (_, exp) in _signed.items() if exp <= now]:
+                del _signed[k]
+        _signed[key] = (url, now + SIGNED_URL_TTL - SIGN_MARGIN)
+    return url
+
+
+def image_url(bucket, blob_name, generation=None):
+    """表示用のURL（DIARY_IMAGE_URLS の設定に従う）。世代番号が分からなければその場で引いて必ず ?v= を付ける
+    （世代番号の無いURLは上書き後も同じになり、immutable のキャッシュで古い画像が出続けるため）"""
+    if not generation:
+        blob = perf.call("gcs.get_blob", blob_name, bucket.get_blob, blob_name)
+        generation = blob.generation if blob is not None else None
+    if URL_MODE == "signed":
+        return signed_url(bucket, blob_name, generation)
+    return public_url(bucket.name, blob_name, generation)
+
+
+def backfill_cache_control(bucket, prefix="", workers=8, progress=None):
+    """Cache-Control の無い（設定前にアップロードした）画像に付け直す。付け直した枚数を返す"""
+    from registration import IMAGE_EXTS
+    blobs = [b for b in perf.call("gcs.list_blobs", prefix, lambda: list(bucket.list_blobs(prefix=prefix)))
+             if b.name.lower().endswith(IMAGE_EXTS) and b.cache_control != CACHE_CONTROL]
+
+    def work(blob):
+        blob.cache_control = CACHE_CONTROL
+        perf.call("gcs.patch", blob.name, blob.patch)
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for i, _ in enumerate(ex.map(work, blobs), 1):
+            if progress:
+                progress(i, len(blobs))
+    return len(blobs)
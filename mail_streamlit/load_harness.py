@@ -0,0 +1,577 @@
+"""再実行（rerun）の負荷計測ハーネス
+
+streamlit.testing.v1.AppTest で diary_app.py / editor_app.py / auto-post-manual.py を動かし、
+決まった操作（店舗選択・検索・保存・画像の選択・フォーム送信など）を何セッション分も、1操作ずつ交互に重ねて実行する。
+Google Sheets / GCS は合成データ入りのフェイク（プロセス内のメモリ）に差し替えるので、本番のデータには触れない。
+
+    python load_harness.py --app editor --sessions 5 --diaries-per-store 500
+    python load_harness.py --app all --sessions 3 --latency-ms 80 --json report.json
+
+結果として、操作ごとの再実行時間 p50 / p95、API呼び出し回数（perf の集計とフェイク側の実回数）、
+セッションごとのメモリ（session_state のおおよそのサイズ）とプロセス全体のピークを表示する。
+"""
+import os
+import sys
+import re
+import json
+import base64
+import hashlib
+import time
+import types
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILES = {"diary": "diary_app.py", "editor": "editor_app.py", "manual": "auto-post-manual.py"}
+
+SHEET_ID = "1sEzw59aswIlA-8_CTyUrRBLN7OnrRIJERKUZ_bELMrY"   # 投稿アカウントシート（マニュアルの投稿状況チェックと共通）
+STATUS_SHEET_ID = "1_GmWjpypap4rrPGNFYWkwcQE1SoK3QOMJlozEhkBwVM"
+STOCK_SHEET_ID = "1e-iLey43A1t0bIBoijaXP55t5fjONdb0ODiTS53beqM"
+BUCKET_NAME = "auto-poster-images"
+ACCOUNTS = ["A", "B", "C", "D"]
+HEADER = ["エリア", "店名", "媒体", "投稿時間", "女の子の名前", "タイトル", "本文"]
+# 1x1 の JPEG（画像として読めるだけの最小データ）
+TINY_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f141d1a1f1e1d1a1c1c"
+    "20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100ffc4001f000001050101010101010000"
+    "0000000000000102030405060708090a0bffc400b5100002010303020403050504040000017d01020300041105122131410613516107227114328191"
+    "a1082342b1c11552d1f02433627282090a161718191a25262728292a3435363738393a434445464748494a535455565758595a636465666768696a"
+    "737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8"
+    "d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9")
+
+
+# --- フェイクのバックエンド（全セッションで共有） ---
+class FakeBackend:
+    """スプレッドシートとバケットの中身、API呼び出し回数、擬似的な通信待ちを持つ"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.sheets = {}     # {spreadsheet_id: {シート名: 行リスト}}
+        self.blobs = {}      # {blob名: (bytes, generation)}
+        self.blob_meta = {}  # {blob名: カスタムメタデータ}
+        self.calls = defaultdict(int)
+        self.lock = threading.RLock()
+
+    def hit(self, op):
+        with self.lock:
+            self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeWorksheet:
+    def __init__(self, backend, key, title):
+        self.backend, self.key, self.title = backend, key, title
+
+    @property
+    def _rows(self):
+        return self.backend.sheets[self.key][self.title]
+
+    def get_all_values(self):
+        self.backend.hit("sheets.get_all_values")
+        with self.backend.lock:
+            return [list(r) for r in self._rows]
+
+    def col_values(self, col):
+        self.backend.hit("sheets.col_values")
+        with self.backend.lock:
+            values = [r[col - 1] if len(r) >= col else "" for r in self._rows]
+        while values and values[-1] == "":
+            values.pop()   # gspread と同じく末尾の空セルは返さない
+        return values
+
+    def get(self, cell_range=None):
+        self.backend.hit("sheets.get")
+        with self.backend.lock:
+            return [list(r) for r in self._rows]
+
+    def append_row(self, row, value_input_option=None):
+        self.append_rows([row], value_input_option)
+
+    def append_rows(self, rows, value_input_option=None):
+        self.backend.hit("sheets.append_rows")
+        with self.backend.lock:
+            self._rows.extend([["" if c is None else str(c) for c in r] for r in rows])
+
+    def update_cell(self, row, col, value):
+        self.backend.hit("sheets.update_cell")
+        with self.backend.lock:
+            r = self._rows[row - 1]
+            r.extend([""] * (col - len(r)))
+            r[col - 1] = str(value)
+
+    def update(self, range_name="A1", values=None, **kw):
+        self.backend.hit("sheets.update")
+        with self.backend.lock:
+            start = int(re.sub(r"[^0-9]", "", range_name.split(":")[0]) or 1)
+            rows = self._rows
+            rows.extend([] for _ in range(start - 1 + len(values) - len(rows)))
+            for i, r in enumerate(values):
+                rows[start - 1 + i] = ["" if c is None else str(c) for c in r]
+
+    def batch_update(self, data, **kw):
+        self.backend.hit("sheets.batch_update")
+        with self.backend.lock:
+            for item in data:
+                cell = item["range"].split(":")[0]
+                row, col = int(re.sub(r"[^0-9]", "", cell)), ord(re.sub(r"[0-9]", "", cell)) - ord("A") + 1
+                for j, v in enumerate(item["values"][0]):
+                    r = self._rows[row - 1]
+                    r.extend([""] * (col + j - len(r)))
+                    r[col - 1 + j] = str(v)
+
+    def clear(self):
+        self.backend.hit("sheets.clear")
+        with self.backend.lock:
+            del self._rows[:]
+
+    def delete_rows(self, start, end=None):
+        self.backend.hit("sheets.delete_rows")
+        with self.backend.lock:
+            del self._rows[start - 1:(end or start)]
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, key):
+        self.backend, self.key = backend, key
+
+    def worksheet(self, title):
+        self.backend.hit("sheets.worksheet")
+        if title not in self.backend.sheets[self.key]:
+            raise KeyError(f"WorksheetNotFound: {title}")
+        return FakeWorksheet(self.backend, self.key, title)
+
+    def add_worksheet(self, title, rows=100, cols=26):
+        self.backend.hit("sheets.add_worksheet")
+        with self.backend.lock:
+            self.backend.sheets[self.key].setdefault(title, [])
+        return FakeWorksheet(self.backend, self.key, title)
+
+    @property
+    def sheet1(self):
+        return FakeWorksheet(self.backend, self.key, next(iter(self.backend.sheets[self.key])))
+
+    def values_batch_get(self, ranges):
+        self.backend.hit("sheets.values_batch_get")
+        out = []
+        with self.backend.lock:
+            for a1 in ranges:
+                name = a1.split("!")[0].strip("'").replace("''", "'")
+                if name not in self.backend.sheets[self.key]:
+                    raise KeyError(f"Unable to parse range: {a1}")
+                out.append({"range": a1, "values": [list(r) for r in self.backend.sheets[self.key][name]]})
+        return {"valueRanges": out}
+
+
+class FakeGspreadClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_by_key(self, key):
+        self.backend.hit("sheets.open_by_key")
+        return FakeSpreadsheet(self.backend, key)
+
+
+class FakeBlob:
+    def __init__(self, backend, name):
+        self.backend, self.name = backend, name
+        self.metadata = backend.blob_meta.get(name)
+
+    @property
+    def generation(self):
+        entry = self.backend.blobs.get(self.name)
+        return entry[1] if entry else None
+
+    @property
+    def size(self):
+        entry = self.backend.blobs.get(self.name)
+        return len(entry[0]) if entry else None
+
+    @property
+    def md5_hash(self):
+        entry = self.backend.blobs.get(self.name)
+        return base64.b64encode(hashlib.md5(entry[0]).digest()).decode("ascii") if entry else None
+
+    def patch(self):
+        self.backend.hit("gcs.patch")
+        with self.backend.lock:
+            self.backend.blob_meta[self.name] = dict(self.metadata or {})
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        self.backend.hit("gcs.upload")
+        data = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        with self.backend.lock:
+            current = self.generation or 0
+            if if_generation_match is not None and if_generation_match != current:
+                raise _precondition_failed()(f"generation {current} != {if_generation_match}")
+            self.backend.blobs[self.name] = (data, current + 1)
+            if self.metadata:
+                self.backend.blob_meta[self.name] = dict(self.metadata)
+
+    def download_as_bytes(self):
+        self.backend.hit("gcs.download")
+        return self.backend.blobs[self.name][0]
+
+    def delete(self):
+        self.backend.hit("gcs.delete")
+        with self.backend.lock:
+            self.backend.blobs.pop(self.name, None)
+            self.backend.blob_meta.pop(self.name, None)
+
+    def exists(self):
+        return self.name in self.backend.blobs
+
+
+class FakeBlobList:
+    """list_blobs の戻り値。delimiter 指定時は読み終えると prefixes が埋まる"""
+
+    def __init__(self, blobs, prefixes):
+        self._blobs = blobs
+        self.prefixes = set()
+        self._prefixes = prefixes
+
+    def __iter__(self):
+        yield from self._blobs
+        self.prefixes = self._prefixes
+
+
+class FakeBucket:
+    def __init__(self, backend, name):
+        self.backend, self.name = backend, name
+
+    def blob(self, name):
+        return FakeBlob(self.backend, name)
+
+    def get_blob(self, name):
+        self.backend.hit("gcs.get_blob")
+        return FakeBlob(self.backend, name) if name in self.backend.blobs else None
+
+    def list_blobs(self, prefix="", delimiter=None):
+        self.backend.hit("gcs.list_blobs")
+        with self.backend.lock:
+            names = sorted(n for n in self.backend.blobs if n.startswith(prefix or ""))
+        if not delimiter:
+            return FakeBlobList([FakeBlob(self.backend, n) for n in names], set())
+        files, prefixes = [], set()
+        for n in names:
+            rest = n[len(prefix or ""):]
+            if delimiter in rest:
+                prefixes.add((prefix or "") + rest.split(delimiter)[0] + delimiter)
+            else:
+                files.append(FakeBlob(self.backend, n))
+        return FakeBlobList(files, prefixes)
+
+    def copy_blob(self, blob, dest_bucket, new_name):
+        self.backend.hit("gcs.copy")
+        with self.backend.lock:
+            data, _ = self.backend.blobs[blob.name]
+            gen = (self.backend.blobs.get(new_name, (None, 0))[1] or 0) + 1
+            self.backend.blobs[new_name] = (data, gen)
+            if blob.name in self.backend.blob_meta:
+                self.backend.blob_meta[new_name] = dict(self.backend.blob_meta[blob.name])
+        return FakeBlob(self.backend, new_name)
+
+
+class FakeStorageClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def bucket(self, name):
+        return FakeBucket(self.backend, name)
+
+    def list_blobs(self, bucket_name, prefix="", delimiter=None):
+        return FakeBucket(self.backend, bucket_name).list_blobs(prefix=prefix, delimiter=delimiter)
+
+
+def _precondition_failed():
+    from google.api_core.exceptions import PreconditionFailed
+    return PreconditionFailed
+
+
+def install_fakes(backend):
+    """アプリが使う場所で import する gspread / google.cloud.storage と、transport のクライアント作成をフェイクに向ける。
+    本物のパッケージを先に import してから末端のモジュールだけを差し替える
+    （google を作り物のモジュールにすると、streamlit が読む google.protobuf が import できなくなる）"""
+    import importlib
+    for name in ("gspread", "google.cloud.storage", "google.api_core.exceptions"):
+        importlib.import_module(name)
+
+    gspread = types.ModuleType("gspread")
+    gspread.service_account_from_dict = lambda info, **kw: FakeGspreadClient(backend)
+    gspread.authorize = lambda creds: FakeGspreadClient(backend)
+    sys.modules["gspread"] = gspread
+
+    storage = types.ModuleType("google.cloud.storage")
+    storage.Client = types.SimpleNamespace(from_service_account_info=lambda info, **kw: FakeStorageClient(backend))
+    sys.modules["google.cloud.storage"] = storage
+    sys.modules["google.cloud"].storage = storage   # from google.cloud import storage は親パッケージの属性を見る
+
+    # アプリは transport 経由でクライアントを作るので、そこもフェイクに向ける
+    import transport
+    transport.gspread_client = lambda info: FakeGspreadClient(backend)
+    transport.storage_client = lambda info: FakeStorageClient(backend)
+
+
+# --- 合成データ ---
+def seed(backend, areas=3, stores_per_area=4, diaries_per_store=50, stock_rows=2000, retired_stores=5, rng=None):
+    """投稿A〜Dのシート・ログイン情報・使用可能日記文・画像・落ち店フォルダを作る"""
+    rng = rng or random.Random(0)
+    posting = {}
+    status = {}
+    stores = []
+    for a in range(areas):
+        for s in range(stores_per_area):
+            stores.append((f"エリア{a + 1}", f"店舗{a + 1}-{s + 1}", rng.choice(["駅ちか", "デリじゃ"]), ACCOUNTS[len(stores) % 4]))
+    for acc in ACCOUNTS:
+        posting[f"投稿{acc}アカウント"] = [HEADER + ["状況"]]
+        status[f"投稿{acc}アカウント"] = [["エリア", "店名", "媒体", "ID", "パスワード"]]
+    for area, store, media, acc in stores:
+        sheet = f"投稿{acc}アカウント"
+        status[sheet].append([area, store, media, f"id_{store}", "pw"])
+        for i in range(diaries_per_store):
+            minute = rng.choice([m for m in range(0, 24 * 60, 10) if not 6 * 60 <= m <= 11 * 60])
+            hhmm = f"{minute // 60:02d}{minute % 60:02d}"
+            name = f"girl{i % 40:02d}"
+            done = f"完了:{minute // 60:02d}:{minute % 60:02d}:00" if rng.random() < 0.5 else ""
+            posting[sheet].append([area, store, media, hhmm, name, f"タイトル{i}", f"本文{i} " + "今日もよろしくね♪" * rng.randint(2, 20), done])
+            if rng.random() < 0.9:
+                folder = f"デリじゃ {store}" if media == "デリじゃ" else store
+                backend.blobs[f"{area}/{folder}/{hhmm}_{name}.jpg"] = (TINY_JPEG, 1)
+    for r in range(retired_stores):
+        for i in range(30):
+            backend.blobs[f"【落ち店】/落ち店{r + 1}/{i:04d}_old{i}.jpg"] = (TINY_JPEG, 1)
+    backend.sheets[SHEET_ID] = posting
+    backend.sheets[STATUS_SHEET_ID] = status
+    backend.sheets[STOCK_SHEET_ID] = {"【使用可能日記文】": [["", "", "タイトル", "本文"]] + [
+        ["", "", f"ストック{i}", "ストック本文" * rng.randint(2, 30)] for i in range(stock_rows)]}
+    return stores
+
+
+# --- シナリオ（操作の台本） ---
+def _widget(items, key=None, label=None, prefix=None):
+    for w in items:
+        if (key and w.key == key) or (label and getattr(w, "label", None) == label) or (prefix and str(w.key or "").startswith(prefix)):
+            return w
+    return None
+
+
+def scenario_diary(at, store):
+    yield "initial", lambda: at.run()
+    folder = _widget(at.selectbox, key="sel_f_4")
+    if folder is not None and len(folder.options) > 1:
+        yield "select_folder", lambda: folder.select_index(1).run()
+        q = _widget(at.text_input, key="q_4")
+        if q is not None:
+            yield "search_images", lambda: q.input("old1").run()
+        box = _widget(at.checkbox, prefix="s4_")
+        if box is not None:
+            yield "tick_image", lambda: box.check().run()
+    area, name, media, acc = store
+
+    def fill_and_submit():
+        at.selectbox(key="sel_acc_f").select(acc)
+        at.text_input(key="in_area_f").input(area)
+        at.text_input(key="in_store_f").input(f"{name}-新")
+        for i in range(5):
+            at.text_input(key=f"f_t_{i}").input(f"{12 + i}00")
+            at.text_input(key=f"f_n_{i}").input(f"new{i}")
+            at.text_area(key=f"f_ti_{i}").input(f"新規タイトル{i}")
+            at.text_area(key=f"f_b_{i}").input("新規本文")
+        _widget(at.button, label="🔥 データを一括登録する").click().run()
+    yield "submit_form", fill_and_submit
+
+
+def scenario_editor(at, store):
+    area, name, media, acc = store
+    yield "initial", lambda: at.run()
+    yield "select_account", lambda: at.selectbox(key="acc_tab1").select(acc).run()
+    yield "select_area", lambda: _widget(at.selectbox, label="📍 エリア").select(area).run()
+    yield "select_store", lambda: _widget(at.selectbox, label="🏢 店舗").select(name).run()
+    yield "search", lambda: _widget(at.text_input, label="🔍 検索").input("girl0").run()
+    save = _widget(at.button, prefix=f"sv_{acc}_")
+    if save is not None:
+        yield "save_card", lambda: save.click().run()
+    yield "scan_tab2", lambda: at.button(key="btn_reload_tab2").click().run()
+
+
+def scenario_manual(at, store):
+    yield "initial", lambda: at.run()
+    yield "check_status", lambda: _widget(at.button, label="最新の投稿状況をチェックする").click().run()
+
+
+SCENARIOS = {"diary": scenario_diary, "editor": scenario_editor, "manual": scenario_manual}
+
+
+# --- 実行と集計 ---
+def deep_size(obj, seen=None):
+    """オブジェクトのおおよその合計サイズ（bytes）"""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "memory_usage") and hasattr(obj, "columns"):
+        size += int(obj.memory_usage(deep=True).sum())
+    return size
+
+
+def session_values(state):
+    """AppTest の session_state の {キー: 値}（ウィジェットの値も含む）。
+    AppTest が持つのは SafeSessionState なので、中の SessionState の filtered_state を使う。取れなければ例外のまま"""
+    inner = getattr(state, "_state", state)
+    values = inner.filtered_state
+    if not isinstance(values, dict):
+        raise TypeError(f"session_state の中身を読めません: {type(values).__name__}")
+    return values
+
+
+class Session:
+    """1セッション分の AppTest と操作の台本（1操作ずつ進める）"""
+
+    def __init__(self, app, session_no, stores, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(os.path.join(APP_DIR, APP_FILES[app]), default_timeout=timeout)
+        self.at.secrets["gcp_service_account"] = {"type": "service_account", "client_email": "harness@example.com"}
+        self.at.secrets["google_resources"] = {"spreadsheet_id": SHEET_ID}
+        self.at.secrets["sheet_names"] = {}
+        self.result = {"app": app, "session": session_no, "steps": [], "errors": []}
+        self._steps = SCENARIOS[app](self.at, stores[session_no % len(stores)])
+
+    def step(self):
+        """次の操作を1つ実行する。台本が終わっていれば False"""
+        try:
+            name, action = next(self._steps)
+        except StopIteration:
+            return False
+        except Exception as e:
+            self.result["errors"].append(f"scenario: {type(e).__name__}: {e}")
+            return False
+        t0 = time.perf_counter()
+        try:
+            action()
+            if self.at.exception:
+                self.result["errors"].append(f"{name}: {self.at.exception[0].value}")
+        except Exception as e:
+            self.result["errors"].append(f"{name}: {type(e).__name__}: {e}")
+        self.result["steps"].append((name, (time.perf_counter() - t0) * 1000))
+        return True
+
+    def finish(self):
+        result = self.result
+        try:
+            agg = self.at.session_state["_perf_session"]
+            result["perf_ops"] = {op: v["calls"] for op, v in agg["ops"].items()}
+            result["reruns"] = agg["reruns"]
+        except Exception:
+            result["perf_ops"], result["reruns"] = {}, len(result["steps"])
+        result["session_bytes"] = deep_size(session_values(self.at.session_state))
+        return result
+
+
+def run_sessions(sessions):
+    """全セッションを1操作ずつ順番に進める（AppTest は1プロセス内で同時に動かせないので、
+    スレッドで並べる代わりに各セッションの再実行を交互に重ねる。キャッシュとフェイクのバックエンドは共有）"""
+    active = list(sessions)
+    while active:
+        active = [s for s in active if s.step()]
+    return [s.finish() for s in sessions]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = (len(values) - 1) * q
+    lo, hi = int(idx), min(int(idx) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (idx - lo)
+
+
+def summarize(results, backend, wall, peak):
+    by_step = defaultdict(list)
+    perf_ops = defaultdict(int)
+    for r in results:
+        for name, ms in r["steps"]:
+            by_step[(r["app"], name)].append(ms)
+        for op, n in r["perf_ops"].items():
+            perf_ops[op] += n
+    sizes = [r["session_bytes"] for r in results]
+    return {
+        "sessions": len(results),
+        "wall_s": round(wall, 2),
+        "steps": {f"{app}.{name}": {"n": len(v), "p50_ms": round(percentile(v, 0.5), 1), "p95_ms": round(percentile(v, 0.95), 1)}
+                  for (app, name), v in by_step.items()},
+        "perf_ops": dict(sorted(perf_ops.items())),
+        "backend_calls": dict(sorted(backend.calls.items())),
+        "session_state_kb": {"avg": round(sum(sizes) / len(sizes) / 1024, 1) if sizes else None,
+                             "max": round(max(sizes) / 1024, 1) if sizes else None},
+        "python_peak_mb": round(peak / 1024 / 1024, 1),
+        "errors": [f"{r['app']}#{r['session']} {e}" for r in results for e in r["errors"]],
+    }
+
+
+def print_report(report):
+    print(f"\n=== {report['sessions']} セッション / {report['wall_s']} 秒 ===")
+    print(f"{'操作':<32}{'回数':>6}{'p50(ms)':>10}{'p95(ms)':>10}")
+    for name, s in report["steps"].items():
+        print(f"{name:<32}{s['n']:>6}{s['p50_ms']:>10}{s['p95_ms']:>10}")
+    print("\nAPI呼び出し（perf 集計）:", ", ".join(f"{k}={v}" for k, v in report["perf_ops"].items()) or "-")
+    print("API呼び出し（フェイク実回数）:", ", ".join(f"{k}={v}" for k, v in report["backend_calls"].items()) or "-")
+    mem = report["session_state_kb"]
+    print(f"session_state: 平均 {mem['avg']} KB / 最大 {mem['max']} KB、Python ヒープのピーク {report['python_peak_mb']} MB")
+    if report["errors"]:
+        print(f"\n⚠️ エラー {len(report['errors'])} 件")
+        for e in report["errors"][:20]:
+            print(f"  - {e}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="AppTest で3つのアプリの再実行時間・API呼び出し・メモリを計測します。")
+    p.add_argument("--app", choices=list(APP_FILES) + ["all"], default="all")
+    p.add_argument("--sessions", type=int, default=5, help="交互に動かすセッション数（アプリごと）")
+    p.add_argument("--areas", type=int, default=3)
+    p.add_argument("--stores-per-area", type=int, default=4)
+    p.add_argument("--diaries-per-store", type=int, default=50)
+    p.add_argument("--stock-rows", type=int, default=2000, help="使用可能日記文シートの行数")
+    p.add_argument("--latency-ms", type=float, default=50.0, help="フェイクAPI 1回あたりの擬似待ち時間")
+    p.add_argument("--timeout", type=float, default=120.0, help="1回の再実行のタイムアウト（秒）")
+    p.add_argument("--json", help="結果を JSON で保存するパス")
+    args = p.parse_args(argv)
+
+    # スナップショットキャッシュ・トレースは一時フォルダへ（本番用のキャッシュを汚さない）
+    tmp = tempfile.mkdtemp(prefix="diary_harness_")
+    os.environ["DIARY_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshots")
+    os.environ.setdefault("DIARY_TRACE_PATH", os.path.join(tmp, "trace.jsonl"))
+    sys.path.insert(0, APP_DIR)
+
+    backend = FakeBackend(args.latency_ms)
+    stores = seed(backend, args.areas, args.stores_per_area, args.diaries_per_store, args.stock_rows)
+    install_fakes(backend)
+    apps = list(APP_FILES) if args.app == "all" else [args.app]
+    print(f"📦 合成データ: 店舗 {len(stores)} / 日記 {len(stores) * args.diaries_per_store} 件 / 画像 {len(backend.blobs)} 枚")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    results = run_sessions([Session(app, n, stores, args.timeout) for n in range(args.sessions) for app in apps])
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = summarize(results, backend, wall, peak)
+    print_report(report)
+    print(f"\n📝 APIトレース: {os.environ['DIARY_TRACE_PATH']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
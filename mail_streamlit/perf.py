@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import threading
+import contextvars
+
+# --- 起動時間の計測 ---
+# Streamlitはスクリプトを再実行するたびに本体を読み直すが、このモジュールはプロセス内で1度しか
+# 読み込まれない。そのため「プロセス起動後の最初の実行（コールドスタート）」だけを計測できる。
+
+
+class StartupReport:
+    """コールドスタートの内訳（import / 認証 / 最初のAPI呼び出し / 描画）を記録"""
+
+    def __init__(self):
+        self.phases = []
+        self.finished = False
+        self._last = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            if self._last is None:
+                self._last = time.perf_counter()
+
+    def mark(self, phase):
+        """直前の区切りからの経過時間を phase として記録（同じ phase は最初の1回のみ）"""
+        with self._lock:
+            if self.finished or self._last is None or any(p == phase for p, _ in self.phases):
+                return
+            now = time.perf_counter()
+            self.phases.append((phase, now - self._last))
+            self._last = now
+
+    def restart_clock(self):
+        """次の mark を今からの経過時間で記録する（ボタンを押すまで遅らせた初期化の計測で、待ち時間を含めないように）"""
+        with self._lock:
+            if not self.finished and self._last is not None:
+                self._last = time.perf_counter()
+
+    def finish(self, app_name):
+        with self._lock:
+            if self.finished or self._last is None:
+                return
+            self.finished = True
+        # Streamlit Cloud のログで起動時間の推移を追えるように1行で出力
+        detail = " ".join(f"{p}={sec * 1000:.0f}ms" for p, sec in self.phases)
+        print(f"[startup] {app_name} total={self.total() * 1000:.0f}ms {detail}", flush=True)
+
+    def total(self):
+        return sum(sec for _, sec in self.phases)
+
+
+STARTUP = StartupReport()
+
+
+def debug_enabled(st):
+    """URLに ?debug=1 が付いているときだけ計測パネルを出す"""
+    try:
+        return st.query_params.get("debug") in ("1", "true")
+    except Exception:
+        return False
+
+
+def render_startup_report(st):
+    if not debug_enabled(st) or not STARTUP.phases:
+        return
+    with st.sidebar.expander("⏱ 起動時間（コールドスタート）", expanded=False):
+        for phase, sec in STARTUP.phases:
+            st.text(f"{phase:<12}{sec * 1000:8.0f} ms")
+        st.text(f"{'合計':<11}{STARTUP.total() * 1000:8.0f} ms")
+
+
+# --- API呼び出しのトレース ---
+# gspread / GCS / BigQuery の呼び出しを perf.call() 経由で行い、操作名・対象・所要時間・バイト数・
+# キャッシュヒット有無を「再実行（rerun）ごと」「セッションごと」に集計する。
+# ?debug=1 でサイドバーに表示し、DIARY_TRACE_PATH（未指定なら debug 時のみ /tmp）へ JSON Lines で書き出す。
+
+_current_rerun = contextvars.ContextVar("perf_rerun", default=None)
+_trace_lock = threading.Lock()
+DEFAULT_TRACE_PATH = "/tmp/diary_api_trace.jsonl"
+
+
+class RerunTrace:
+    def __init__(self, app, session_id, rerun_no, session_agg, trace_path):
+        self.app = app
+        self.session_id = session_id
+        self.rerun_no = rerun_no
+        self.session_agg = session_agg
+        self.trace_path = trace_path
+        self.calls = []
+        self.started = time.perf_counter()
+
+
+def _session_id(st):
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx().session_id
+    except Exception:
+        return None
+
+
+def begin_rerun(st, app):
+    """スクリプト先頭で呼ぶ。この再実行で行われる呼び出しを集計対象にする"""
+    agg = st.session_state.setdefault("_perf_session", {"reruns": 0, "ops": {}})
+    agg["reruns"] += 1
+    path = os.environ.get("DIARY_TRACE_PATH") or (DEFAULT_TRACE_PATH if debug_enabled(st) else None)
+    trace = RerunTrace(app, _session_id(st), agg["reruns"], agg, path)
+    _current_rerun.set(trace)
+    return trace
+
+
+def estimate_bytes(result):
+    """戻り値のおおよそのサイズ（bytes / 2次元のセル値 / 文字列）"""
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    if isinstance(result, dict) and "valueRanges" in result:
+        return sum(estimate_bytes(vr.get("values", [])) for vr in result["valueRanges"])
+    if isinstance(result, list) and result and isinstance(result[0], list):
+        return sum(len(str(c)) for row in result for c in row)
+    return 0
+
+
+def _record(rec):
+    trace = _current_rerun.get()
+    with _trace_lock:
+        if trace is not None:
+            trace.calls.append(rec)
+            op = trace.session_agg["ops"].setdefault(rec["op"], {"calls": 0, "ms": 0.0, "bytes": 0, "hit": 0, "miss": 0})
+            op["calls"] += 1
+            op["ms"] += rec["ms"]
+            op["bytes"] += rec["bytes"]
+            if rec["cache"] in ("hit", "miss"):
+                op[rec["cache"]] += 1
+        path = trace.trace_path if trace is not None else os.environ.get("DIARY_TRACE_PATH")
+        if path:
+            line = dict(rec, ts=time.time(), app=trace.app if trace else None,
+                        session=trace.session_id if trace else None, rerun=trace.rerun_no if trace else None)
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+
+def call(op, target, fn, *args, **kwargs):
+    """API呼び出しを計測して実行（例: perf.call("sheets.get_all_values", ws.title, ws.get_all_values)）"""
+    t0 = time.perf_counter()
+    rec = {"op": op, "target": str(target), "bytes": 0, "cache": None, "error": None}
+    try:
+        result = fn(*args, **kwargs)
+        rec["bytes"] = estimate_bytes(result)
+        return result
+    except Exception as e:
+        rec["error"] = type(e).__name__
+        raise
+    finally:
+        rec["ms"] = (time.perf_counter() - t0) * 1000
+        _record(rec)
+
+
+def cached_call(op, target, fn, *args, **kwargs):
+    """st.cache_data 付き関数の呼び出し。中で API 呼び出しが起きなければキャッシュヒットとして記録"""
+    trace = _current_rerun.get()
+    n0 = len(trace.calls) if trace is not None else 0
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    hit = trace is not None and not any(c["cache"] is None for c in trace.calls[n0:])
+    _record({"op": op, "target": str(target), "bytes": 0, "cache": "hit" if hit else "miss",
+             "error": None, "ms": (time.perf_counter() - t0) * 1000})
+    return result
+
+
+def render_trace_panel(st):
+    """スクリプト末尾で呼ぶ。?debug=1 のときサイドバーに今回の再実行とセッション累計を表示"""
+    trace = _current_rerun.get()
+    if trace is None or not debug_enabled(st):
+        return
+    import pandas as pd
+    with st.sidebar.expander("📡 API呼び出し（今回の再実行）", expanded=True):
+        st.caption(f"再実行 #{trace.rerun_no}・{(time.perf_counter() - trace.started) * 1000:.0f} ms・{len(trace.calls)} 件")
+        if trace.calls:
+            st.dataframe(pd.DataFrame(trace.calls)[["op", "target", "ms", "bytes", "cache"]].round(1),
+                         hide_index=True, use_container_width=True)
+    with st.sidebar.expander("📈 API呼び出し（セッション累計）", expanded=False):
+        ops = trace.session_agg["ops"]
+        if ops:
+            df = pd.DataFrame.from_dict(ops, orient="index").sort_values("ms", ascending=False)
+            st.dataframe(df.round(1), use_container_width=True)
@@ -0,0 +1,277 @@
+import re
+import time
+import base64
+import hashlib
+import secrets
+import threading
+
+import perf
+import account_data
+import image_urls
+
+# --- 日記登録の共通処理 ---
+# 登録アプリ（diary_app.py）のフォームと、一括登録コマンド（bulk_import.py）の両方から使う。
+# Streamlit には依存しない。
+
+GCS_BUCKET_NAME = "auto-poster-images"
+MEDIA_OPTIONS = ["駅ちか", "デリじゃ"]
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+APPEND_CHUNK = 200  # append_rows 1回あたりの行数
+ROW_ID_META = "row_id"   # 画像（blob）のカスタムメタデータに入れる行IDのキー
+
+_hidden_sheets = set()
+_hidden_lock = threading.Lock()
+
+
+def store_folder(store, media):
+    """媒体ごとの画像フォルダ名（デリじゃは「デリじゃ 店名」）"""
+    return f"デリじゃ {store}" if media == "デリじゃ" else store
+
+
+def image_blob_path(area, store, media, post_time, girl_name, ext):
+    return f"{area}/{store_folder(store, media)}/{str(post_time).strip()}_{str(girl_name).strip()}.{ext}"
+
+
+def is_valid_post_time(t_str):
+    """編集アプリの parse_to_datetime と同じ基準（数字3〜4桁で HHMM として読める）"""
+    t_clean = re.sub(r'[^0-9]', '', str(t_str))
+    if len(t_clean) == 3: t_clean = "0" + t_clean
+    return len(t_clean) == 4 and int(t_clean[:2]) < 24 and int(t_clean[2:]) < 60
+
+
+# --- 行ID ---
+# 日記の行と画像を「名前・時間のあいまい一致」ではなく ID で結びつける。
+# シートには非表示の Z 列、画像には blob のメタデータ row_id として同じ ID を書く。
+def new_row_id(seed=None):
+    """10文字の行ID。seed を渡すと同じ seed から同じ ID を作る（一括登録の再実行用）"""
+    raw = hashlib.sha1(seed.encode("utf-8")).digest()[:6] if seed is not None else secrets.token_bytes(6)
+    # 6バイトは base32 で10文字＋埋め草 "======" になるので、埋め草を落とす
+    return base64.b32encode(raw).decode("ascii").rstrip("=").lower()
+
+
+def ensure_row_id_column(spreadsheet, ws):
+    """行ID列（Z列）を非表示にする（シートごとにプロセス内で1回だけ）"""
+    key = (getattr(spreadsheet, "id", None), getattr(ws, "id", None))
+    with _hidden_lock:
+        if key in _hidden_sheets:
+            return
+        _hidden_sheets.add(key)
+    try:
+        if getattr(ws, "col_count", account_data.ROW_ID_COL + 1) <= account_data.ROW_ID_COL:
+            perf.call("sheets.add_cols", ws.title, ws.add_cols, account_data.ROW_ID_COL + 1 - ws.col_count)
+        perf.call("sheets.batch_update", ws.title, spreadsheet.batch_update, {"requests": [{"updateDimensionProperties": {
+            "range": {"sheetId": ws.id, "dimension": "COLUMNS", "startIndex": account_data.ROW_ID_COL, "endIndex": account_data.ROW_ID_COL + 1},
+            "properties": {"hiddenByUser": True}, "fields": "hiddenByUser"}}]})
+    except Exception:
+        with _hidden_lock:
+            _hidden_sheets.discard(key)   # 非表示にできなくても登録は続ける（次回また試す）
+
+
+def set_row_id(ws, row_number, row_id):
+    """既存の行（行IDなし）に行IDを書き込む"""
+    perf.call("sheets.update_cell", ws.title, ws.update_cell, row_number, account_data.ROW_ID_COL + 1, row_id)
+
+
+def sheet_row(area, store, media, entry):
+    row = [area, store, media, entry['投稿時間'], entry['女の子の名前'], entry['タイトル'], entry['本文']]
+    if entry.get('row_id'):
+        # H列（投稿システムの状況欄）以降は空けたまま、Z列に行ID
+        row += [""] * (account_data.ROW_ID_COL - len(row)) + [entry['row_id']]
+    return row
+
+
+# --- 画像アップロード ---
+# 再送信・二度押しで同じ画像を送り直さないよう、手元の CRC32C / MD5 を一覧（list_blobs の結果）の
+# ハッシュと比べ、同じなら送らない。大きいファイルは再開可能アップロードで分割して送り、
+# 失敗したら GCS が受け取り済みの位置から続ける。
+RESUMABLE_THRESHOLD = 8 * 1024 * 1024   # これ以上は分割して送る
+RESUMABLE_CHUNK = 2 * 1024 * 1024       # 256KiB の倍数
+CHUNK_RETRIES = 5
+
+_sessions = {}    # {(blob名, MD5): 再開可能アップロードのURL}  同じ内容を再送信したときに続きから送る
+_sessions_lock = threading.Lock()
+
+
+class UploadStats:
+    """実際に送ったバイト数と、同一内容のため省略したバイト数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = self.skipped = 0
+        self.sent_bytes = self.skipped_bytes = self.resumed_bytes = 0
+
+    def add_sent(self, n_bytes, resumed_bytes=0):
+        with self._lock:
+            self.sent += 1
+            self.sent_bytes += n_bytes - resumed_bytes
+            self.resumed_bytes += resumed_bytes
+
+    def add_skipped(self, n_bytes):
+        with self._lock:
+            self.skipped += 1
+            self.skipped_bytes += n_bytes
+
+    def summary(self):
+        text = f"送信 {self.sent}枚（{_mb(self.sent_bytes)}）・同一のため省略 {self.skipped}枚（{_mb(self.skipped_bytes)}）"
+        if self.resumed_bytes:
+            text += f"・途中から再開 {_mb(self.resumed_bytes)} 分は送信済み"
+        return text
+
+
+def _mb(n_bytes):
+    return f"{n_bytes / 1024 / 1024:.1f}MB"
+
+
+def content_hashes(data):
+    """GCS の md5Hash / crc32c と同じ形式（base64）のハッシュ。google-crc32c が無ければ MD5 だけ"""
+    hashes = {"md5": base64.b64encode(hashlib.md5(data).digest()).decode("ascii"), "crc32c": None}
+    try:
+        import google_crc32c
+        hashes["crc32c"] = base64.b64encode(google_crc32c.value(data).to_bytes(4, "big")).decode("ascii")
+    except ImportError:
+        pass
+    return hashes
+
+
+def blob_entry(blob):
+    """一覧の1件を比較用の辞書にする"""
+    return {"size": getattr(blob, "size", None), "generation": getattr(blob, "generation", None), "md5": getattr(blob, "md5_hash", None),
+            "crc32c": getattr(blob, "crc32c", None), "row_id": (getattr(blob, "metadata", None) or {}).get(ROW_ID_META, "")}
+
+
+def listing(bucket, prefix):
+    """フォルダ内の {blob名: blob_entry}。アップロード前に1回だけ呼んで使い回す"""
+    blobs = perf.call("gcs.list_blobs", prefix, lambda: list(bucket.list_blobs(prefix=prefix)))
+    return {b.name: blob_entry(b) for b in blobs}
+
+
+def is_same_content(entry, data, hashes):
+    if not entry or entry.get("size") != len(data):
+        return False
+    if entry.get("crc32c") and hashes["crc32c"]:
+        return entry["crc32c"] == hashes["crc32c"]
+    return bool(entry.get("md5")) and entry["md5"] == hashes["md5"]
+
+
+def _confirmed_offset(http, url, total):
+    """再開可能アップロードで GCS が受け取り済みのバイト数。セッションが切れていれば None"""
+    r = http.put(url, data=b"", headers={"Content-Range": f"bytes */{total}"}, timeout=60)
+    if r.status_code in (200, 201):
+        return total
+    if r.status_code == 308:
+        received = r.headers.get("Range")   # "bytes=0-N"
+        return int(received.rsplit("-", 1)[1]) + 1 if received else 0
+    if r.status_code in (404, 410):
+        return None
+    r.raise_for_status()
+    return None
+
+
+def _resumable_upload(blob, data, content_type, md5):
+    """分割アップロード。チャンクが失敗したら受け取り済みの位置を問い合わせて続きから送る。
+    続きから送った場合、前回までに送信済みだったバイト数を返す"""
+    http = blob.client._http
+    total = len(data)
+    key = (blob.name, md5)
+    with _sessions_lock:
+        url = _sessions.get(key)
+    offset = _confirmed_offset(http, url, total) if url else None
+    if offset is None:
+        url = perf.call("gcs.resumable_start", blob.name, blob.create_resumable_upload_session, content_type=content_type, size=total)
+        offset = 0
+        with _sessions_lock:
+            _sessions[key] = url
+    resumed, failures = offset, 0
+    while offset < total:
+        end = min(offset + RESUMABLE_CHUNK, total)
+        try:
+            r = perf.call("gcs.upload_chunk", blob.name, http.put, url, data=data[offset:end],
+                          headers={"Content-Range": f"bytes {offset}-{end - 1}/{total}"}, timeout=120)
+            if r.status_code in (200, 201):
+                offset = total
+            elif r.status_code == 308:
+                received = r.headers.get("Range")
+                offset = int(received.rsplit("-", 1)[1]) + 1 if received else offset
+                failures = 0
+            elif r.status_code < 500 and r.status_code not in (408, 429):
+                # 4xx は再試行しても直らない
+                raise RuntimeError(f"画像のアップロードに失敗しました（HTTP {r.status_code}）: {r.text[:200]}")
+            else:
+                raise ConnectionError(f"HTTP {r.status_code}")
+        except OSError:   # 通信エラー（requests の例外も OSError の一種）・5xx
+            failures += 1
+            if failures > CHUNK_RETRIES:
+                raise
+            time.sleep(min(2 ** failures, 30))
+            confirmed = _confirmed_offset(http, url, total)
+            if confirmed is None:
+                raise
+            offset = confirmed
+    with _sessions_lock:
+        _sessions.pop(key, None)
+    return resumed
+
+
+def upload_image(bucket, blob_path, data, content_type, hash_index=None, row_id=None, existing=None, stats=None):
+    """画像を1枚アップロード。他店舗・落ち店の使用済み画像と酷似していれば [(距離, blob名)] を返す。
+    existing に同じ名前の既存画像（blob_entry）を渡すと、内容が同じときは送らずに済ませる"""
+    img_hash, similar = (None, [])
+    if hash_index is not None:
+        img_hash, similar = hash_index.check_upload(data, blob_path)
+    blob = bucket.blob(blob_path)
+    blob.cache_control = image_urls.CACHE_CONTROL   # URL に世代番号を付けるので、内容は変わらない前提でキャッシュさせる
+    if row_id:
+        blob.metadata = {ROW_ID_META: row_id}
+    hashes = content_hashes(data)
+    if is_same_content(existing, data, hashes):
+        if row_id and existing.get("row_id") != row_id:
+            perf.call("gcs.patch", blob_path, blob.patch)   # 中身は同じで行IDだけ付け替える
+        if stats is not None:
+            stats.add_skipped(len(data))
+    else:
+        resumed = 0
+        if len(data) >= RESUMABLE_THRESHOLD and hasattr(blob, "create_resumable_upload_session"):
+            resumed = _resumable_upload(blob, data, content_type, hashes["md5"])
+        else:
+            perf.call("gcs.upload", blob_path, blob.upload_from_string, data, content_type=content_type)
+        if stats is not None:
+            stats.add_sent(len(data), resumed)
+    if hash_index is not None and img_hash is not None and hash_index.hashes.get(blob_path) != img_hash:
+        hash_index.add(blob_path, img_hash)
+    return similar
+
+
+def row_id_of(row):
+    """sheet_row で作った行の行ID（Z列）。無ければ空文字"""
+    return str(row[account_data.ROW_ID_COL]).strip() if len(row) > account_data.ROW_ID_COL else ""
+
+
+def written_row_ids(ws):
+    """シートの Z 列に既にある行IDの集合（Z 列だけ読む）"""
+    ids = perf.call("sheets.col_values", getattr(ws, "title", ""), ws.col_values, account_data.ROW_ID_COL + 1)
+    return {v.strip() for v in ids if v.strip()}
+
+
+def append_rows_chunked(ws, rows, chunk=APPEND_CHUNK, on_chunk=None, retries=5, skip_written=False):
+    """append_rows を chunk 行ずつ実行。429 は待って再試行し、1チャンク終わるごとに on_chunk(済み行数) を呼ぶ
+    skip_written=True なら再試行の前に Z 列を読み直し、失敗扱いでも実は入っていた行（行IDが同じ行）は送らない"""
+    done = 0
+    while done < len(rows):
+        part = rows[done:done + chunk]
+        size = len(part)
+        for attempt in range(retries):
+            try:
+                if attempt and skip_written:
+                    written = written_row_ids(ws)
+                    part = [r for r in part if not row_id_of(r) or row_id_of(r) not in written]
+                if part:
+                    perf.call("sheets.append_rows", getattr(ws, "title", ""), ws.append_rows, part, value_input_option='USER_ENTERED')
+                break
+            except Exception as e:
+                if "429" not in str(e) or attempt == retries - 1:
+                    raise
+                time.sleep(min(2 ** attempt * 5, 60))
+        done += size
+        if on_chunk:
+            on_chunk(done)
+    return done
@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import perf
+
+# --- 落ち店移動のバックグラウンドジョブ ---
+# 1店舗の移動を「日記文のストック転記 → 元シートの行削除 → ログイン情報削除 → 画像移動」の
+# ステップに分け、進捗をジャーナル（JSON）へ逐次保存する。
+# 途中で止まっても、ジャーナルから再開すれば済んだ作業は繰り返さない。
+# ジャーナルは画像用の公開バケットには置かない：DIARY_JOB_BUCKET（非公開バケット）があればそこ、
+# 無ければローカルフォルダ（DIARY_JOB_DIR）。ジョブが終わったら（完了・失敗とも）ジャーナルは消す。
+
+JOB_PREFIX = "_system/retire_jobs/"
+JOB_DIR = os.environ.get("DIARY_JOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".retire_jobs"))
+JOB_BUCKET = os.environ.get("DIARY_JOB_BUCKET")
+OCHIMISE_ROOT = "【落ち店】/"
+ROW_ID_COL = 25   # account_data.ROW_ID_COL（Z列の行ID）
+STEPS = ["copy_rows", "delete_rows", "delete_status", "move_blobs", "done"]
+APPEND_CHUNK = 50  # ストックシートへ一度に転記する行数
+
+
+def with_retry(fn, *args, tries=6, **kwargs):
+    """429（API制限）や一時的な通信エラーは指数バックオフで再試行"""
+    for attempt in range(tries):
+        try:
+            return perf.call(f"job.{getattr(fn, '__name__', 'call')}", "", fn, *args, **kwargs)
+        except Exception as e:
+            msg = str(e)
+            if attempt == tries - 1 or not any(c in msg for c in ("429", "500", "502", "503", "Connection")):
+                raise
+            time.sleep(min(2 ** attempt * 2, 60))
+
+
+# --- ジャーナルの保存先 ---
+class LocalJournal:
+    def __init__(self, root=JOB_DIR):
+        self.root = root
+
+    def load_all(self):
+        jobs = []
+        for fn in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            try:
+                with open(os.path.join(self.root, fn), encoding="utf-8") as f:
+                    jobs.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return jobs
+
+    def save(self, job):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"{job['id']}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def delete(self, job_id):
+        try:
+            os.remove(os.path.join(self.root, f"{job_id}.json"))
+        except FileNotFoundError:
+            pass
+
+
+class BucketJournal:
+    """非公開バケットに置くジャーナル"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def load_all(self):
+        jobs = []
+        for blob in self.bucket.list_blobs(prefix=JOB_PREFIX):
+            try:
+                jobs.append(json.loads(blob.download_as_bytes()))
+            except Exception:
+                continue
+        return jobs
+
+    def save(self, job):
+        blob = self.bucket.blob(f"{JOB_PREFIX}{job['id']}.json")
+        with_retry(blob.upload_from_string, json.dumps(job, ensure_ascii=False), content_type="application/json")
+
+    def delete(self, job_id):
+        try: self.bucket.blob(f"{JOB_PREFIX}{job_id}.json").delete()
+        except Exception: pass
+
+
+def journal_store(storage_client):
+    return BucketJournal(storage_client.bucket(JOB_BUCKET)) if JOB_BUCKET else LocalJournal()
+
+
+_sheet_locks = {}
+_sheet_locks_guard = threading.Lock()
+
+
+def sheet_lock(spreadsheet_id, title):
+    """シートごとのロック。行の削除や行番号を使った書き込みは、このロックの中で直前に読み直した行番号で行う
+    （同じシートへの別の削除で行がずれて、別の店舗の行を消さないように）"""
+    with _sheet_locks_guard:
+        return _sheet_locks.setdefault((spreadsheet_id, title), threading.RLock())
+
+
+def contiguous_blocks(row_numbers):
+    """行番号を下から順に連続ブロック (start, end) へまとめる（削除しても上の行番号がずれない順）"""
+    blocks = []
+    for r in sorted(row_numbers, reverse=True):
+        if blocks and blocks[-1][0] == r + 1:
+            blocks[-1][0] = r
+        else:
+            blocks.append([r, r])
+    return [tuple(b) for b in blocks]
+
+
+class RetireJobRunner:
+    """落ち店移動ジョブの実行・再開・進捗管理（プロセス内で1つだけ作って共有する）"""
+
+    def __init__(self, gc, bucket, get_router, journal=None, max_workers=3, on_blob_moved=None, on_job_done=None):
+        self.gc = gc
+        self.bucket = bucket       # 画像のバケット（ジャーナルは置かない）
+        self.journal = journal or LocalJournal()
+        self.get_router = get_router   # 呼ぶたびに最新の対応表（sheet_routing.SheetRouter）を返す
+        self.on_blob_moved = on_blob_moved
+        self.on_job_done = on_job_done
+        self.jobs = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retire")
+        self.load_journals()
+
+    # --- ジャーナル ---
+    def load_journals(self):
+        """残っている未完了ジョブを読み込む（再起動後の再開用）"""
+        for job in self._take_public_journals() + self.journal.load_all():
+            if job.get("state") != "done":
+                if job.get("state") in ("queued", "running"):
+                    job["state"] = "interrupted"
+                self.jobs.setdefault(job["id"], job)
+
+    def _take_public_journals(self):
+        """以前は画像の公開バケットに置いていたジャーナルを、ログイン情報を除いて今の保存先へ移す"""
+        jobs = []
+        for blob in self.bucket.list_blobs(prefix=JOB_PREFIX):
+            try:
+                job = json.loads(blob.download_as_bytes())
+                row = job.pop("status_row", None)
+                if row and not job.get("status_deleted"):
+                    job["status_key"] = (row + [""] * 3)[:3]
+                self.journal.save(job)
+                jobs.append(job)
+                blob.delete()
+            except Exception:
+                continue
+        return jobs
+
+    def _save(self, job):
+        job["updated_at"] = time.time()
+        self.journal.save(job)
+
+    # --- 投入・再開 ---
+    def submit(self, acc, area, shop):
+        with self._lock:
+            for job in self.jobs.values():
+                if job["acc"] == acc and job["shop"] == shop and job["state"] != "done":
+                    return job["id"]
+            job = {
+                "id": f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}",
+                "acc": acc, "area": area, "shop": shop,
+                "state": "queued", "step": STEPS[0], "error": None,
+                "snapshot": None, "rows_total": 0, "rows_copied": 0, "rows_deleted": 0,
+                "status_deleted": False, "blobs_total": 0, "blobs_moved": 0,
+                "created_at": time.time(), "started_at": None, "finished_at": None,
+            }
+            self.jobs[job["id"]] = job
+        self._save(job)
+        self._start(job)
+        return job["id"]
+
+    def resume(self, job_id):
+        job = self.jobs[job_id]
+        if job["state"] in ("failed", "interrupted"):
+            job["state"], job["error"] = "queued", None
+            self._start(job)
+
+    def _start(self, job):
+        with self._lock:
+            if job["id"] in self._running:
+                return
+            self._running.add(job["id"])
+        self._executor.submit(self._run, job)
+
+    def has_active(self):
+        return any(j["state"] in ("queued", "running") for j in self.jobs.values())
+
+    def list_jobs(self):
+        return sorted(self.jobs.values(), key=lambda j: j["created_at"])
+
+    def clear_finished(self):
+        """完了済みジョブを一覧とジャーナルから消す"""
+        with self._lock:
+            done = [j for j in self.jobs.values() if j["state"] == "done"]
+            for job in done:
+                self.jobs.pop(job["id"], None)
+        for job in done:
+            self.journal.delete(job["id"])
+
+    # --- 進捗 ---
+    @staticmethod
+    def progress(job):
+        """(完了単位数, 全体単位数, 1秒あたりの処理数)"""
+        total = job["rows_total"] * 2 + 1 + job["blobs_total"]
+        done = job["rows_copied"] + job["rows_deleted"] + int(job["status_deleted"]) + job["blobs_moved"]
+        if job["state"] == "done":
+            done = total
+        elapsed = (job["finished_at"] or time.time()) - job["started_at"] if job["started_at"] else 0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return done, max(total, 1), rate
+
+    # --- 実行本体 ---
+    def _run(self, job):
+        try:
+            job["state"] = "running"
+            job["started_at"] = job["started_at"] or time.time()
+            self._save(job)
+            for step in STEPS[STEPS.index(job["step"]):-1]:
+                getattr(self, f"_step_{step}")(job)
+                job["step"] = STEPS[STEPS.index(step) + 1]
+                self._save(job)
+            job["state"] = "done"
+            job["finished_at"] = time.time()
+            if self.on_job_done:
+                self.on_job_done(job)
+        except Exception as e:
+            # 失敗したジョブは一覧（メモリ）に残り、「再開」でジャーナルを書き直して続きから進む
+            job["state"] = "failed"
+            job["error"] = str(e)
+        finally:
+            self.journal.delete(job["id"])
+            with self._lock:
+                self._running.discard(job["id"])
+
+    def _main_ws(self, job):
+        """(ロック, シート)"""
+        loc = self.get_router().location(job["acc"], job["area"])
+        return sheet_lock(loc.spreadsheet_id, loc.worksheet), with_retry(self.gc.open_by_key, loc.spreadsheet_id).worksheet(loc.worksheet)
+
+    @staticmethod
+    def _is_store_row(job, r):
+        return len(r) >= 2 and r[0].strip() == job["area"].strip() and r[1].strip() == job["shop"].strip()
+
+    @staticmethod
+    def _snapshot_key(r):
+        """行の照合キー。行IDがあれば行ID、無ければ（タイトル, 本文）"""
+        rid = r[ROW_ID_COL].strip() if len(r) > ROW_ID_COL else ""
+        return ("id", rid) if rid else ("text", r[5] if len(r) > 5 else "", r[6] if len(r) > 6 else "")
+
+    def _step_copy_rows(self, job):
+        # 初回だけ対象行（タイトル・本文・行ID）を確定してジャーナルへ記録し、以降はその続きから転記
+        if job["snapshot"] is None:
+            rows = with_retry(self._main_ws(job)[1].get_all_values)
+            job["snapshot"] = [[r[5] if len(r) > 5 else "", r[6] if len(r) > 6 else "", r[ROW_ID_COL].strip() if len(r) > ROW_ID_COL else ""]
+                               for r in rows if self._is_store_row(job, r)]
+            job["rows_total"] = len(job["snapshot"])
+            self._save(job)
+        ws_stock = with_retry(self.gc.open_by_key, self.get_router().stock_id).sheet1
+        while job["rows_copied"] < job["rows_total"]:
+            chunk = job["snapshot"][job["rows_copied"]:job["rows_copied"] + APPEND_CHUNK]
+            with_retry(ws_stock.append_rows, [[None, None, s[0], s[1]] for s in chunk], value_input_option='USER_ENTERED')
+            job["rows_copied"] += len(chunk)
+            self._save(job)
+
+    def _step_delete_rows(self, job):
+        # 削除は1ブロックずつ、シートのロックの中で直前に読み直した行番号で行う（転記済みの内容と一致する行だけ）
+        lock, ws_main = self._main_ws(job)
+        remaining = {}
+        for s in job["snapshot"]:
+            # 古いジャーナルは [タイトル, 本文] だけ
+            key = ("id", s[2]) if len(s) > 2 and s[2] else ("text", s[0], s[1])
+            remaining[key] = remaining.get(key, 0) + 1
+        while True:
+            with lock:
+                rows = with_retry(ws_main.get_all_values)
+                left = dict(remaining)
+                targets = {}
+                for i, r in enumerate(rows, 1):
+                    key = self._snapshot_key(r)
+                    if self._is_store_row(job, r) and left.get(key):
+                        left[key] -= 1
+                        targets[i] = key
+                blocks = contiguous_blocks(targets)
+                if not blocks:
+                    break
+                start, end = blocks[0]   # 一番下のブロック
+                with_retry(ws_main.delete_rows, start, end)
+            for i in range(start, end + 1):
+                remaining[targets[i]] -= 1
+            job["rows_deleted"] = min(job["rows_deleted"] + end - start + 1, job["rows_total"])
+            self._save(job)
+        job["rows_deleted"] = job["rows_total"]
+
+    def _step_delete_status(self, job):
+        # 消す行の (エリア, 店名, 媒体) と、その時点で同じキーの行が何行あったかをジャーナルに記録してから消す
+        # （ID・パスワードは記録しない）。再開時は行数が記録のままのときだけ消す（消し済みなら二重に消さない）
+        router = self.get_router()
+        title = router.sheet_map[job["acc"]]
+        ws_link = with_retry(self.gc.open_by_key, router.status_id).worksheet(title)
+        key_of = lambda r: [c.strip() for c in (r + [""] * 3)[:3]]
+        with sheet_lock(router.status_id, title):
+            link_data = with_retry(ws_link.get_all_values)
+            if job.get("status_count") is None:
+                if job.get("status_key") is None:
+                    shop_rows = [r for r in link_data if len(r) >= 2 and r[1] == job["shop"]]
+                    if not shop_rows:
+                        job["status_deleted"] = True
+                        return
+                    job["status_key"] = key_of(shop_rows[-1])
+                job["status_count"] = sum(1 for r in link_data if key_of(r) == job["status_key"])
+                self._save(job)
+            matches = [i for i, r in enumerate(link_data, 1) if key_of(r) == job["status_key"]]
+            if matches and len(matches) == job["status_count"]:
+                with_retry(ws_link.delete_rows, matches[-1])
+        job["status_deleted"] = True
+
+    def _step_move_blobs(self, job):
+        # コピー→削除済みの画像は一覧に出てこないので、残っているものだけを移動すれば冪等
+        found_blobs = []
+        for pfx in [f"{job['area']}/{job['shop']}/", f"{job['area']}/デリじゃ {job['shop']}/"]:
+            found_blobs = list(with_retry(self.bucket.list_blobs, prefix=pfx))
+            if found_blobs: break
+        job["blobs_total"] = job["blobs_moved"] + len(found_blobs)
+        self._save(job)
+        for i, b in enumerate(found_blobs, 1):
+            new_name = f"{OCHIMISE_ROOT}{job['shop']}/{b.name.split('/')[-1]}"
+            with_retry(self.bucket.copy_blob, b, self.bucket, new_name)
+            with_retry(b.delete)
+            if self.on_blob_moved:
+                self.on_blob_moved(b.name, new_name)
+            job["blobs_moved"] += 1
+            if i % 20 == 0 or i == len(found_blobs):
+                self._save(job)
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# --- 投稿時間プランナー ---
+# 投稿A〜Dの全シートから「アカウント × 時間帯」の投稿数を集計し、新しく登録する日記の投稿時間を
+# 空いている枠へ振り分ける。GCEはメンテナンス時間（06:00〜11:00）に止まるため、その枠は使わない。
+
+SLOT_MIN = 10                         # 提案する投稿時間の刻み（分）
+SLOTS_PER_DAY = 24 * 60 // SLOT_MIN
+MAINTENANCE = (6 * 60, 11 * 60)       # この範囲（分, 両端含む）は投稿しない
+POSTS_PER_HOUR_CAPACITY = 6           # 1アカウントが1時間に捌ける投稿数の目安
+SAME_STORE_GAP_MIN = 20               # 同じ店舗の投稿はこの分数より離す（画像照合の許容幅と同じ）
+
+
+def parse_minutes(times):
+    """投稿時間の列（"930" / "0930" / "9:30" など）を 0時からの分に変換。読めないものは NaN"""
+    digits = times.astype(str).str.replace(r"[^0-9]", "", regex=True)
+    digits = digits.where(digits.str.len() != 3, "0" + digits)
+    valid = digits.str.len() == 4
+    hh = pd.to_numeric(digits.str[:2].where(valid), errors="coerce")
+    mm = pd.to_numeric(digits.str[2:4].where(valid), errors="coerce")
+    ok = (hh < 24) & (mm < 60)
+    return (hh * 60 + mm).where(ok)
+
+
+def _maintenance_mask(minutes):
+    return (minutes >= MAINTENANCE[0]) & (minutes <= MAINTENANCE[1])
+
+
+def hourly_load(df, accounts):
+    """時間(0〜23) × アカウントの投稿数。df は「アカウント」「投稿時間」列を持つこと"""
+    minutes = parse_minutes(df["投稿時間"])
+    hours = (minutes // 60).dropna().astype(int)
+    acc = df.loc[hours.index, "アカウント"]
+    table = {a: np.bincount(hours[acc == a].to_numpy(), minlength=24) for a in accounts}
+    return pd.DataFrame(table, index=pd.RangeIndex(24, name="時"))
+
+
+def remaining_capacity(load):
+    """時間帯ごとの残り投稿枠（メンテナンス時間帯は 0）"""
+    cap = np.full(24, POSTS_PER_HOUR_CAPACITY)
+    cap[[h for h in range(24) if MAINTENANCE[0] <= h * 60 and h * 60 + 59 <= MAINTENANCE[1]]] = 0
+    return load.rsub(cap, axis=0).clip(lower=0)
+
+
+def propose_times(df, account, store, count):
+    """account に store の日記を count 件追加するときの投稿時間（"HHMM"）を提案。
+    アカウントの混み具合が低い枠を優先し、メンテナンス時間と同じ店舗の近い時間は避ける"""
+    minutes = parse_minutes(df["投稿時間"])
+    valid = minutes.notna()
+    slot_of = (minutes[valid] // SLOT_MIN).astype(int).to_numpy()
+    in_acc = (df.loc[valid, "アカウント"] == account).to_numpy()
+    in_store = (df.loc[valid, "店名"].astype(str).str.strip() == store.strip()).to_numpy()
+
+    slot_load = np.bincount(slot_of[in_acc], minlength=SLOTS_PER_DAY).astype(float)
+    hour_load = slot_load.reshape(24, -1).sum(axis=1)
+
+    slot_start = np.arange(SLOTS_PER_DAY) * SLOT_MIN
+    blocked = _maintenance_mask(slot_start)
+    # 同じ店舗の既存投稿から ±SAME_STORE_GAP_MIN 以内の枠をまとめて塞ぐ
+    gap = SAME_STORE_GAP_MIN // SLOT_MIN
+    offsets = np.arange(-gap, gap + 1)
+    near_store = np.zeros(SLOTS_PER_DAY, dtype=bool)
+    near_store[(slot_of[in_store][:, None] + offsets).ravel() % SLOTS_PER_DAY] = True
+
+    proposals = []
+    for _ in range(count):
+        candidates = ~blocked & ~near_store
+        if not candidates.any():
+            candidates = ~blocked
+        # 時間帯の混雑を優先し、同じ時間帯の中では投稿の少ない10分枠を選ぶ
+        score = hour_load[np.arange(SLOTS_PER_DAY) // (60 // SLOT_MIN)] * 100 + slot_load
+        score = np.where(candidates, score, np.inf)
+        best = int(np.argmin(score))
+        proposals.append(best)
+        near_store[(best + offsets) % SLOTS_PER_DAY] = True
+        slot_load[best] += 1
+        hour_load[best // (60 // SLOT_MIN)] += 1
+    return [f"{(s * SLOT_MIN) // 60:02d}{(s * SLOT_MIN) % 60:02d}" for s in sorted(proposals)]
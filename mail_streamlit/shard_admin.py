@@ -0,0 +1,299 @@
+"""投稿アカウントシートの振り分け（シャード）の管理コマンド
+
+対応表（GCS の _system/sheet_routing.json）を表示・変更し、アカウント（またはアカウントの1エリア）の行を
+別のスプレッドシートへ移す。
+
+    python shard_admin.py show
+    python shard_admin.py add-shard s2 <スプレッドシートID>
+    python shard_admin.py add-account E --shard s2
+    python shard_admin.py move --account B --to s2
+    python shard_admin.py move --account C --area 池袋 --to s2
+
+move の流れ：行IDの付与 → 移動先へコピー → 対応表の切り替え → アプリが切り替わるまで待つ
+→ 待っている間に元のシートへ入った追加・変更を移動先へ反映 → 元のシートから削除。
+途中で止まっても同じコマンドを再実行すれば続きから進む（行は行IDで照合するので二重にコピー・削除しない）。
+投稿システムが読むシートも変わるので、切り替え後は投稿システム側の読み先も対応表に合わせること。
+
+アプリは書き込みの直前に対応表の世代番号を確かめるので、切り替えて --wait 秒待てば元のシートへは書かなくなる。
+ただし元のシートからの削除（最後の段階）はアプリのプロセスとは排他にならない（sheet_lock はプロセス内だけ）。
+切り替え前から続いている落ち店移動などがあれば、それが終わってから（アプリが静かなときに）実行すること。
+move 同士は GCS のロック（_system/shard_admin.lock）で別のPC・プロセスとも同時に1つだけにする。
+"""
+import os
+import sys
+import copy
+import json
+import time
+import socket
+import argparse
+from contextlib import contextmanager
+
+import account_data
+import registration
+import sheet_routing
+from retire_jobs import with_retry, contiguous_blocks
+
+STATUS_HEADER = ["エリア", "店名", "媒体", "ログインID", "パスワード"]
+ROW_WIDTH = account_data.ROW_ID_COL + 1
+MOVE_LOCK_BLOB = "_system/shard_admin.lock"
+
+
+def connect(secrets_path):
+    import tomllib
+    import transport
+    with open(secrets_path, "rb") as f:
+        secrets = tomllib.load(f)
+    info = secrets["gcp_service_account"]
+    bucket = transport.storage_client(info).bucket(registration.GCS_BUCKET_NAME)
+    return transport.gspread_client(info), bucket, secrets["google_resources"]["spreadsheet_id"]
+
+
+def load(bucket, main_id):
+    loaded = sheet_routing.load_table(bucket, main_id)
+    return loaded["table"], loaded["generation"]
+
+
+def worksheet(gc, spreadsheet_id, title, header=None):
+    """シートを開く。無ければ header を1行目にして作る"""
+    sh = with_retry(gc.open_by_key, spreadsheet_id)
+    try:
+        return sh, with_retry(sh.worksheet, title)
+    except Exception:
+        if header is None:
+            raise
+        ws = with_retry(sh.add_worksheet, title=title, rows=1000, cols=ROW_WIDTH)
+        with_retry(ws.update, range_name="A1", values=[header])
+        print(f"  📄 {title} を作成しました（{spreadsheet_id}）")
+        return sh, ws
+
+
+def _pad(row):
+    return (list(row) + [""] * ROW_WIDTH)[:ROW_WIDTH]
+
+
+def _row_id(row):
+    return row[account_data.ROW_ID_COL].strip() if len(row) > account_data.ROW_ID_COL else ""
+
+
+# --- 表示・追加 ---
+def cmd_show(table, generation):
+    print(f"対応表（世代 {generation or 'なし：既定の構成'}）")
+    for name, sid in table["shards"].items():
+        print(f"  シャード {name}: {sid}{'（集計シート）' if name == table['home'] else ''}")
+    for code, conf in table["accounts"].items():
+        areas = "".join(f"、{a}→{s}" for a, s in (conf.get("areas") or {}).items())
+        moving = f"　※移動中 {conf['moving']}" if conf.get("moving") else ""
+        print(f"  アカウント {code}: {conf.get('sheet') or sheet_routing.sheet_name(code)} @ {conf['shard']}{areas}{moving}")
+
+
+def cmd_add_shard(bucket, table, generation, name, spreadsheet_id):
+    if name in table["shards"]:
+        raise SystemExit(f"❌ シャード {name} は既にあります")
+    table["shards"][name] = spreadsheet_id
+    sheet_routing.save(bucket, table, generation)
+    print(f"✅ シャード {name} を追加しました")
+
+
+def cmd_add_account(gc, bucket, table, generation, code, shard):
+    if code in table["accounts"]:
+        raise SystemExit(f"❌ アカウント {code} は既にあります")
+    if shard not in table["shards"]:
+        raise SystemExit(f"❌ シャード {shard} がありません")
+    title = sheet_routing.sheet_name(code)
+    # 見出し行は既存のアカウントのシートに合わせる
+    router = sheet_routing.SheetRouter(table, generation)
+    first = router.location(router.accounts[0])
+    header = with_retry(worksheet(gc, first.spreadsheet_id, first.worksheet)[1].row_values, 1) or account_data.DF_COLS
+    sh, ws = worksheet(gc, table["shards"][shard], title, header)
+    registration.ensure_row_id_column(sh, ws)
+    worksheet(gc, router.status_id, title, STATUS_HEADER)
+    table["accounts"][code] = {"shard": shard, "sheet": title}
+    sheet_routing.save(bucket, table, generation)
+    print(f"✅ アカウント {code} を {shard} に追加しました（アプリには {sheet_routing.ROUTING_MAX_AGE} 秒以内に出ます）")
+
+
+# --- 移動 ---
+@contextmanager
+def move_lock(bucket):
+    """move を同時に1つだけにする（ロックのオブジェクトを「まだ無いときだけ作る」ので別のPC・プロセスとも排他）"""
+    from google.api_core.exceptions import PreconditionFailed
+    blob = bucket.blob(MOVE_LOCK_BLOB)
+    owner = {"host": socket.gethostname(), "pid": os.getpid(), "started_at": time.time()}
+    try:
+        # 再試行はしない（1回目が実は通っていると、自分のロックを「実行中」と見誤る）
+        blob.upload_from_string(json.dumps(owner), content_type="application/json", if_generation_match=0)
+    except PreconditionFailed:
+        raise SystemExit(f"❌ 別の move が実行中です（{MOVE_LOCK_BLOB}）。止まったまま残っているなら中身を確かめてから削除してください")
+    try:
+        yield
+    finally:
+        with_retry(blob.delete)
+
+
+def _check_generation(bucket, generation):
+    """対応表が自分の切り替え後のままか（他の変更が入っていたら、その対応表で削除を続けない）"""
+    blob = with_retry(bucket.get_blob, sheet_routing.ROUTING_BLOB)
+    if (blob.generation if blob else None) != generation:
+        raise SystemExit("❌ 移動中に対応表が変更されました。show で確かめてから同じコマンドを再実行してください")
+
+
+def _in_scope(router_before, code, area, src, row):
+    """移動対象の行か（エリア指定時はそのエリア、アカウント全体ならそのシャードに割り当てられていたエリア）"""
+    if not any(str(v).strip() for v in row[:len(account_data.DF_COLS)]):
+        return False
+    if area is not None:
+        return row[0].strip() == area
+    return router_before.location(code, row[0]) == src
+
+
+def _read_scope(ws, router_before, code, area, src):
+    rows = with_retry(ws.get_all_values)
+    return [(i, _pad(r)) for i, r in enumerate(rows[1:], 2) if _in_scope(router_before, code, area, src, _pad(r))]
+
+
+def _assign_ids(ws, scope):
+    """行IDの無い行に ID を振る（移動の照合はすべて行IDで行う）"""
+    missing = [{"range": f"{account_data.ROW_ID_LETTER}{i}", "values": [[registration.new_row_id()]]} for i, r in scope if not _row_id(r)]
+    if missing:
+        with_retry(ws.batch_update, missing)
+        print(f"  🔖 行IDを {len(missing)} 行に付けました")
+    return len(missing)
+
+
+def cmd_move(gc, bucket, main_id, code, area, dest, wait):
+    table, generation = load(bucket, main_id)
+    if code not in table["accounts"]:
+        raise SystemExit(f"❌ アカウント {code} は対応表にありません")
+    if dest not in table["shards"]:
+        raise SystemExit(f"❌ シャード {dest} がありません")
+    conf = table["accounts"][code]
+    moving = conf.get("moving")
+    if moving and (moving["area"], moving["to"]) != (area, dest):
+        raise SystemExit(f"❌ アカウント {code} は別の移動の途中です: {moving}（同じ指定で再実行して終わらせてください）")
+
+    router = sheet_routing.SheetRouter(table, generation)
+    if moving:
+        # 切り替え済みの移動を再開：元のシャードは記録から
+        src = router.location(code, area)._replace(shard=moving["from"], spreadsheet_id=table["shards"][moving["from"]])
+        before = dict(table, accounts=dict(table["accounts"], **{code: moving["before"]}))
+        router_before = sheet_routing.SheetRouter(before)
+        print(f"⏩ 切り替え済みの移動を再開します（{moving['from']} → {dest}）")
+    else:
+        src = router.location(code, area)
+        router_before = sheet_routing.SheetRouter(copy.deepcopy(table))   # 切り替え前の対応表（table はこの後書き換える）
+        if src.shard == dest:
+            print("✅ 既に移動先のシャードにあります")
+            return 0
+    dst = src._replace(shard=dest, spreadsheet_id=table["shards"][dest])
+    label = f"{code}{f'（{area}）' if area else ''}"
+    _, ws_src = worksheet(gc, src.spreadsheet_id, src.worksheet)
+    header = with_retry(ws_src.row_values, 1) or account_data.DF_COLS
+    sh_dst, ws_dst = worksheet(gc, dst.spreadsheet_id, dst.worksheet, header)
+    registration.ensure_row_id_column(sh_dst, ws_dst)
+
+    copied = {}
+    if not moving:
+        # 1. 行IDの無い行に ID を振る
+        _assign_ids(ws_src, _read_scope(ws_src, router_before, code, area, src))
+
+        # 2. 移動先へコピー（移動先に同じ行IDがあれば飛ばす）
+        scope = _read_scope(ws_src, router_before, code, area, src)
+        have = {_row_id(_pad(r)) for r in with_retry(ws_dst.get_all_values)[1:]}
+        todo = [r for _, r in scope if _row_id(r) not in have]
+        print(f"📋 {label} の {len(scope)} 行をコピー中...（新規 {len(todo)} 行）")
+        registration.append_rows_chunked(ws_dst, todo)
+        copied = {_row_id(r): r for _, r in scope}
+
+        # 3. 対応表を切り替える（移動中の印も残し、止まっても再開できるようにする）
+        new_conf = dict(conf, moving={"area": area, "from": src.shard, "to": dest, "before": conf})
+        if area is None:
+            new_conf["shard"] = dest
+            new_conf["areas"] = {a: s for a, s in (conf.get("areas") or {}).items() if s != dest}
+        else:
+            new_conf["areas"] = dict(conf.get("areas") or {}, **{area: dest})
+            if dest == conf["shard"]:
+                del new_conf["areas"][area]
+        if not new_conf["areas"]:
+            new_conf.pop("areas")
+        table["accounts"][code] = new_conf
+        generation = sheet_routing.save(bucket, table, generation)
+        print(f"🔀 対応表を切り替えました。アプリが読み直すまで {wait} 秒待ちます...")
+        time.sleep(wait)
+
+    # 4. 待っている間に元のシートへ入った追加・変更を移動先へ反映（再開時は移動先の行が基準）
+    _assign_ids(ws_src, _read_scope(ws_src, router_before, code, area, src))
+    scope = _read_scope(ws_src, router_before, code, area, src)
+    dst_rows = {_row_id(_pad(r)): (i, _pad(r)) for i, r in enumerate(with_retry(ws_dst.get_all_values)[1:], 2)}
+    appends, updates = [], []
+    for _, r in scope:
+        rid = _row_id(r)
+        if rid not in dst_rows:
+            appends.append(r)
+        elif rid in copied and copied[rid] != r and dst_rows[rid][1] != r:
+            n = dst_rows[rid][0]
+            updates.append({"range": f"A{n}:{account_data.ROW_ID_LETTER}{n}", "values": [r]})
+    if updates:
+        with_retry(ws_dst.batch_update, updates)
+    if appends:
+        registration.append_rows_chunked(ws_dst, appends)
+    print(f"🔁 切り替え中の変更を反映しました（追加 {len(appends)} 行・更新 {len(updates)} 行）")
+
+    # 5. 移動先にある行だけを元のシートから削除。1ブロックごとに対応表の世代番号を確かめて読み直し、
+    #    行IDで行番号を引き直してから消す（読み直しから削除までの間にアプリが元のシートの行を消すと
+    #    行番号がずれるので、元のシートに書くアプリの処理が残っていないときに実行する。冒頭の説明を参照）
+    have = {_row_id(_pad(r)) for r in with_retry(ws_dst.get_all_values)[1:]}
+    deleted = 0
+    while True:
+        _check_generation(bucket, generation)
+        targets = [i for i, r in _read_scope(ws_src, router_before, code, area, src) if _row_id(r) in have]
+        if not targets:
+            break
+        start, end = contiguous_blocks(targets)[0]   # 一番下のブロック
+        with_retry(ws_src.delete_rows, start, end)
+        deleted += end - start + 1
+    print(f"🧹 元のシートから {deleted} 行を削除しました")
+
+    # 6. 移動中の印を外す
+    table, generation = load(bucket, main_id)
+    table["accounts"][code].pop("moving", None)
+    sheet_routing.save(bucket, table, generation)
+    print(f"✅ {label} を {src.shard} → {dest} へ移動しました")
+    return 0
+
+
+def main(argv=None):
+    default_secrets = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".streamlit", "secrets.toml")
+    p = argparse.ArgumentParser(description="投稿アカウントシートのシャード（振り分け先スプレッドシート）を管理します。")
+    p.add_argument("--secrets", default=default_secrets, help="secrets.toml のパス")
+    sub = p.add_subparsers(dest="command", required=True)
+    sub.add_parser("show", help="対応表を表示")
+    a = sub.add_parser("add-shard", help="振り分け先のスプレッドシートを追加")
+    a.add_argument("name")
+    a.add_argument("spreadsheet_id")
+    a = sub.add_parser("add-account", help="投稿アカウントを追加（シートとログイン情報シートも作る）")
+    a.add_argument("code")
+    a.add_argument("--shard", default="main")
+    a = sub.add_parser("move", help="アカウント（またはその1エリア）の行を別のシャードへ移す")
+    a.add_argument("--account", required=True)
+    a.add_argument("--area", help="指定するとこのエリアの行だけを移す")
+    a.add_argument("--to", required=True, help="移動先のシャード名")
+    a.add_argument("--wait", type=int, default=sheet_routing.ROUTING_MAX_AGE * 2,
+                   help="対応表を切り替えてから元の行を消すまで待つ秒数（アプリが読み直す間隔より長く）")
+    args = p.parse_args(argv)
+
+    gc, bucket, main_id = connect(args.secrets)
+    if args.command == "move":
+        with move_lock(bucket):
+            return cmd_move(gc, bucket, main_id, args.account, args.area.strip() if args.area else None, args.to, args.wait)
+    table, generation = load(bucket, main_id)
+    if args.command == "show":
+        cmd_show(table, generation)
+    elif args.command == "add-shard":
+        cmd_add_shard(bucket, table, generation, args.name, args.spreadsheet_id)
+    elif args.command == "add-account":
+        cmd_add_account(gc, bucket, table, generation, args.code, args.shard)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import json
+import time
+import threading
+from collections import namedtuple
+
+import perf
+import account_data
+
+# --- 投稿アカウントシートの振り分け（シャード） ---
+# 1つのスプレッドシートには書き込み回数の上限とセル数（1000万）の上限があるので、
+# 投稿アカウントのシートを複数のスプレッドシート（シャード）に分けて置けるようにする。
+# 「アカウント（＋必要ならエリア）→ スプレッドシート・シート名」の対応表は GCS の JSON に置き、
+# 各アプリは ROUTING_MAX_AGE 秒ごとにその場で読み直し（cached）、書き込みの直前には世代番号を確かめる（current）。
+# 対応表が無ければ従来どおり1つのスプレッドシートに A〜D。
+# シャード・アカウントの追加と、アカウント（エリア）単位の行の移動は shard_admin.py で行う。
+
+ROUTING_BLOB = "_system/sheet_routing.json"
+ROUTING_MAX_AGE = 60      # 対応表を読み直す間隔（秒）。移動コマンドはこれより長く待ってから元の行を消す
+DEFAULT_STATUS_SHEET_ID = "1_GmWjpypap4rrPGNFYWkwcQE1SoK3QOMJlozEhkBwVM"
+DEFAULT_STOCK_SHEET_ID = "1e-iLey43A1t0bIBoijaXP55t5fjONdb0ODiTS53beqM"
+
+
+class Location(namedtuple("Location", ["account", "shard", "spreadsheet_id", "worksheet"])):
+    """1アカウント分の行が置かれている場所"""
+    __slots__ = ()
+
+    @property
+    def snapshot_key(self):
+        # アプリのスナップショットキャッシュと同じキー（従来の f"sheet:{SHEET_ID}:{シート名}"）
+        return f"sheet:{self.spreadsheet_id}:{self.worksheet}"
+
+
+def default_table(main_id):
+    """対応表が無いときの構成：1つのスプレッドシートに A〜D"""
+    return {
+        "version": 1,
+        "shards": {"main": main_id},
+        "home": "main",                       # 店舗アカウント集計シートを置くシャード
+        "status_sheet": DEFAULT_STATUS_SHEET_ID,
+        "stock_sheet": DEFAULT_STOCK_SHEET_ID,
+        "accounts": {code: {"shard": "main", "sheet": name} for code, name in account_data.SHEET_MAP.items()},
+    }
+
+
+def validate(table):
+    """対応表の整合性チェック。問題があれば ValueError"""
+    shards = table.get("shards") or {}
+    if table.get("home") not in shards:
+        raise ValueError(f"home のシャード '{table.get('home')}' がありません")
+    used = set()
+    for code, conf in (table.get("accounts") or {}).items():
+        for area, shard in [(None, conf.get("shard"))] + list((conf.get("areas") or {}).items()):
+            if shard not in shards:
+                raise ValueError(f"アカウント {code}{f'（{area}）' if area else ''} のシャード '{shard}' がありません")
+            place = (shard, conf.get("sheet") or sheet_name(code))
+            if place in used and area is None:
+                raise ValueError(f"シート {place[1]}（{shard}）が複数のアカウントに割り当てられています")
+            used.add(place)
+    return table
+
+
+def sheet_name(code):
+    return f"投稿{code}アカウント"
+
+
+class SheetRouter:
+    """対応表を引くだけの読み取り専用オブジェクト"""
+
+    def __init__(self, table, generation=None):
+        self.table = validate(table)
+        self.generation = generation
+
+    @property
+    def accounts(self):
+        return list(self.table["accounts"])
+
+    @property
+    def sheet_map(self):
+        """{アカウント: シート名}（ログイン情報のスプレッドシートも同じシート名）"""
+        return {code: conf.get("sheet") or sheet_name(code) for code, conf in self.table["accounts"].items()}
+
+    def shard_id(self, shard):
+        return self.table["shards"][shard]
+
+    @property
+    def home_id(self):
+        return self.shard_id(self.table["home"])
+
+    @property
+    def status_id(self):
+        return self.table.get("status_sheet") or DEFAULT_STATUS_SHEET_ID
+
+    @property
+    def stock_id(self):
+        return self.table.get("stock_sheet") or DEFAULT_STOCK_SHEET_ID
+
+    def has_area_routes(self, code):
+        return bool(self.table["accounts"][code].get("areas"))
+
+    def location(self, code, area=None):
+        """アカウント（とエリア）の行を読み書きする場所"""
+        conf = self.table["accounts"][code]
+        shard = conf["shard"]
+        if area is not None:
+            shard = (conf.get("areas") or {}).get(str(area).strip(), shard)
+        return Location(code, shard, self.shard_id(shard), conf.get("sheet") or sheet_name(code))
+
+    def locations(self, code):
+        """アカウントの行が置かれうる場所すべて（既定のシャード＋エリア別のシャード）"""
+        conf = self.table["accounts"][code]
+        shards = [conf["shard"]] + [s for s in (conf.get("areas") or {}).values() if s != conf["shard"]]
+        return [Location(code, s, self.shard_id(s), conf.get("sheet") or sheet_name(code)) for s in dict.fromkeys(shards)]
+
+    def all_locations(self, codes=None):
+        return [loc for code in (codes or self.accounts) for loc in self.locations(code)]
+
+
+# --- 対応表の読み書き（GCS） ---
+def load_table(bucket, main_id):
+    """{"table": 対応表, "generation": 世代番号}。対応表がまだ無ければ既定の構成（世代番号 None）"""
+    blob = perf.call("gcs.get_blob", ROUTING_BLOB, bucket.get_blob, ROUTING_BLOB)
+    if blob is None:
+        return {"table": default_table(main_id), "generation": None}
+    return {"table": json.loads(perf.call("gcs.download", ROUTING_BLOB, blob.download_as_bytes)), "generation": blob.generation}
+
+
+def load(bucket, main_id):
+    loaded = load_table(bucket, main_id)
+    return SheetRouter(loaded["table"], loaded["generation"])
+
+
+def save(bucket, table, generation):
+    """読み込んだときの世代番号のまま上書きする（他の変更と競合したら PreconditionFailed）。新しい世代番号を返す"""
+    validate(table)
+    blob = bucket.blob(ROUTING_BLOB)
+    perf.call("gcs.upload", ROUTING_BLOB, blob.upload_from_string, json.dumps(table, ensure_ascii=False, indent=1),
+              content_type="application/json", if_generation_match=generation or 0)
+    return blob.generation
+
+
+# --- アプリ用のキャッシュ ---
+# 対応表はディスクに残さず、期限切れの値を先に返して裏で読み直すこともしない（古い対応表のまま別のシャードへ書き込まないように）
+_cache = {}               # {既定のスプレッドシートID: (読み込んだ時刻, SheetRouter)}
+_cache_lock = threading.Lock()
+
+
+def _remember(main_id, router):
+    with _cache_lock:
+        _cache[main_id] = (time.time(), router)
+    return router
+
+
+def cached(bucket, main_id, max_age=ROUTING_MAX_AGE):
+    """max_age 秒だけプロセス内に持つ SheetRouter。期限が切れていればその場で読み直す"""
+    with _cache_lock:
+        hit = _cache.get(main_id)
+    if hit and time.time() - hit[0] < max_age:
+        return hit[1]
+    return _remember(main_id, load(bucket, main_id))
+
+
+def current(router, bucket, main_id):
+    """書き込み直前の確認。対応表の世代番号が変わっていれば読み直した SheetRouter、同じなら router をそのまま返す"""
+    blob = perf.call("gcs.get_blob", ROUTING_BLOB, bucket.get_blob, ROUTING_BLOB)
+    if (blob.generation if blob else None) == router.generation:
+        return router
+    return _remember(main_id, load(bucket, main_id))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# --- 読み込み ---
+def read_locations(open_spreadsheet, locations, cell_range=None):
+    """複数シャードのシートを読む。スプレッドシートごとに values_batchGet 1回、スプレッドシート同士は並列。
+    {Location: 行リスト}（読めなかった場所は例外オブジェクト）"""
+    by_sid = {}
+    for loc in locations:
+        by_sid.setdefault(loc.spreadsheet_id, []).append(loc)
+    results = account_data.fan_out(
+        lambda sid: account_data.read_sheets(open_spreadsheet(sid), [loc.worksheet for loc in by_sid[sid]], cell_range), by_sid)
+    out = {}
+    for sid, locs in by_sid.items():
+        res = results[sid]
+        for loc in locs:
+            out[loc] = res if isinstance(res, Exception) else res.get(loc.worksheet)
+    return out
+
+
+def account_frame(router, code, rows_by_loc):
+    """1アカウント分の DataFrame。複数シャードにまたがるときは、対応表でその場所に割り当てられたエリアの行だけを使う
+    （移動の途中で両方に同じ行があっても二重に数えない）"""
+    frames = []
+    for loc in router.locations(code):
+        rows = rows_by_loc.get(loc)
+        if not isinstance(rows, list):
+            continue
+        df = account_data.frame_for(code, rows, slot=loc)
+        if router.has_area_routes(code):
+            owned = [a for a in df["エリア"].unique() if router.location(code, a) == loc]
+            df = df[df["エリア"].isin(owned)]
+        frames.append(df)
+    return account_data.combine_frames(frames)
+
+
+def all_frames(router, rows_by_loc):
+    """全アカウント分の DataFrame"""
+    return account_data.combine_frames([account_frame(router, code, rows_by_loc) for code in router.accounts])
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+# --- シート・画像一覧のスナップショットキャッシュ（ディスク永続） ---
+# st.cache_data はプロセスのメモリにしか残らないため、再起動・再デプロイ・スリープ復帰のたびに
+# 全シートの読み直しとバケットの一覧取得が走る。ここでは取得結果を SQLite に列指向・zlib圧縮で保存し、
+# 起動直後はディスクの最終スナップショットをすぐ返しつつ、裏で最新に取り直す（stale-while-revalidate）。
+
+SCHEMA_VERSION = 1
+CACHE_DIR = os.environ.get("DIARY_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot_cache"))
+
+
+def encode(value):
+    """2次元のセル値は列ごとにまとめて圧縮率を上げる（同じ列は似た値が続くため）"""
+    if isinstance(value, list) and value and all(isinstance(r, list) for r in value):
+        width = max(len(r) for r in value)
+        doc = {"t": "table", "lens": [len(r) for r in value],
+               "cols": [[r[j] if j < len(r) else "" for r in value] for j in range(width)]}
+    else:
+        doc = {"t": "json", "v": value}
+    return zlib.compress(json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def decode(payload):
+    doc = json.loads(zlib.decompress(payload).decode("utf-8"))
+    if doc["t"] == "table":
+        cols = doc["cols"]
+        return [[cols[j][i] for j in range(n)] for i, n in enumerate(doc["lens"])]
+    return doc["v"]
+
+
+class SnapshotCache:
+    """メモリ + SQLite の2段キャッシュ。get() に取得関数を渡して使う"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self._mem = {}
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._min_fetched_at = 0.0
+        self._db = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(cache_dir, "snapshots.sqlite3"), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS snapshots (
+                key TEXT PRIMARY KEY, schema INTEGER, fetched_at REAL, digest TEXT, size INTEGER, payload BLOB)""")
+            self._db.commit()
+        except (OSError, sqlite3.Error):
+            # 書き込めない環境ではメモリキャッシュだけで動かす
+            self._db = None
+
+    # --- ディスク ---
+    def _read_disk(self, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT schema, fetched_at, payload FROM snapshots WHERE key=?", (key,)).fetchone()
+        if row is None or row[0] != SCHEMA_VERSION:
+            return None
+        try:
+            return {"value": decode(row[2]), "fetched_at": row[1], "from_disk": True}
+        except Exception:
+            return None
+
+    def _write_disk(self, key, value, fetched_at):
+        if self._db is None:
+            return
+        payload = encode(value)
+        with self._lock:
+            try:
+                self._db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)",
+                                 (key, SCHEMA_VERSION, fetched_at, hashlib.sha1(payload).hexdigest(), len(payload), payload))
+                self._db.commit()
+            except sqlite3.Error:
+                pass
+
+    # --- 取得 ---
+    def _load(self, key, loader):
+        value = loader()
+        entry = {"value": value, "fetched_at": time.time(), "from_disk": False}
+        with self._lock:
+            self._mem[key] = entry
+        self._write_disk(key, value, entry["fetched_at"])
+        return value
+
+    def _revalidate_async(self, key, loader):
+        with self._lock:
+            if key in self._inflight:
+                return
+            self._inflight.add(key)
+
+        def work():
+            try:
+                self._load(key, loader)
+            except Exception:
+                pass  # 取り直しに失敗したら古いスナップショットのまま
+            finally:
+                with self._lock:
+                    self._inflight.discard(key)
+
+        threading.Thread(target=work, daemon=True, name=f"revalidate:{key}").start()
+
+    def get(self, key, loader, max_age):
+        """キャッシュ済みなら即返す。古い・ディスク由来なら裏で取り直す。無ければその場で取得"""
+        with self._lock:
+            entry = self._mem.get(key)
+        if entry is None:
+            entry = self._read_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self._mem.setdefault(key, entry)
+        if entry is None:
+            return self._load(key, loader)
+        if entry["fetched_at"] < self._min_fetched_at:
+            # 「更新」ボタン後は最新を待つ。取得できなければ手元のスナップショットを返す
+            try:
+                return self._load(key, loader)
+            except Exception:
+                return entry["value"]
+        if entry["from_disk"] or time.time() - entry["fetched_at"] >= max_age:
+            self._revalidate_async(key, loader)
+        return entry["value"]
+
+    def peek(self, key, max_age):
+        """取り直しが不要なスナップショットがあるか（get と同じ基準：「更新」後に取得済み・max_age 以内・ディスク由来でない）"""
+        with self._lock:
+            entry = self._mem.get(key)
+        if entry is None or entry["from_disk"]:
+            return False
+        return entry["fetched_at"] >= self._min_fetched_at and time.time() - entry["fetched_at"] < max_age
+
+    def put(self, key, value):
+        """まとめて取得した結果を直接書き込む"""
+        entry = {"value": value, "fetched_at": time.time(), "from_disk": False}
+        with self._lock:
+            self._mem[key] = entry
+        self._write_disk(key, value, entry["fetched_at"])
+
+    def forget(self, key):
+        """1件だけ捨てる（次回アクセス時にその場で取り直す）"""
+        with self._lock:
+            self._mem.pop(key, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM snapshots WHERE key=?", (key,))
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+
+    def invalidate(self):
+        """これ以前に取得したものは、次回アクセス時に取り直す"""
+        self._min_fetched_at = time.time()
+
+    def age(self, key):
+        with self._lock:
+            entry = self._mem.get(key)
+        return None if entry is None else time.time() - entry["fetched_at"]
+
+
+SNAPSHOTS = SnapshotCache()
@@ -0,0 +1,378 @@
+import io
+import os
+import re
+import json
+import uuid
+import threading
+from datetime import datetime, timedelta, timezone
+
+import perf
+from retire_jobs import contiguous_blocks
+
+# --- 使用可能日記文（ストックシート）のアーカイブ ---
+# 落ち店移動のたびにストックシートへ行が増え続けるので、使用済み・古い行を日付パーティションの
+# Parquet（zstd圧縮）へ移してシートを小さく保つ。パーティションごとのキーワード・文字数の索引を持ち、
+# 検索は文字数の範囲と「含まれる文字」で読まなくてよいパーティションを外し、残りを語を多く含みそうな順に読む。
+# 復元は使用済みの印を消してシートへ書き戻し、アーカイブから消す。
+#
+#   {ROOT}dt=2026-10-19/part-153012-1a2b3c.parquet
+#   {ROOT}index.json   {"partitions": {パス: {...}}, "keywords": {語: [パス, ...]}}
+#   {ROOT}restore-pending/{id}.json   シートへの書き戻しが済んでいない復元（次の復元の前に続きを入れる）
+
+ROOT = "_system/stock_archive/"
+INDEX_NAME = ROOT + "index.json"
+PENDING_PREFIX = ROOT + "restore-pending/"
+TITLE_COL, BODY_COL = 2, 3          # ストックシートの C列=タイトル, D列=本文（A・B列は使用済みの印など）
+SHEET_WIDTH = 4
+ARCHIVE_COLS = ["A", "B", "タイトル", "本文"]
+KEEP_ROWS = 3000                    # シートに残す最新行数の既定値
+MAX_KEYWORDS_PER_PARTITION = 400    # パーティションごとに索引へ載せる語の上限（出現数の多い順）
+APPEND_CHUNK = 200
+JST = timezone(timedelta(hours=9))
+
+_TOKEN_RE = re.compile(r"[一-龥々]{2,}|[ァ-ヴー]{2,}|[A-Za-z0-9]{3,}")
+
+
+def tokens(text):
+    """索引用の語（漢字・カタカナ2文字以上の連なりと英数字3文字以上）"""
+    return {t.lower() for t in _TOKEN_RE.findall(str(text))}
+
+
+class WriteConflict(Exception):
+    """世代番号つきの書き込みで、読み込んだ後に他のセッションが書き換えていた"""
+
+
+# --- 保存先（GCSバケット or ローカルフォルダ） ---
+# read_versioned / write(if_generation_match=...) は索引の上書き競合を防ぐ用（世代番号 0 は「まだ無いこと」）
+class BucketStore:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def read(self, name):
+        return self.read_versioned(name)[0]
+
+    def read_versioned(self, name):
+        blob = perf.call("gcs.get_blob", name, self.bucket.get_blob, name)
+        if blob is None:
+            return None, None
+        return perf.call("gcs.download", name, blob.download_as_bytes), blob.generation
+
+    def write(self, name, data, content_type="application/octet-stream", if_generation_match=None):
+        from google.api_core.exceptions import PreconditionFailed
+        blob = self.bucket.blob(name)
+        extra = {} if if_generation_match is None else {"if_generation_match": if_generation_match}
+        try:
+            perf.call("gcs.upload", name, blob.upload_from_string, data, content_type=content_type, **extra)
+        except PreconditionFailed as e:
+            raise WriteConflict(name) from e
+        return blob.generation
+
+    def delete(self, name):
+        perf.call("gcs.delete", name, self.bucket.blob(name).delete)
+
+    def list(self, prefix):
+        return [b.name for b in perf.call("gcs.list_blobs", prefix, lambda: list(self.bucket.list_blobs(prefix=prefix)))]
+
+
+class LocalStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _path(self, name):
+        return os.path.join(self.root_dir, *name.split("/"))
+
+    def _generation(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def read(self, name):
+        return self.read_versioned(name)[0]
+
+    def read_versioned(self, name):
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                return f.read(), self._generation(path)
+        except FileNotFoundError:
+            return None, None
+
+    def write(self, name, data, content_type=None, if_generation_match=None):
+        path = self._path(name)
+        if if_generation_match is not None and self._generation(path) != if_generation_match:
+            raise WriteConflict(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        return self._generation(path)
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        out = []
+        for dirpath, _, files in os.walk(self.root_dir):
+            for fn in files:
+                name = os.path.relpath(os.path.join(dirpath, fn), self.root_dir).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    out.append(name)
+        return sorted(out)
+
+
+# --- Parquet の読み書き ---
+def _to_parquet(rows, archived_at):
+    """archived_at は全行共通の時刻か、行ごとの時刻のリスト"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    cols = {c: [r[j] if j < len(r) else "" for r in rows] for j, c in enumerate(ARCHIVE_COLS)}
+    table = pa.table({
+        **{c: pa.array(v, type=pa.string()) for c, v in cols.items()},
+        "文字数": pa.array([len(b) for b in cols["本文"]], type=pa.int32()),
+        "archived_at": pa.array(archived_at if isinstance(archived_at, list) else [archived_at] * len(rows), type=pa.float64()),
+    })
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression="zstd")
+    return buf.getvalue()
+
+
+def _from_parquet(data):
+    import pyarrow.parquet as pq
+    return pq.read_table(io.BytesIO(data)).to_pandas()
+
+
+class StockArchive:
+    """アーカイブの作成・検索・復元（プロセス内で1つ作って共有する）"""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._index = None
+        self._generation = None
+        self._pending = []   # 保存前の索引の変更（保存が競合したら最新を読み直して再適用する）
+
+    # --- 索引 ---
+    @property
+    def index(self):
+        if self._index is None:
+            self._load_index()
+        return self._index
+
+    def _load_index(self):
+        raw, self._generation = self.store.read_versioned(INDEX_NAME)
+        self._index = json.loads(raw) if raw else {"partitions": {}, "keywords": {}}
+
+    def _save_index(self, retries=3):
+        """読み込んだときの世代番号のまま上書きする。他のセッションが先に保存していたら読み直して変更を再適用"""
+        for _ in range(retries):
+            try:
+                self._generation = self.store.write(INDEX_NAME, json.dumps(self.index, ensure_ascii=False), "application/json",
+                                                    if_generation_match=self._generation or 0)
+                self._pending = []
+                return
+            except WriteConflict:
+                pending = self._pending
+                self._load_index()
+                for op in pending:
+                    self._apply(*op)
+                self._pending = pending
+        raise RuntimeError("アーカイブの索引の保存が競合しました。時間をおいて再実行してください。")
+
+    def _apply(self, op, path=None, meta=None, words=None):
+        idx = self.index
+        if op == "reset":
+            idx["partitions"], idx["keywords"] = {}, {}
+        elif op == "put":
+            idx["partitions"][path] = meta
+            for t in words:
+                paths = idx["keywords"].setdefault(t, [])
+                if path not in paths:
+                    paths.append(path)
+        elif op == "drop":
+            idx["partitions"].pop(path, None)
+            for t in list(idx["keywords"]):
+                paths = [p for p in idx["keywords"][t] if p != path]
+                if paths: idx["keywords"][t] = paths
+                else: del idx["keywords"][t]
+
+    def _change(self, *op):
+        self._apply(*op)
+        self._pending.append(op)
+
+    def _index_partition(self, path, df):
+        texts = df["タイトル"] + " " + df["本文"]
+        meta = {
+            "dt": path[len(ROOT):].split("/")[0][3:], "rows": int(len(df)),
+            "min_len": int(df["文字数"].min()) if len(df) else 0, "max_len": int(df["文字数"].max()) if len(df) else 0,
+            # パーティションに出てくる文字の一覧（部分一致の検索語に無い文字があれば、そのパーティションは読まない）
+            "chars": "".join(sorted(set("".join(texts)))),
+        }
+        counts = {}
+        for text in texts:
+            for t in tokens(text):
+                counts[t] = counts.get(t, 0) + 1
+        self._change("put", path, meta, sorted(counts, key=counts.get, reverse=True)[:MAX_KEYWORDS_PER_PARTITION])
+
+    def _unindex_partition(self, path):
+        self._change("drop", path)
+
+    def rebuild_index(self):
+        """パーティションを全部読み直して索引を作り直す"""
+        with self._lock:
+            self._change("reset")
+            for path in self.store.list(ROOT):
+                if path.endswith(".parquet"):
+                    self._index_partition(path, _from_parquet(self.store.read(path)))
+            self._save_index()
+
+    def stats(self):
+        parts = self.index["partitions"]
+        return {"partitions": len(parts), "rows": sum(p["rows"] for p in parts.values())}
+
+    # --- アーカイブ ---
+    @staticmethod
+    def select_rows(rows, keep_rows=KEEP_ROWS):
+        """アーカイブ対象の行番号（1始まり, ヘッダー除く）：A・B列に値がある使用済み行と、最新 keep_rows 行より古い行"""
+        body = rows[1:]
+        cutoff = max(0, len(body) - keep_rows)
+        picked = []
+        for i, r in enumerate(body):
+            used = any(str(c).strip() for c in r[:TITLE_COL])
+            has_text = any(str(c).strip() for c in r[TITLE_COL:SHEET_WIDTH])
+            if has_text and (used or i < cutoff):
+                picked.append(i + 2)
+        return picked
+
+    def archive_from_sheet(self, ws, keep_rows=KEEP_ROWS, progress=None):
+        """ストックシートの対象行を Parquet へ移し、シートから削除する。移した行数を返す
+        先にアーカイブと索引を保存してから削除するので、途中で止まっても行が消えることはない"""
+        with self._lock:
+            rows = perf.call("sheets.get_all_values", ws.title, ws.get_all_values)
+            targets = self.select_rows(rows, keep_rows)
+            if not targets:
+                return 0
+            picked = [(rows[i - 1] + [""] * SHEET_WIDTH)[:SHEET_WIDTH] for i in targets]
+            now = datetime.now(JST)
+            path = f"{ROOT}dt={now:%Y-%m-%d}/part-{now:%H%M%S}-{uuid.uuid4().hex[:6]}.parquet"
+            data = _to_parquet(picked, now.timestamp())
+            self.store.write(path, data)
+            self._index_partition(path, _from_parquet(data))
+            self._save_index()
+
+            # 読み込み後に行が増減していても、内容が一致する行だけを消す（落ち店移動と同じ考え方）
+            current = perf.call("sheets.get_all_values", ws.title, ws.get_all_values)
+            remaining = {}
+            for r in picked:
+                remaining[tuple(r)] = remaining.get(tuple(r), 0) + 1
+            delete = []
+            for i, r in enumerate(current[1:], 2):
+                key = tuple((r + [""] * SHEET_WIDTH)[:SHEET_WIDTH])
+                if remaining.get(key):
+                    remaining[key] -= 1
+                    delete.append(i)
+            blocks = contiguous_blocks(delete)
+            for n, (start, end) in enumerate(blocks, 1):
+                perf.call("sheets.delete_rows", ws.title, ws.delete_rows, start, end)
+                if progress:
+                    progress(n, len(blocks))
+            return len(picked)
+
+    # --- 検索 ---
+    def candidate_partitions(self, query="", min_len=None, max_len=None):
+        """読む順のパーティション。索引の文字数の最小・最大が範囲外のもの、検索語の文字を含まないものは読まない。
+        キーワードの索引は並べ替えにだけ使う（索引は上位の語だけで、検索は部分一致なので
+        「カフェ」で「カフェラテ」の行もヒットする。索引で絞ると取りこぼす）"""
+        parts = self.index["partitions"]
+        paths = set(parts)
+        if min_len is not None:
+            paths = {p for p in paths if parts[p]["max_len"] >= min_len}
+        if max_len is not None:
+            paths = {p for p in paths if parts[p]["min_len"] <= max_len}
+        needed = set("".join(query.split()))
+        if needed:
+            # 文字の一覧が無い（古い索引の）パーティションは外さない
+            paths = {p for p in paths if "chars" not in parts[p] or needed <= set(parts[p]["chars"])}
+        score = {}
+        for t in (tokens(query) if query else set()):
+            for p in self.index["keywords"].get(t, []):
+                score[p] = score.get(p, 0) + 1
+        # 語を多く含むパーティション → 新しいパーティションの順
+        return sorted(sorted(paths, reverse=True), key=lambda p: score.get(p, 0), reverse=True)
+
+    def search(self, query="", min_len=None, max_len=None, limit=500):
+        """タイトル・本文の部分一致と文字数で検索。結果は __part__（パーティション）・__idx__（行位置）列付き"""
+        import pandas as pd
+        frames = []
+        total = 0
+        for path in self.candidate_partitions(query, min_len, max_len):
+            df = _from_parquet(self.store.read(path))
+            df["__part__"], df["__idx__"] = path, range(len(df))
+            mask = pd.Series(True, index=df.index)
+            if query:
+                for word in query.split():
+                    mask &= df["タイトル"].str.contains(word, regex=False) | df["本文"].str.contains(word, regex=False)
+            if min_len is not None:
+                mask &= df["文字数"] >= min_len
+            if max_len is not None:
+                mask &= df["文字数"] <= max_len
+            hit = df[mask]
+            frames.append(hit)
+            total += len(hit)
+            if total >= limit:
+                break
+        if not frames:
+            return pd.DataFrame(columns=ARCHIVE_COLS + ["文字数", "archived_at", "__part__", "__idx__"])
+        return pd.concat(frames, ignore_index=True).head(limit)
+
+    # --- 復元 ---
+    def restore(self, ws, selection, on_chunk=None):
+        """selection（search() の結果の一部）をシートへ書き戻し、アーカイブから取り除く。復元した行数を返す
+        A・B列（使用済みの印）は空にして戻す（印が残ったままだと使えず、次のアーカイブでまた移される）
+        書き戻す行を先に restore-pending へ保存し、パーティションと索引を書き換えてからシートへ追記する
+        （途中で止まっても行は restore-pending に残り、次の復元の前に続きを入れる）"""
+        import registration
+        if len(selection) == 0:
+            return 0
+        with self._lock:
+            self._resume_pending(ws)
+            rows = [["", "", t, b] for t, b in selection[["タイトル", "本文"]].astype(str).values.tolist()]
+            pending = f"{PENDING_PREFIX}{uuid.uuid4().hex}.json"
+            self.store.write(pending, json.dumps({"rows": rows}, ensure_ascii=False), "application/json")
+            for path, part in selection.groupby("__part__"):
+                df = _from_parquet(self.store.read(path))
+                keep = df.drop(index=[i for i in part["__idx__"] if i in df.index])
+                self._unindex_partition(path)
+                if keep.empty:
+                    self.store.delete(path)
+                else:
+                    data = _to_parquet(keep[ARCHIVE_COLS].values.tolist(), keep["archived_at"].tolist())
+                    self.store.write(path, data)
+                    self._index_partition(path, _from_parquet(data))
+            self._save_index()
+            registration.append_rows_chunked(ws, rows, chunk=APPEND_CHUNK, on_chunk=on_chunk)
+            self.store.delete(pending)
+            return len(rows)
+
+    def _resume_pending(self, ws):
+        """前回の復元でシートへの追記が済まなかった行を入れる（途中まで入っていた行は内容で照合して飛ばす）"""
+        import registration
+        names = [n for n in self.store.list(PENDING_PREFIX) if n.endswith(".json")]
+        if not names:
+            return
+        present = {}
+        for r in perf.call("sheets.get_all_values", ws.title, ws.get_all_values)[1:]:
+            key = tuple((r + [""] * SHEET_WIDTH)[TITLE_COL:SHEET_WIDTH])
+            present[key] = present.get(key, 0) + 1
+        for name in names:
+            todo = []
+            for r in json.loads(self.store.read(name))["rows"]:
+                key = tuple(r[TITLE_COL:SHEET_WIDTH])
+                if present.get(key):
+                    present[key] -= 1
+                else:
+                    todo.append(r)
+            registration.append_rows_chunked(ws, todo, chunk=APPEND_CHUNK)
+            self.store.delete(name)
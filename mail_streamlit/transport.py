@@ -0,0 +1,174 @@
+import os
+import time
+import threading
+
+# --- Sheets / GCS 共通の HTTP 接続 ---
+# 3つのアプリと一括登録コマンドが、同じサービスアカウントの認証情報（1つ）と、
+# プロセス内で共有する keep-alive の接続プールを使う。プールの大きさは並列処理のワーカー数に合わせ、
+# 空き待ち時間・新規接続数・トークン更新回数を計測する（?debug=1 でサイドバーに表示）。
+# requests（urllib3）は HTTP/2 に対応していないため HTTP/1.1 の keep-alive で接続を使い回す。
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+    "https://www.googleapis.com/auth/cloud-platform",
+]
+# 1ホストあたりの同時接続数（account_data.fan_out=8, 一括登録のアップロード=8, 落ち店移動=3 を同時に捌ける数）
+POOL_SIZE = int(os.environ.get("DIARY_HTTP_POOL_SIZE", "20"))
+CONNECT_RETRIES = 3
+
+_lock = threading.Lock()
+_shared = {}      # {client_email: {"creds": ..., "sessions": {名前: session}}}
+
+
+class PoolStats:
+    """接続プールの利用状況（全セッション合計）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waited = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.token_refreshes = 0
+
+    def acquired(self, wait_ms):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if wait_ms >= 1:
+                self.waited += 1
+                self.wait_ms += wait_ms
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def released(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def refreshed(self):
+        with self._lock:
+            self.token_refreshes += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {k: v for k, v in vars(self).items() if not k.startswith("_")}
+
+
+STATS = PoolStats()
+
+
+def _adapter_class():
+    from requests.adapters import HTTPAdapter
+
+    class PooledAdapter(HTTPAdapter):
+        """プールが埋まっているときは空くまで待ち、その待ち時間を記録する"""
+
+        def __init__(self, pool_size):
+            from urllib3.util.retry import Retry
+            self._slots = threading.BoundedSemaphore(pool_size)
+            # 接続確立の失敗だけ再試行（送信済みのリクエストは二重に送らない）
+            super().__init__(pool_connections=4, pool_maxsize=pool_size, pool_block=True,
+                             max_retries=Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, status=0,
+                                               other=0, backoff_factor=0.5, raise_on_status=False))
+
+        def send(self, request, **kwargs):
+            t0 = time.perf_counter()
+            self._slots.acquire()
+            STATS.acquired((time.perf_counter() - t0) * 1000)
+            try:
+                return super().send(request, **kwargs)
+            finally:
+                STATS.released()
+                self._slots.release()
+
+        def connections_opened(self):
+            return sum(getattr(pool, "num_connections", 0) for pool in self.poolmanager.pools._container.values())
+
+    return PooledAdapter
+
+
+def _share_refresh(creds):
+    """複数スレッド・複数セッションから同時に期限切れを検知しても、トークン更新は1回だけ行う"""
+    original = creds.refresh
+    lock = threading.Lock()
+
+    def refresh(request):
+        token_before = creds.token
+        with lock:
+            if creds.token != token_before and creds.valid:
+                return  # 待っている間に他のスレッドが更新済み
+            original(request)
+            STATS.refreshed()
+
+    creds.refresh = refresh
+    return creds
+
+
+def _entry(info):
+    key = info["client_email"]
+    with _lock:
+        entry = _shared.get(key)
+        if entry is None:
+            from google.oauth2.service_account import Credentials
+            creds = _share_refresh(Credentials.from_service_account_info(dict(info), scopes=SCOPES))
+            entry = _shared[key] = {"creds": creds, "sessions": {}}
+        return entry
+
+
+def session(info, name):
+    """name（"sheets" / "storage"）ごとに1つの認証付きセッションを作って使い回す"""
+    entry = _entry(info)
+    with _lock:
+        s = entry["sessions"].get(name)
+        if s is None:
+            from google.auth.transport.requests import AuthorizedSession
+            s = AuthorizedSession(entry["creds"])
+            adapter = _adapter_class()(POOL_SIZE)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            entry["sessions"][name] = s
+        return s
+
+
+def gspread_client(info):
+    import gspread
+    return gspread.Client(auth=_entry(info)["creds"], session=session(info, "sheets"))
+
+
+def storage_client(info):
+    from google.cloud import storage
+    return storage.Client(project=info.get("project_id"), credentials=_entry(info)["creds"], _http=session(info, "storage"))
+
+
+def pool_report():
+    """プール統計 + セッションごとの新規接続数"""
+    report = STATS.snapshot()
+    with _lock:
+        sessions = {name: s for entry in _shared.values() for name, s in entry["sessions"].items()}
+    report["connections"] = {}
+    for name, s in sessions.items():
+        adapter = s.get_adapter("https://")
+        try:
+            report["connections"][name] = adapter.connections_opened()
+        except Exception:
+            report["connections"][name] = None
+    report["pool_size"] = POOL_SIZE
+    return report
+
+
+def render_pool_panel(st):
+    """スクリプト末尾で呼ぶ。?debug=1 のときサイドバーに接続プールの状況を表示"""
+    import perf
+    if not perf.debug_enabled(st):
+        return
+    r = pool_report()
+    with st.sidebar.expander("🔌 HTTP接続プール", expanded=False):
+        st.text(f"{'リクエスト':<10}{r['requests']:>8}")
+        st.text(f"{'新規接続':<10}{sum(n or 0 for n in r['connections'].values()):>8}  {r['connections']}")
+        st.text(f"{'同時最大':<10}{r['peak_in_flight']:>8} / {r['pool_size']}")
+        avg = r["wait_ms"] / r["waited"] if r["waited"] else 0
+        st.text(f"{'空き待ち':<10}{r['waited']:>8} 回（平均 {avg:.0f} ms・最大 {r['max_wait_ms']:.0f} ms）")
+        st.text(f"{'トークン更新':<9}{r['token_refreshes']:>8}")